@@ -0,0 +1,111 @@
+"""
+Бот для замеров: настоящие обработчики, база и FSM, подмененный Bot API.
+
+Bot.request не ходит в Telegram, а через api_latency секунд возвращает
+правдоподобный ответ, поэтому замеры показывают стоимость самого бота
+при заданной задержке Bot API.
+"""
+import asyncio
+import functools
+import os
+import random
+import sqlite3
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+import _common  # noqa: F401
+from aiogram.bot import base
+
+import db
+import main
+from catalog_index import catalog
+from render import DEPTHS, FEATURES, GENRES
+from title_index import titles
+
+
+def create_bot_app(directory, api_latency=0.0, **config):
+    """
+    Создает приложение main.create_app с базой и FSM в directory.
+
+    Args:
+        directory (str): Каталог для файлов базы, FSM и журнала отзывов.
+        api_latency (float): Задержка ответа подмененного Bot API, в секундах.
+        **config: Переопределения ключей main.DEFAULT_CONFIG.
+
+    Returns:
+        Dispatcher: Диспетчер приложения.
+    """
+    async def fake_request(bot, method, data=None, files=None, **kwargs):
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int((data or {}).get('chat_id') or 0)
+            return {'message_id': 1, 'date': 0, 'text': (data or {}).get('text', ''),
+                    'chat': {'id': chat_id, 'type': 'private'}}
+        return True
+
+    base.BaseBot.request = fake_request
+    # Индексы - синглтоны процесса: строим их по базе этого прогона
+    catalog._loaded = False
+    titles._loaded = False
+    return main.create_app({
+        'api_token': '123:benchmark',
+        'db_path': os.path.join(directory, 'bot.db'),
+        # Диалоги замеров всегда находят тайтлы, но в сеть бот не пойдет и по ошибке
+        'deepseek_api_url': 'http://127.0.0.1:9/chat/completions',
+        'deepseek_cache_path': None,
+        'fsm_storage': 'sqlite',
+        'fsm_storage_options': {'path': os.path.join(directory, 'fsm.db')},
+        'feedback_dead_letter_path': os.path.join(directory, 'dead_letter.jsonl'),
+        'metrics_port': None,
+        **config,
+    })
+
+
+def _user(chat_id):
+    return {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+
+
+def message_update(update_id, chat_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': _user(chat_id),
+    }}
+
+
+def callback_update(update_id, chat_id, data):
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': str(chat_id), 'data': data, 'from': _user(chat_id),
+        'message': {'message_id': 1, 'date': 0, 'text': '...', 'chat': {'id': chat_id, 'type': 'private'}},
+    }}
+
+
+@functools.lru_cache(maxsize=None)
+def dialog_choices():
+    """Сочетания (жанр, глубина, особенность) из кнопок диалога, под которые в стартовом каталоге есть тайтлы."""
+    conn = sqlite3.connect(':memory:')
+    try:
+        db.init_db(conn)
+        rows = conn.execute('SELECT genre, depth, features FROM content').fetchall()
+    finally:
+        conn.close()
+    genres = {value for _, value in GENRES}
+    depths = {value for _, value in DEPTHS}
+    features = {value for _, value in FEATURES}
+    return sorted({
+        (genre, depth, feature)
+        for genre_tags, depth, feature_tags in rows if depth in depths
+        for genre in db.split_tags(genre_tags) if genre in genres
+        for feature in db.split_tags(feature_tags) if feature in features
+    })
+
+
+def dialog_updates(chat_id, first_update_id, rng=random):
+    """Апдейты одного диалога подбора в JSON: запрос, жанр, глубина, особенность, непонятная фраза."""
+    genre, depth, feature = rng.choice(dialog_choices())
+    return [
+        message_update(first_update_id, chat_id, 'Хочу посмотреть фильм'),
+        callback_update(first_update_id + 1, chat_id, f'genre_{genre}'),
+        callback_update(first_update_id + 2, chat_id, f'depth_{depth}'),
+        callback_update(first_update_id + 3, chat_id, f'feature_{feature}'),
+        message_update(first_update_id + 4, chat_id, 'Привет, как дела?'),
+    ]
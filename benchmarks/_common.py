@@ -0,0 +1,42 @@
+"""Общие помощники замеров: путь к модулям бота, таймер и перцентили."""
+import os
+import sys
+import time
+
+# Модули бота лежат в корне репозитория, а не в пакете
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу: percentile(latencies, 0.99)."""
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def timeit(func, repeat=5, number=1):
+    """Лучшее время одного вызова func из repeat серий по number вызовов, в секундах."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def report(title, rows, columns):
+    """Печатает таблицу результатов: rows - список словарей с ключами columns."""
+    print(title)
+    widths = [max(len(column), *(len(_cell(row[column])) for row in rows)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(_cell(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return f'{value:.3g}' if abs(value) < 100 else f'{value:.0f}'
+    return str(value)
@@ -0,0 +1,138 @@
+"""
+Подбор по тегам в большом каталоге: LIKE-скан против таблиц тегов и CatalogIndex.
+
+Каталог из --rows случайных тайтлов с тегами из вариантов диалога
+записывается во временную базу, таблицы тегов заполняются
+db.sync_content_tags. Затем одни и те же запросы «жанр, глубина,
+особенность, top-10 по рейтингу» выполняются:
+
+    like    - прежним запросом genre LIKE '%tag%' AND features LIKE '%tag%'
+              по индексу (depth, rating);
+    tags    - db._find_content_ids по покрывающему индексу content_genre,
+              как при холодном старте, пока CatalogIndex не построен;
+    top_k   - CatalogIndex.top_k, как для пользователей без истории;
+    matches - CatalogIndex.matching_ids, кандидаты для пользователей с историей;
+    rank    - RankingEngine.top_k по 50 оценкам пользователя среди этих кандидатов.
+
+Второй набор запросов («miss») спрашивает жанр, которого в каталоге нет:
+LIKE-скану приходится пройти всю глубину целиком, а индексы отвечают сразу.
+
+    python benchmarks/bench_catalog_lookup.py --rows 500000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import percentile, report
+import db
+from catalog_index import CatalogIndex
+from ranking import RankingEngine
+from render import DEPTHS, FEATURES, GENRES
+
+LIKE_QUERY = '''
+    SELECT id FROM content
+    WHERE genre LIKE ? AND depth = ? AND features LIKE ?
+    ORDER BY rating DESC
+    LIMIT ?
+'''
+
+
+def fill_catalog(conn, rows):
+    genres = [value for _, value in GENRES]
+    features = [value for _, value in FEATURES]
+    depths = [value for _, value in DEPTHS]
+    conn.executemany(
+        'INSERT INTO content (title, genre, depth, features, type, rating) VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (f'Тайтл {number}', ','.join(random.sample(genres, 2)), random.choice(depths),
+             ','.join(random.sample(features, 2)), random.choice(('movie', 'anime')), round(random.uniform(1, 10), 2))
+            for number in range(rows)
+        )
+    )
+    conn.commit()
+
+
+def queries(count, genre=None):
+    return [
+        {'genre': genre or random.choice(GENRES)[1], 'depth': random.choice(DEPTHS)[1],
+         'features': random.choice(FEATURES)[1]}
+        for _ in range(count)
+    ]
+
+
+def measure(func, preferences):
+    latencies = []
+    for item in preferences:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LIKE-скан против таблиц тегов и CatalogIndex')
+    parser.add_argument('--rows', type=int, default=500_000, help='Тайтлов в каталоге')
+    parser.add_argument('--queries', type=int, default=200, help='Запросов на режим')
+    parser.add_argument('--limit', type=int, default=10, help='Сколько рекомендаций возвращать')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, 'catalog.db'))
+        try:
+            db.init_db(conn)
+            start = time.perf_counter()
+            fill_catalog(conn, args.rows)
+            print(f'Каталог {args.rows} тайтлов записан за {time.perf_counter() - start:.1f} с')
+
+            start = time.perf_counter()
+            db.sync_content_tags(conn)
+            conn.commit()
+            print(f'Таблицы тегов заполнены за {time.perf_counter() - start:.1f} с')
+
+            index = CatalogIndex()
+            start = time.perf_counter()
+            index.load(conn)
+            print(f'CatalogIndex построен за {time.perf_counter() - start:.1f} с')
+
+            ranker = RankingEngine()
+            start = time.perf_counter()
+            ranker.load(conn)
+            print(f'Матрица ранжирования построена за {time.perf_counter() - start:.1f} с')
+            feedback = [(content_id, random.choice(('like', 'dislike')))
+                        for content_id in random.sample(range(1, args.rows + 1), 50)]
+
+            def like(item):
+                return conn.execute(
+                    LIKE_QUERY, (f"%{item['genre']}%", item['depth'], f"%{item['features']}%", args.limit)
+                ).fetchall()
+
+            modes = {
+                'like': like,
+                'tags': lambda item: db._find_content_ids(conn, item, [], args.limit),
+                'top_k': lambda item: index.top_k(item, args.limit),
+                'matches': index.matching_ids,
+                'rank': lambda item: ranker.top_k(item, feedback, args.limit, candidates=index.matching_ids(item)),
+            }
+            workloads = {'random': queries(args.queries), 'miss': queries(args.queries, genre='western')}
+            rows = []
+            for workload, preferences in workloads.items():
+                for mode, func in modes.items():
+                    latencies = measure(func, preferences)
+                    rows.append({
+                        'queries': workload, 'mode': mode, 'p50_ms': percentile(latencies, 0.5) * 1000,
+                        'p99_ms': percentile(latencies, 0.99) * 1000, 'per_s': len(latencies) / sum(latencies),
+                    })
+        finally:
+            conn.close()
+
+    report(f'{args.queries} запросов по {args.rows} тайтлам, top-{args.limit}', rows,
+           ['queries', 'mode', 'p50_ms', 'p99_ms', 'per_s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Кадров в секунду у FrameCompositor на одном ядре.
+
+Рендерит --frames кадров подряд (время идет как при --fps, берется
+лучшая из трех серий) отдельно для каждого слоя flashFrameAnimate, для
+всего стека и без слоев (только копирование основы и перевод в uint8).
+
+    python benchmarks/bench_compositor.py --size 1280x720
+"""
+import argparse
+import time
+
+import numpy as np
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report
+from frame_effects import FrameCompositor, default_layers
+
+
+def fps_of(compositor, frames, fps, repeat=3):
+    """Лучшая из repeat серий: соседние процессы на машине только замедляют рендер."""
+    out = np.empty(compositor.shape, dtype=np.uint8)
+    compositor.render(0, out=out)
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for index in range(frames):
+            compositor.render(index * 1000 / fps, out=out)
+        best = max(best, frames / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Кадров в секунду у FrameCompositor')
+    parser.add_argument('--size', default='1280x720', help='Размер кадра ШИРИНАxВЫСОТА')
+    parser.add_argument('--frames', type=int, default=120, help='Кадров в замере')
+    parser.add_argument('--fps', type=float, default=25, help='Частота кадров анимации')
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split('x'))
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    cases = [('no layers', [])]
+    cases += [(type(layer).__name__, [layer]) for layer in default_layers()]
+    cases.append(('full stack', None))
+
+    rows = []
+    for name, layers in cases:
+        fps = fps_of(FrameCompositor(image, layers), args.frames, args.fps)
+        rows.append({'layers': name, 'fps': fps, 'ms/frame': 1000 / fps})
+
+    report(f'FrameCompositor {width}x{height}, {args.frames} кадров', rows, ['layers', 'fps', 'ms/frame'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Задержка обработчика под нагрузкой: соединение на вызов против пула.
+
+Каждый из --users пользователей раз в --interval секунд присылает
+обновление; обработчик, как process_features, сохраняет предпочтения,
+читает историю и карточки. Задержка считается от момента прихода
+обновления, поэтому в нее входит и ожидание занятого цикла событий.
+
+Режимы:
+    blocking - как до пула: sqlite3.connect на каждый вызов и запрос
+               прямо в цикле событий;
+    pool     - db.ConnectionPool: WAL, кэш выражений, выделенные потоки.
+
+    python benchmarks/bench_db_pool.py --users 500 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import percentile, report
+import db
+
+PREFERENCES = {'genre': 'action', 'depth': 'deep', 'features': 'action'}
+
+
+def prepare(path, users):
+    conn = sqlite3.connect(path)
+    try:
+        db.init_db(conn)
+        conn.executemany('INSERT OR IGNORE INTO users (user_id) VALUES (?)', [(user_id,) for user_id in range(users)])
+        content_ids = [row[0] for row in conn.execute('SELECT id FROM content')]
+        events = [
+            (user_id, random.choice(content_ids), random.choice(('like', 'dislike')), f'2026-01-01T00:00:{second:02d}')
+            for user_id in range(users) for second in range(5)
+        ]
+        db._apply_feedback_batch(conn, events)
+        conn.commit()
+        return content_ids
+    finally:
+        conn.close()
+
+
+def blocking_caller(path):
+    async def call(func, *args):
+        conn = sqlite3.connect(path)
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+    return call, lambda: None
+
+
+def pool_caller(path):
+    pool = db.ConnectionPool(path)
+    return pool.run, pool.close
+
+
+async def simulate(call, users, interval, duration, content_ids):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    start = loop.time()
+    deadline = start + duration
+
+    async def handler(user_id):
+        await call(db._save_user_preferences, user_id, PREFERENCES)
+        await call(db._get_user_history_details, user_id)
+        await call(db._get_content_by_ids, random.sample(content_ids, 3))
+
+    async def user(user_id):
+        arrival = start + random.uniform(0, interval)
+        while arrival < deadline:
+            await asyncio.sleep(max(0.0, arrival - loop.time()))
+            await handler(user_id)
+            latencies.append(loop.time() - arrival)
+            arrival += interval
+
+    await asyncio.gather(*(user(user_id) for user_id in range(users)))
+    return latencies, loop.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='p99 обработчика: соединение на вызов против пула')
+    parser.add_argument('--users', type=int, default=500, help='Одновременных пользователей')
+    parser.add_argument('--interval', type=float, default=1.0, help='Секунд между обновлениями одного пользователя')
+    parser.add_argument('--duration', type=float, default=10.0, help='Длительность прогона, секунд')
+    parser.add_argument('--modes', default='blocking,pool', help='Режимы через запятую')
+    args = parser.parse_args()
+
+    callers = {'blocking': blocking_caller, 'pool': pool_caller}
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes.split(','):
+            random.seed(0)
+            path = os.path.join(directory, f'{mode}.db')
+            content_ids = prepare(path, args.users)
+            call, close = callers[mode](path)
+            try:
+                latencies, elapsed = asyncio.run(
+                    simulate(call, args.users, args.interval, args.duration, content_ids)
+                )
+            finally:
+                close()
+            rows.append({
+                'mode': mode, 'handled': len(latencies), 'per_s': len(latencies) / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000,
+                'max_ms': max(latencies) * 1000,
+            })
+
+    report(f'{args.users} пользователей, обновление раз в {args.interval} с',
+           rows, ['mode', 'handled', 'per_s', 'p50_ms', 'p99_ms', 'max_ms'])
+
+
+if __name__ == '__main__':
+    main()
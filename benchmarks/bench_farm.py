@@ -0,0 +1,97 @@
+"""
+Масштабирование фермы рендера с 1 до N процессов.
+
+Рендерит --jobs превью (эффекты и LUT) сначала в текущем процессе
+через render_preview, затем в RenderFarm с 1, 2, ... --max-workers
+процессами и сравнивает кадры в секунду. Процессы фермы запускаются
+прогревочным заданием, чтобы старт forkserver не попадал в замер.
+
+Результат пишется в APNG (.png), если не указан другой --suffix: его
+сжатие идет в потоке записи родителя и при многих ядрах может само
+стать узким местом. Если процессов больше, чем доступных ядер,
+выводится предупреждение: ускорение в таких строках показывает только
+накладные расходы фермы, а не масштабирование.
+
+    python benchmarks/bench_farm.py --max-workers 8 --jobs 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report
+from color_grading import preset_path
+from preview_pipeline import render_preview
+from render_farm import CHUNK_FRAMES, RenderFarm
+
+
+def available_cores():
+    # Ядра, на которых процессу разрешено выполняться (taskset, cgroup cpuset)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Масштабирование фермы рендера по процессам')
+    parser.add_argument('--max-workers', type=int, default=available_cores(), help='Наибольшее число процессов')
+    parser.add_argument('--jobs', type=int, default=4, help='Превью в замере')
+    parser.add_argument('--size', default='640x360', help='Размер кадра ШИРИНАxВЫСОТА')
+    parser.add_argument('--duration', type=float, default=2.0, help='Длительность превью, секунд')
+    parser.add_argument('--fps', type=float, default=25, help='Кадров в секунду')
+    parser.add_argument('--preset', default='neo_noir', help='Пресет LUT; пустая строка - без LUT')
+    parser.add_argument('--suffix', default='.png', help='Формат результата')
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split('x'))
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    preset = args.preset or None
+    if preset and not os.path.exists(preset_path(preset)):
+        # Рабочие процессы загружают пресет сами, подменить его таблицей замера нельзя
+        print(f'Нет файла пресета {preset}: замер без LUT')
+        preset = None
+    frames = round(args.fps * args.duration) * args.jobs
+    cores = available_cores()
+    if args.max_workers > cores:
+        print(f'Внимание: доступно ядер: {cores}, а процессов до {args.max_workers}; '
+              f'строки с workers > {cores} не показывают масштабирование')
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        def output(name):
+            return os.path.join(directory, f'{name}{args.suffix}')
+
+        start = time.perf_counter()
+        for number in range(args.jobs):
+            render_preview(image, output(f'inline-{number}'), fps=args.fps, duration=args.duration, preset=preset)
+        inline = time.perf_counter() - start
+        rows.append({'workers': 'inline', 'seconds': inline, 'fps': frames / inline, 'speedup': 1.0})
+
+        for workers in range(1, args.max_workers + 1):
+            farm = RenderFarm(workers)
+            try:
+                # Прогрев: по части на процесс, чтобы все запустились и загрузили LUT
+                farm.submit(image, output(f'warmup-{workers}'), fps=args.fps,
+                            duration=workers * CHUNK_FRAMES / args.fps, preset=preset).result()
+
+                start = time.perf_counter()
+                jobs = [farm.submit(image, output(f'farm-{workers}-{number}'), fps=args.fps,
+                                    duration=args.duration, preset=preset)
+                        for number in range(args.jobs)]
+                for job in jobs:
+                    job.result()
+                seconds = time.perf_counter() - start
+            finally:
+                farm.close()
+            rows.append({'workers': workers, 'seconds': seconds, 'fps': frames / seconds,
+                         'speedup': inline / seconds})
+
+    report(f'{args.jobs} превью {width}x{height}, {frames} кадров, ядер: {cores}', rows,
+           ['workers', 'seconds', 'fps', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Пропускная способность цветокоррекции по пресетам: мегапикселей в секунду.
+
+Для каждого пресета из luts замеряются подготовка Lut (упаковка узлов
+и таблиц ключей) и Lut.apply на кадре заданного размера. Если PNG
+пресета нет рядом со списком, берется синтетическая таблица 33^3 той же
+формы - стоимость apply от содержимого таблицы не зависит.
+
+    python benchmarks/bench_lut.py --size 1920x1080
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report, timeit
+import color_grading
+
+
+def synthetic_table(size=33):
+    axis = np.linspace(0, 255, size, dtype=np.float32)
+    b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+    # Слегка «теплая» кривая, чтобы таблица не была тождественной
+    return np.stack([np.sqrt(r / 255) * 255, g, b * 0.9], axis=-1)
+
+
+def preset_table(name):
+    path = color_grading.preset_path(name)
+    if os.path.exists(path):
+        return color_grading.parse_lut_image(color_grading._read_png(path)), 'png'
+    return synthetic_table(), 'synthetic'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер Lut.apply по пресетам')
+    parser.add_argument('--size', default='1920x1080', help='Размер кадра ШИРИНАxВЫСОТА')
+    parser.add_argument('--repeat', type=int, default=10, help='Серий замера apply')
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split('x'))
+    frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    out = np.empty_like(frame)
+
+    rows = []
+    for name in color_grading.preset_names():
+        table, source = preset_table(name)
+        start = time.perf_counter()
+        lut = color_grading.Lut(table, name=name)
+        prepare = time.perf_counter() - start
+        seconds = timeit(lambda: lut.apply(frame, out=out), repeat=args.repeat)
+        rows.append({
+            'preset': name, 'source': source, 'prepare_ms': prepare * 1000, 'nodes_KB': lut._nodes.nbytes >> 10,
+            'ms/frame': seconds * 1000, 'MP/s': width * height / seconds / 1e6,
+        })
+
+    report(f'Lut.apply {width}x{height}', rows, ['preset', 'source', 'prepare_ms', 'nodes_KB', 'ms/frame', 'MP/s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Накладные расходы метрик: время обработки апдейта с метриками и без.
+
+Диалоги подбора прогоняются через Dispatcher.process_update в двух
+приложениях, отличающихся только metrics_port (middleware, обертки
+пула, Bot API и FSM; сам экспортер не запускается). Режимы чередуются
+в меняющемся порядке, из --repeat прогонов берется медиана. Bot API
+подменен и отвечает через --api-latency: против нулевой задержки видна
+вся стоимость метрик, против реалистичной - ее доля во времени
+обработчика. Кроме времени по часам считается процессорное время
+процесса (вместе с потоками пула): оно не зависит от ожидания диска
+и заметно стабильнее между прогонами.
+
+    python benchmarks/bench_metrics.py --api-latency 0,0.005
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, types
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report
+from _bot import create_bot_app, dialog_updates
+from main import METRICS_PORT, on_shutdown
+
+CHATS = 20
+
+
+async def run(metrics_port, api_latency, dialogs):
+    """Время по часам и процессорное время на один апдейт в микросекундах."""
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        dp = create_bot_app(directory, api_latency, metrics_port=metrics_port)
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        try:
+            def batch(first_update_id):
+                return [types.Update(**data)
+                        for number in range(dialogs)
+                        for data in dialog_updates(number % CHATS + 1, first_update_id + number * 5, rng)]
+
+            # Прогрев: индексы, соединения и кэш карточек
+            for update in batch(1):
+                await dp.process_update(update)
+
+            updates = batch(1_000_000)
+            start, cpu_start = time.perf_counter(), time.process_time()
+            for update in updates:
+                await dp.process_update(update)
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+            return wall / len(updates) * 1e6, cpu / len(updates) * 1e6
+        finally:
+            await on_shutdown(dp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Накладные расходы метрик на апдейт')
+    parser.add_argument('--api-latency', default='0,0.005', help='Задержки Bot API через запятую, секунд')
+    parser.add_argument('--dialogs', type=int, default=200, help='Диалогов в прогоне')
+    parser.add_argument('--repeat', type=int, default=8, help='Прогонов каждого режима')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    rows = []
+    for api_latency in map(float, args.api_latency.split(',')):
+        dialogs = args.dialogs if not api_latency else max(1, args.dialogs // 5)
+        timings = {'off': [], 'on': []}
+        modes = [('off', None), ('on', METRICS_PORT)]
+        for _ in range(args.repeat):
+            for mode, port in modes:
+                timings[mode].append(asyncio.run(run(port, api_latency, dialogs)))
+            # Порядок меняется каждый прогон, чтобы прогрев не доставался одному режиму
+            modes.reverse()
+        for clock, column in (('wall', 0), ('cpu', 1)):
+            off = statistics.median(timing[column] for timing in timings['off'])
+            on = statistics.median(timing[column] for timing in timings['on'])
+            rows.append({
+                'api_ms': api_latency * 1000, 'clock': clock, 'off_us': off, 'on_us': on,
+                'delta_us': on - off, 'overhead_%': (on - off) / off * 100,
+            })
+
+    report(f'Медиана {args.repeat} прогонов, мкс на апдейт', rows,
+           ['api_ms', 'clock', 'off_us', 'on_us', 'delta_us', 'overhead_%'])
+
+
+if __name__ == '__main__':
+    main()
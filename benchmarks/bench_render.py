@@ -0,0 +1,60 @@
+"""
+Горячий путь отрисовки: клавиатуры диалога и карточки рекомендаций.
+
+Сравнивает сборку на каждый апдейт, как было в обработчиках (новая
+InlineKeyboardMarkup и ее сериализация, которую aiogram делал при
+отправке), с готовыми клавиатурами render и попаданием в CardCache.
+Для каждого варианта - время на вызов и пик памяти вызова по tracemalloc.
+
+    python benchmarks/bench_render.py
+"""
+import argparse
+import tracemalloc
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report, timeit
+import render
+from db import Recommendation
+
+REC = Recommendation(3, 'Атака титанов', 'action,fantasy', 'deep', 'action,drama', 'anime')
+
+
+def peak_bytes(func):
+    """Пик памяти, выделенной за один вызов func."""
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Стоимость клавиатур и карточек на апдейт')
+    parser.add_argument('--number', type=int, default=2000, help='Вызовов в серии')
+    args = parser.parse_args()
+
+    cards = render.CardCache()
+    cards.render(REC)
+    cases = [
+        ('genre keyboard', 'per update', lambda: render._column_keyboard(render.GENRES, 'genre_')),
+        ('genre keyboard', 'precomputed', lambda: render.GENRE_KEYBOARD),
+        ('depth keyboard', 'per update', render._depth_keyboard),
+        ('depth keyboard', 'precomputed', lambda: render.DEPTH_KEYBOARD),
+        ('card', 'per update', lambda: render.format_card(REC)),
+        ('card', 'cache hit', lambda: cards.render(REC)),
+    ]
+
+    rows = []
+    for name, variant, func in cases:
+        seconds = timeit(func, repeat=5, number=args.number)
+        rows.append({'what': name, 'variant': variant, 'us/call': seconds * 1e6, 'peak_bytes': peak_bytes(func)})
+
+    report('Отрисовка на один апдейт', rows, ['what', 'variant', 'us/call', 'peak_bytes'])
+
+
+if __name__ == '__main__':
+    main()
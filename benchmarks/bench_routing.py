@@ -0,0 +1,141 @@
+"""
+Стоимость маршрутизации сообщений и кнопок при росте числа намерений.
+
+Сообщения из routing_corpus.txt (или --corpus) маршрутизируются тремя
+способами:
+
+    linear      - как раньше: цепочка фильтров any(phrase in text.lower())
+                  по намерениям по порядку;
+    alternation - одно регулярное выражение с плоским перечислением фраз;
+    router      - router.IntentRouter (регулярное выражение по префиксному дереву).
+
+К намерению film_dialog из main добавляются синтетические намерения по
+пять основ в каждом. Кнопки сравниваются так же: цепочка startswith
+против CallbackRouter.
+
+    python benchmarks/bench_routing.py --intents 1,10,40,200
+"""
+import argparse
+import os
+import random
+import re
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import report, timeit
+from main import FILM_DIALOG_PHRASES
+from router import CallbackRouter, IntentRouter
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routing_corpus.txt')
+CALLBACK_PREFIXES = ['genre', 'depth', 'feature', 'feedback', 'more']
+CALLBACK_CORPUS = ['genre_action', 'depth_deep', 'feature_humor', 'feedback_like_3', 'more_recommendations']
+ALPHABET = 'абвгдежзиклмнопрстуфхцчшэюя'
+
+
+def intents(count, rng):
+    """film_dialog и count - 1 синтетических намерений по пять основ."""
+    result = [('film_dialog', FILM_DIALOG_PHRASES)]
+    for number in range(count - 1):
+        stems = [''.join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 8))) for _ in range(5)]
+        result.append((f'intent_{number}', stems))
+    return result
+
+
+def linear_router(intent_list):
+    filters = [(name, lambda text, phrases=phrases: any(phrase in text.lower() for phrase in phrases))
+               for name, phrases in intent_list]
+
+    def route(text):
+        for name, matches in filters:
+            if matches(text):
+                return name
+        return None
+    return route
+
+
+def alternation_router(intent_list):
+    by_phrase = {phrase: name for name, phrases in intent_list for phrase in phrases}
+    pattern = re.compile('|'.join(re.escape(phrase) for phrase in by_phrase))
+
+    def route(text):
+        found = pattern.search(text.lower())
+        return by_phrase[found.group()] if found else None
+    return route
+
+
+def trie_router(intent_list):
+    router = IntentRouter()
+    for name, phrases in intent_list:
+        router.add(name, phrases, None)
+    router.match('')
+    return router.match
+
+
+class _Callback:
+    def __init__(self, data):
+        self.data = data
+
+
+def callback_cases(extra):
+    prefixes = CALLBACK_PREFIXES + [f'extra{number}' for number in range(extra)]
+    # Раньше каждый обработчик проверял свой startswith, и последние кнопки проходили всю цепочку
+    chain = [lambda data, prefix=prefix: data.startswith(f'{prefix}_') for prefix in reversed(prefixes)]
+    router = CallbackRouter()
+    for prefix in prefixes:
+        router.add(prefix, None)
+    queries = [_Callback(data) for data in CALLBACK_CORPUS]
+
+    def linear():
+        for query in queries:
+            next((True for check in chain if check(query.data)), None)
+
+    def dispatch():
+        for query in queries:
+            router.resolve(query)
+    return linear, dispatch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Стоимость маршрутизации сообщений и кнопок')
+    parser.add_argument('--corpus', default=CORPUS, help='Файл с сообщениями, по одному на строку')
+    parser.add_argument('--intents', default='1,10,40,200', help='Число намерений через запятую')
+    parser.add_argument('--number', type=int, default=20, help='Проходов по корпусу в серии')
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as handle:
+        messages = [line.strip() for line in handle if line.strip()]
+
+    rows = []
+    builders = {'linear': linear_router, 'alternation': alternation_router, 'router': trie_router}
+    for count in map(int, args.intents.split(',')):
+        intent_list = intents(count, random.Random(count))
+        routes = {name: build(intent_list) for name, build in builders.items()}
+        # Все способы должны распознавать одинаково, иначе сравнение бессмысленно
+        expected = [routes['router'](text) for text in messages]
+        row = {'intents': count, 'film_dialog': expected.count('film_dialog')}
+        for name, route in routes.items():
+            if name == 'linear':
+                # Цепочка выбирает первое по порядку намерение, а не первое в тексте
+                assert [route(text) == 'film_dialog' for text in messages] == \
+                    [intent == 'film_dialog' for intent in expected], name
+            else:
+                assert [route(text) for text in messages] == expected, name
+            seconds = timeit(lambda: [route(text) for text in messages], number=args.number)
+            row[f'{name}_us'] = seconds / len(messages) * 1e6
+        rows.append(row)
+
+    report(f'Сообщения: {len(messages)} из {os.path.basename(args.corpus)}, мкс на сообщение',
+           rows, ['intents', 'film_dialog', 'linear_us', 'alternation_us', 'router_us'])
+
+    rows = []
+    for extra in (0, 20):
+        linear, dispatch = callback_cases(extra)
+        rows.append({
+            'prefixes': len(CALLBACK_PREFIXES) + extra,
+            'startswith_us': timeit(linear, number=1000) / len(CALLBACK_CORPUS) * 1e6,
+            'router_us': timeit(dispatch, number=1000) / len(CALLBACK_CORPUS) * 1e6,
+        })
+    report('Кнопки, мкс на callback', rows, ['prefixes', 'startswith_us', 'router_us'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Нагрузочный прогон вебхука: пропускная способность и перцентили задержки.
+
+Поднимает webhook.create_webhook_app с настоящими обработчиками бота на
+локальном порту и воспроизводит апдейты Telegram из JSONL (по апдейту
+на строку). Апдейты одного чата отправляются по порядку, разные чаты -
+параллельно, не больше --concurrency запросов сразу. Без --updates
+генерируются диалоги подбора для --chats чатов; --record сохраняет их
+для повторных прогонов.
+
+Отчет: ack - ответ сервера на POST (постановка в очередь), done - от
+отправки до конца обработки апдейта диспетчером.
+
+    python benchmarks/bench_webhook.py --chats 200 --workers 8 --api-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from collections import OrderedDict
+
+import aiohttp
+from aiogram import types
+from aiohttp import web
+
+# _common добавляет корень репозитория в sys.path, поэтому импортируется первым
+from _common import percentile, report
+from _bot import create_bot_app, dialog_updates
+from main import on_shutdown
+from webhook import create_webhook_app, update_chat_id
+
+WEBHOOK_PATH = '/webhook'
+
+
+def generate(chats, dialogs):
+    rng = random.Random(0)
+    updates = []
+    update_id = 1
+    for _ in range(dialogs):
+        for chat_id in range(1, chats + 1):
+            updates += dialog_updates(chat_id, update_id, rng)
+            update_id += 5
+    return updates
+
+
+def load(path):
+    with open(path, encoding='utf-8') as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def by_chat(updates):
+    """Апдейты, сгруппированные по чатам с сохранением порядка внутри чата."""
+    chats = OrderedDict()
+    for data in updates:
+        chats.setdefault(update_chat_id(types.Update(**data)), []).append(data)
+    return list(chats.values())
+
+
+async def replay(updates, workers, queue_size, concurrency, api_latency):
+    with tempfile.TemporaryDirectory() as directory:
+        dp = create_bot_app(directory, api_latency)
+        sent = {}
+        done = {}
+
+        process_update = dp.process_update
+
+        async def timed_process_update(update):
+            try:
+                return await process_update(update)
+            finally:
+                done[update.update_id] = time.perf_counter()
+
+        dp.process_update = timed_process_update
+        app = create_webhook_app(dp, WEBHOOK_PATH, workers=workers, queue_size=queue_size,
+                                 on_shutdown=on_shutdown)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        url = f'http://127.0.0.1:{port}{WEBHOOK_PATH}'
+
+        acks = []
+        statuses = {}
+        limit = asyncio.Semaphore(concurrency)
+
+        async def chat_sender(session, chat_updates):
+            for data in chat_updates:
+                async with limit:
+                    start = sent[data['update_id']] = time.perf_counter()
+                    async with session.post(url, json=data) as response:
+                        await response.read()
+                    acks.append(time.perf_counter() - start)
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(chat_sender(session, chat_updates) for chat_updates in by_chat(updates)))
+        # Остановка дожидается очередей, поэтому после нее обработано все принятое
+        await runner.cleanup()
+        elapsed = time.perf_counter() - started
+
+    latencies = [done[update_id] - start for update_id, start in sent.items() if update_id in done]
+    return {
+        'updates': len(updates), 'processed': len(latencies), 'status': statuses,
+        'per_s': len(latencies) / elapsed,
+        'ack_p50_ms': percentile(acks, 0.5) * 1000, 'ack_p99_ms': percentile(acks, 0.99) * 1000,
+        'done_p50_ms': percentile(latencies, 0.5) * 1000, 'done_p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон вебхука')
+    parser.add_argument('--updates', help='JSONL с апдейтами Telegram для воспроизведения')
+    parser.add_argument('--record', help='Сохранить сгенерированные апдейты в JSONL')
+    parser.add_argument('--chats', type=int, default=200, help='Чатов при генерации')
+    parser.add_argument('--dialogs', type=int, default=2, help='Диалогов на чат при генерации')
+    parser.add_argument('--workers', default='1,8,32', help='Число обработчиков через запятую')
+    parser.add_argument('--queue-size', type=int, default=100, help='Очередь одного обработчика')
+    parser.add_argument('--concurrency', type=int, default=64, help='Одновременных запросов клиента')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Задержка Bot API, секунд')
+    args = parser.parse_args()
+
+    # Отказы 503 рвут диалоги, и бот уходит в запасные ветки вплоть до недоступного
+    # DeepSeek: их предупреждения и ошибки - шум для отчета, отказы видны в status
+    logging.basicConfig(level=logging.CRITICAL)
+    updates = load(args.updates) if args.updates else generate(args.chats, args.dialogs)
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as handle:
+            for data in updates:
+                handle.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+    rows = []
+    for workers in map(int, args.workers.split(',')):
+        result = asyncio.run(replay(updates, workers, args.queue_size, args.concurrency, args.api_latency))
+        rows.append({'workers': workers, **result})
+
+    report(f'{len(updates)} апдейтов, Bot API {args.api_latency * 1000:.0f} мс, клиент {args.concurrency}', rows,
+           ['workers', 'processed', 'status', 'per_s', 'ack_p50_ms', 'ack_p99_ms', 'done_p50_ms', 'done_p99_ms'])
+
+
+if __name__ == '__main__':
+    main()
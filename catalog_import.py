@@ -0,0 +1,257 @@
+import argparse
+import csv
+import functools
+import json
+import logging
+import os
+import time
+
+import db
+
+# Сколько строк передавать в один executemany
+BATCH_SIZE = 10000
+# Сколько строк фиксировать одной транзакцией
+COMMIT_EVERY = 200000
+# С какого объема дампов выгоднее удалить индексы и построить их заново
+DEFER_INDEXES_MIN_BYTES = 64 * 1024 * 1024
+
+CONTENT_TYPES = {'movie': 'movie', 'film': 'movie', 'фильм': 'movie', 'anime': 'anime', 'аниме': 'anime'}
+
+
+@functools.lru_cache(maxsize=65536)
+def _normalize_tags(value):
+    # Сочетаний тегов в дампах немного, поэтому разбор кэшируется
+    return ','.join(db.split_tags(value))
+
+
+def _tags(value):
+    # В JSONL жанры и особенности бывают списком, в CSV - строкой через запятую
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(tag) for tag in value)
+    return _normalize_tags(value or '')
+
+
+def _number(value, cast):
+    if value in (None, ''):
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_record(record):
+    """
+    Приводит запись дампа к строке таблицы content.
+
+    Returns:
+        tuple: Значения для вставки или None, если у записи нет названия.
+    """
+    title = (record.get('title') or '').strip()
+    if not title:
+        return None
+
+    year = _number(record.get('year'), lambda value: int(float(value)))
+    content_type = str(record.get('type') or '').strip().lower()
+
+    return (
+        title,
+        _tags(record.get('genre') or record.get('genres')),
+        (record.get('depth') or '').strip().lower() or None,
+        _tags(record.get('features')),
+        CONTENT_TYPES.get(content_type, content_type or None),
+        record.get('description') or None,
+        _number(record.get('rating'), float),
+        year,
+        db.content_key(title, year)
+    )
+
+
+def read_records(path):
+    """
+    Построчно читает CSV или JSONL и отдает (запись, прочитано байт).
+
+    Формат определяется по расширению: .jsonl/.ndjson или CSV с заголовком.
+    """
+    with open(path, encoding='utf-8', newline='') as handle:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line), handle.buffer.tell()
+        else:
+            for record in csv.DictReader(handle):
+                yield record, handle.buffer.tell()
+
+
+def _drop_indexes(conn):
+    for name in db.CONTENT_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def _create_indexes(conn):
+    for sql in db.CONTENT_INDEXES.values():
+        conn.execute(sql)
+
+
+def _write_batch(conn, rows):
+    # Дубли по названию и году обновляют существующую запись; пустые поля дампа
+    # не затирают известные значения, лайки и дизлайки сохраняются
+    conn.executemany('''
+        INSERT INTO content (title, genre, depth, features, type, description, editorial_rating, rating, year, dedup_key)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, COALESCE(?7, 0), ?8, ?9)
+        ON CONFLICT(dedup_key) DO UPDATE SET
+            title = excluded.title,
+            genre = COALESCE(NULLIF(excluded.genre, ''), genre),
+            depth = COALESCE(excluded.depth, depth),
+            features = COALESCE(NULLIF(excluded.features, ''), features),
+            type = COALESCE(excluded.type, type),
+            description = COALESCE(excluded.description, description),
+            editorial_rating = COALESCE(excluded.editorial_rating, editorial_rating)
+    ''', rows)
+
+    # Пересобираем теги затронутых записей и запоминаем их ID, чтобы в конце пересчитать рейтинг
+    keys = [row[-1] for row in rows]
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        ids = [row[0] for row in conn.execute(
+            f"SELECT id FROM content WHERE dedup_key IN ({','.join(['?'] * len(chunk))})", chunk
+        )]
+        conn.executemany('INSERT OR IGNORE INTO temp.imported_content (id) VALUES (?)', [(content_id,) for content_id in ids])
+        db.sync_content_tags(conn, ids)
+
+
+def _finish(conn):
+    """Пересчитывает рейтинг импортированных записей и переносит его в таблицу тегов."""
+    conn.execute(
+        f'UPDATE content SET rating = {db.RATING_EXPRESSION} WHERE id IN (SELECT id FROM temp.imported_content)',
+        {'likes': 0, 'dislikes': 0, 'prior': db.RATING_PRIOR_WEIGHT}
+    )
+    conn.execute('''
+        UPDATE content_genre SET rating = content.rating
+        FROM content
+        WHERE content.id = content_genre.content_id
+          AND content_genre.content_id IN (SELECT id FROM temp.imported_content)
+    ''')
+
+
+def import_files(path, files, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY, defer_indexes=None):
+    """
+    Загружает дампы каталога в таблицу content.
+
+    Вставка идет пачками executemany в больших транзакциях с ослабленной
+    синхронизацией; вторичные индексы удаляются на время загрузки и
+    строятся заново в конце. Дубли определяются по нормализованному
+    названию и году.
+
+    Args:
+        path (str): Путь к базе данных бота.
+        files (list): Пути к файлам CSV или JSONL.
+        batch_size (int): Строк в одном executemany.
+        commit_every (int): Строк в одной транзакции.
+        defer_indexes (bool, optional): Удалять вторичные индексы на время загрузки.
+            По умолчанию - только для дампов от DEFER_INDEXES_MIN_BYTES.
+
+    Returns:
+        dict: Число прочитанных, пропущенных и новых записей.
+    """
+    if defer_indexes is None:
+        defer_indexes = sum(os.path.getsize(name) for name in files) >= DEFER_INDEXES_MIN_BYTES
+
+    import_pool = db.ConnectionPool(path, size=1)
+    try:
+        with import_pool.connection() as conn:
+            db.init_db(conn)
+            conn.commit()
+            return _import(conn, files, batch_size, commit_every, defer_indexes)
+    finally:
+        import_pool.close()
+
+
+def _import(conn, files, batch_size, commit_every, defer_indexes):
+    try:
+        before = conn.execute('SELECT COUNT(*) FROM content').fetchone()[0]
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS imported_content (id INTEGER PRIMARY KEY)')
+        if defer_indexes:
+            _drop_indexes(conn)
+
+        total_bytes = sum(os.path.getsize(name) for name in files) or 1
+        done_bytes = 0
+        read = skipped = uncommitted = 0
+        started = last_report = time.monotonic()
+
+        for name in files:
+            batch = []
+            position = 0
+            for record, position in read_records(name):
+                read += 1
+                row = normalize_record(record)
+                if row is None:
+                    skipped += 1
+                    continue
+                batch.append(row)
+
+                if len(batch) >= batch_size:
+                    _write_batch(conn, batch)
+                    uncommitted += len(batch)
+                    batch = []
+                    if uncommitted >= commit_every:
+                        conn.commit()
+                        uncommitted = 0
+
+                    now = time.monotonic()
+                    if now - last_report >= 5:
+                        last_report = now
+                        progress = (done_bytes + position) / total_bytes
+                        logging.info(
+                            f"Импорт: {read} записей ({progress:.0%}), "
+                            f"{read / (now - started):.0f} записей/с"
+                        )
+
+            if batch:
+                _write_batch(conn, batch)
+            done_bytes += os.path.getsize(name)
+
+        logging.info("Загрузка завершена, пересчитываем рейтинг и строим индексы")
+        _finish(conn)
+        if defer_indexes:
+            _create_indexes(conn)
+        # В той же транзакции, что и последняя пачка: бот не увидит новую версию без данных
+        db.bump_catalog_version(conn)
+        conn.commit()
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA optimize')
+
+        added = conn.execute('SELECT COUNT(*) FROM content').fetchone()[0] - before
+        elapsed = time.monotonic() - started
+        logging.info(
+            f"Импорт завершен за {elapsed:.1f} с: прочитано {read}, пропущено {skipped}, "
+            f"новых {added}, обновлено дублей {read - skipped - added} ({read / max(elapsed, 1e-9):.0f} записей/с)"
+        )
+        return {'read': read, 'skipped': skipped, 'added': added}
+    except Exception:
+        conn.rollback()
+        # Индексы нужны боту даже после неудачного импорта
+        if defer_indexes:
+            _create_indexes(conn)
+            conn.commit()
+        raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Импорт каталога фильмов и аниме из CSV или JSONL')
+    parser.add_argument('files', nargs='+', help='Файлы .csv или .jsonl')
+    parser.add_argument('--db', default=db.DB_PATH, help='Путь к файлу базы данных')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Строк в одном executemany')
+    parser.add_argument('--commit-every', type=int, default=COMMIT_EVERY, help='Строк в одной транзакции')
+    indexes = parser.add_mutually_exclusive_group()
+    indexes.add_argument('--defer-indexes', dest='defer_indexes', action='store_true', default=None,
+                         help='Удалить индексы на время загрузки')
+    indexes.add_argument('--keep-indexes', dest='defer_indexes', action='store_false',
+                         help='Не удалять индексы на время загрузки')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import_files(args.db, args.files, args.batch_size, args.commit_every, args.defer_indexes)
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+
+import db
+
+
+class CatalogIndex:
+    """
+    Индекс каталога в памяти процесса для быстрого подбора рекомендаций.
+
+    Для каждого значения жанра, глубины, особенности и типа хранится
+    список (posting list) ключей (-rating, id), отсортированный по убыванию
+    рейтинга, и множество id для проверки принадлежности. Запрос «top-k
+    непросмотренных по предпочтениям» обходит самый короткий список в
+    порядке рейтинга и останавливается, как только набрано k результатов.
+
+    Изменения рейтинга применяются точечно через update_rating без
+    перезагрузки всего каталога. Записи, добавленные или обновленные импортом из другого
+    процесса, подхватываются полной перезагрузкой, когда меняется
+    отпечаток db.catalog_stamp.
+
+    Args:
+        refresh_interval (float): Как часто проверять, менялся ли каталог, в секундах.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._postings = {}
+        self._members = {}
+        self._all = []
+        self._items = {}
+        self._stamp = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._load_lock = None
+        self._loading = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _keys(genre, depth, features, content_type):
+        keys = [('genre', tag) for tag in db.split_tags(genre)]
+        keys += [('feature', tag) for tag in db.split_tags(features)]
+        if depth:
+            keys.append(('depth', depth))
+        if content_type:
+            keys.append(('type', content_type))
+        # «action,action» не должно давать повторов id в списке
+        return list(dict.fromkeys(keys))
+
+    def add(self, content_id, genre, depth, features, content_type, rating):
+        """Добавляет или заменяет запись каталога в индексе."""
+        if content_id in self._items:
+            self.remove(content_id)
+
+        rating = rating or 0
+        keys = self._keys(genre, depth, features, content_type)
+        sort_key = (-rating, content_id)
+
+        for key in keys:
+            insort(self._postings.setdefault(key, []), sort_key)
+            self._members.setdefault(key, set()).add(content_id)
+        insort(self._all, sort_key)
+
+        self._items[content_id] = (rating, keys)
+
+    def remove(self, content_id):
+        """Удаляет запись каталога из индекса."""
+        item = self._items.pop(content_id, None)
+        if item is None:
+            return
+
+        rating, keys = item
+        sort_key = (-rating, content_id)
+
+        for key in keys:
+            postings = self._postings[key]
+            del postings[bisect_left(postings, sort_key)]
+            self._members[key].discard(content_id)
+        del self._all[bisect_left(self._all, sort_key)]
+
+    def update_rating(self, content_id, rating):
+        """
+        Перемещает запись на новую позицию во всех её списках.
+
+        Args:
+            content_id (int): ID контента.
+            rating (float): Новый рейтинг.
+        """
+        item = self._items.get(content_id)
+        if item is None or item[0] == rating:
+            return
+
+        old_rating, keys = item
+        old_key = (-old_rating, content_id)
+        new_key = (-rating, content_id)
+
+        for postings in [self._postings[key] for key in keys] + [self._all]:
+            del postings[bisect_left(postings, old_key)]
+            insort(postings, new_key)
+
+        self._items[content_id] = (rating, keys)
+
+    def top_k(self, preferences, k=1, exclude_ids=()):
+        """
+        Возвращает до k ID контента с наивысшим рейтингом под предпочтения.
+
+        Args:
+            preferences (dict): Предпочтения с ключами genre, depth, features и type.
+            k (int): Сколько ID вернуть.
+            exclude_ids (iterable, optional): Уже просмотренный контент.
+
+        Returns:
+            list: ID контента в порядке убывания рейтинга.
+        """
+        keys = self._keys(
+            preferences.get('genre', ''),
+            preferences.get('depth', ''),
+            preferences.get('features', ''),
+            preferences.get('type', '')
+        )
+
+        if keys:
+            # Любой незнакомый тег означает пустой результат
+            if any(key not in self._postings for key in keys):
+                return []
+            keys.sort(key=lambda key: len(self._postings[key]))
+            candidates = self._postings[keys[0]]
+            filters = [self._members[key] for key in keys[1:]]
+        else:
+            candidates = self._all
+            filters = []
+
+        exclude = set(exclude_ids)
+        result = []
+        for _, content_id in candidates:
+            if content_id in exclude:
+                continue
+            if all(content_id in members for members in filters):
+                result.append(content_id)
+                if len(result) >= k:
+                    break
+
+        return result
+
+    def matching_ids(self, preferences):
+        """
+        Возвращает множество ID, подходящих под все предпочтения диалога.
+
+        Args:
+            preferences (dict): Предпочтения с ключами genre, depth, features и type.
+
+        Returns:
+            set: ID контента или None, если предпочтения ничего не ограничивают.
+        """
+        keys = self._keys(
+            preferences.get('genre', ''),
+            preferences.get('depth', ''),
+            preferences.get('features', ''),
+            preferences.get('type', '')
+        )
+        if not keys:
+            return None
+        if any(key not in self._members for key in keys):
+            return set()
+
+        # Пересечение начинаем с самого короткого множества
+        members = sorted((self._members[key] for key in keys), key=len)
+        return members[0].intersection(*members[1:])
+
+    def load(self, conn):
+        """Полностью строит индекс по таблице content."""
+        self._install(self._build(conn))
+
+    @staticmethod
+    def _build(conn):
+        # Новый индекс собирается в потоке пула отдельно от текущего, а
+        # подменяется в event loop, поэтому обработчики не видят его наполовину
+        postings = {}
+        members = {}
+        all_items = []
+        items = {}
+
+        stamp = db.catalog_stamp(conn)
+        rows = conn.execute('SELECT id, genre, depth, features, type, rating FROM content').fetchall()
+
+        # Сочетаний тегов немного, поэтому разобранные ключи переиспользуются
+        keys_cache = {}
+
+        # Сортируем один раз, чтобы списки строились добавлением в конец
+        rows.sort(key=lambda row: (-(row[5] or 0), row[0]))
+        for content_id, genre, depth, features, content_type, rating in rows:
+            rating = rating or 0
+            tags = (genre, depth, features, content_type)
+            cached = keys_cache.get(tags)
+            if cached is None:
+                keys = CatalogIndex._keys(*tags)
+                targets = [(postings.setdefault(key, []), members.setdefault(key, set())) for key in keys]
+                cached = keys_cache[tags] = (keys, targets)
+            keys, targets = cached
+            sort_key = (-rating, content_id)
+            for key_postings, key_members in targets:
+                key_postings.append(sort_key)
+                key_members.add(content_id)
+            all_items.append(sort_key)
+            items[content_id] = (rating, keys)
+
+        return stamp, postings, members, all_items, items
+
+    def _install(self, index):
+        self._stamp, self._postings, self._members, self._all, self._items = index
+        self._checked_at = time.monotonic()
+        self._loaded = True
+        logging.info(f"Индекс каталога загружен: {len(self._items)} записей")
+
+    def _build_if_changed(self, conn, stamp):
+        if db.catalog_stamp(conn) != stamp:
+            return self._build(conn)
+        return None
+
+    async def ensure_loaded(self):
+        """Загружает индекс при первом обращении и перестраивает его после импорта каталога."""
+        if self._loaded and time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                self._install(await db.pool.run(self._build))
+            elif time.monotonic() - self._checked_at >= self.refresh_interval:
+                self._checked_at = time.monotonic()
+                index = await db.pool.run(self._build_if_changed, self._stamp)
+                if index is not None:
+                    self._install(index)
+
+    def load_in_background(self):
+        """Запускает первую загрузку индекса, не дожидаясь её окончания."""
+        if self._loaded or (self._loading is not None and not self._loading.done()):
+            return
+        self._loading = asyncio.ensure_future(self._load_logged())
+
+    async def _load_logged(self):
+        try:
+            await self.ensure_loaded()
+        except Exception as e:
+            logging.error(f"Не удалось загрузить индекс каталога: {e}")
+
+
+# Общий индекс каталога процесса
+catalog = CatalogIndex()
@@ -0,0 +1,234 @@
+import functools
+import os
+
+import numpy as np
+
+# Файл со списком пресетов цветокоррекции; PNG лежат рядом с ним
+LUT_DIR = os.path.dirname(os.path.abspath(__file__))
+LUT_LIST = os.path.join(LUT_DIR, 'luts')
+# Сколько загруженных LUT держать в памяти: узлы 33^3 занимают около 700 КБ
+LUT_CACHE_SIZE = 8
+# Сколько пикселей обрабатывать за раз, чтобы временные буферы оставались в кэше процессора
+BAND_PIXELS = 1 << 13
+# Узлы хранятся в фиксированной точке, все три канала в одном int64 по 21 бит:
+# значение узла умножено на 8, вес вершины - на 1024, поэтому взвешенная сумма
+# узлов (не больше 255 * 8 * 1024) не выходит за поле своего канала, и одно
+# умножение на вес интерполирует сразу три канала
+_FIELD_BITS = 21
+_NODE_BITS = 3
+_WEIGHT_BITS = 10
+# Ключ значения канала: вес верхнего узла, шаг индекса по оси и смещение
+# нижнего узла в полях по 24 бита
+_KEY_BITS = 24
+_KEY_MASK = (1 << _KEY_BITS) - 1
+
+
+def _read_png(path):
+    # Необязательная зависимость: нужен пакет Pillow
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGB'), dtype=np.uint8)
+
+
+def parse_lut_image(pixels):
+    """
+    Превращает изображение LUT в таблицу (N, N, N, 3) float32 с индексами [b, g, r].
+
+    Поддерживаются HALD (квадрат L^3 x L^3, N = L^2, красный меняется
+    быстрее всего) и полоса из N квадратов N x N по горизонтали или вертикали.
+    """
+    height, width = pixels.shape[:2]
+
+    size = round((width * height) ** (1 / 3))
+    if width == height and size ** 3 == width * height and round(size ** 0.5) ** 2 == size:
+        # HALD: пиксели по порядку - это ячейки куба, r быстрее всего, затем g, затем b
+        return pixels.reshape(size, size, size, 3).astype(np.float32)
+
+    if width == height * height:
+        # Горизонтальная полоса: x = b * N + r, y = g
+        size = height
+        return pixels.reshape(size, size, size, 3).transpose(1, 0, 2, 3).astype(np.float32)
+
+    if height == width * width:
+        # Вертикальная полоса: y = b * N + g, x = r
+        size = width
+        return pixels.reshape(size, size, size, 3).astype(np.float32)
+
+    raise ValueError(f"Неизвестный формат LUT {width}x{height}: ожидается HALD или полоса N*N x N")
+
+
+def _axis_weights(size):
+    """Для каждого 8-битного значения: индекс нижнего узла сетки и доля до верхнего."""
+    position = np.arange(256, dtype=np.float64) * (size - 1) / 255
+    lower = np.minimum(position.astype(np.intp), size - 2)
+    fraction = (position - lower).astype(np.float32)
+    return lower, fraction
+
+
+class Lut:
+    """
+    Трехмерная таблица цветокоррекции.
+
+    Кадр интерполируется тетраэдрически прямо по узлам N x N x N: куб
+    вокруг цвета делится на шесть тетраэдров, и цвет - взвешенная сумма
+    четырех вершин своего тетраэдра. Индекс нижнего узла и доля до
+    верхнего для каждого 8-битного значения берутся из заранее
+    посчитанных таблиц, без деления на пиксель.
+
+    Для каждого канала заранее строится таблица ключей на 256 значений:
+    вес верхнего узла, шаг индекса по оси и смещение нижнего узла. Максимум
+    и минимум ключей пикселя сразу дают порядок долей, то есть тетраэдр, а
+    сумма - индекс нижнего узла. Узлы упакованы в int64 в фиксированной
+    точке, поэтому выборка вершины и умножение на вес идут сразу по трем
+    каналам. Кадр обрабатывается полосами по BAND_PIXELS пикселей.
+
+    Args:
+        table (numpy.ndarray): Узлы (N, N, N, 3) с индексами [b, g, r], значения 0-255.
+        name (str, optional): Имя пресета для логов.
+    """
+
+    def __init__(self, table, name=None):
+        table = np.asarray(table, dtype=np.float32)
+        if table.ndim != 4 or table.shape[3] != 3 or len(set(table.shape[:3])) != 1 or table.shape[0] < 2:
+            raise ValueError(f"Ожидается таблица (N, N, N, 3), получено {table.shape}")
+        self.table = table
+        self.name = name
+        self.size = size = table.shape[0]
+
+        # Узел (b, g, r) лежит по индексу (b * N + g) * N + r
+        nodes = np.rint(np.clip(table, 0, 255) * (1 << _NODE_BITS)).astype(np.int64).reshape(-1, 3)
+        self._nodes = nodes[:, 0] | nodes[:, 1] << _FIELD_BITS | nodes[:, 2] << 2 * _FIELD_BITS
+
+        lower, fraction = _axis_weights(size)
+        weight = np.rint(fraction * (1 << _WEIGHT_BITS)).astype(np.int64)
+        # При равных долях порядок задает шаг, поэтому у максимума и минимума оси всегда разные
+        self._keys = [weight << 2 * _KEY_BITS | step << _KEY_BITS | lower * step for step in (1, size, size * size)]
+        # Шаг от нижнего узла к противоположной вершине куба
+        self._diagonal = 1 + size + size * size
+
+    def apply(self, frame, out=None):
+        """
+        Применяет цветокоррекцию к кадру RGB uint8 (высота, ширина, 3).
+
+        Args:
+            frame (numpy.ndarray): Исходный кадр.
+            out (numpy.ndarray, optional): Буфер для результата; может совпадать с frame.
+
+        Returns:
+            numpy.ndarray: Кадр после цветокоррекции.
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.ndim != 3 or frame.shape[2] != 3:
+            raise ValueError(f"Ожидается кадр RGB (высота, ширина, 3), получено {frame.shape}")
+        if out is None:
+            out = np.empty_like(frame)
+
+        pixels = frame.reshape(-1, 3)
+        result = out.reshape(-1, 3)
+        band = min(BAND_PIXELS, len(pixels))
+        keys = np.empty((3, band), dtype=np.int64)
+        high, low, middle, base, index, weight, corner, total = np.empty((8, band), dtype=np.int64)
+        nodes = self._nodes
+        one = 1 << _WEIGHT_BITS
+        shift = _NODE_BITS + _WEIGHT_BITS
+        rounding = (1 << shift - 1) * (1 | 1 << _FIELD_BITS | 1 << 2 * _FIELD_BITS)
+
+        for start in range(0, len(pixels), band):
+            source = pixels[start:start + band]
+            count = len(source)
+            if count < band:
+                keys = keys[:, :count]
+                high, low, middle, base, index, weight, corner, total = (
+                    buffer[:count] for buffer in (high, low, middle, base, index, weight, corner, total)
+                )
+
+            for channel, (key, table) in enumerate(zip(keys, self._keys)):
+                np.take(table, source[:, channel], out=key, mode='clip')
+            red, green, blue = keys
+            np.maximum(red, green, out=high)
+            np.maximum(high, blue, out=high)
+            np.minimum(red, green, out=low)
+            np.minimum(low, blue, out=low)
+            np.add(red, green, out=base)
+            base += blue
+            np.subtract(base, high, out=middle)
+            middle -= low
+            base &= _KEY_MASK
+
+            # Нижний узел с весом 1 - max(доли)
+            np.take(nodes, base, out=corner, mode='clip')
+            np.right_shift(high, 2 * _KEY_BITS, out=weight)
+            np.subtract(one, weight, out=weight)
+            np.multiply(corner, weight, out=total)
+
+            # Шаг по оси с наибольшей долей, вес max - mid
+            np.right_shift(high, _KEY_BITS, out=index)
+            index &= _KEY_MASK
+            index += base
+            np.take(nodes, index, out=corner, mode='clip')
+            high >>= 2 * _KEY_BITS
+            middle >>= 2 * _KEY_BITS
+            np.subtract(high, middle, out=weight)
+            corner *= weight
+            total += corner
+
+            # Шаги по двум осям с наибольшими долями, вес mid - min
+            np.right_shift(low, _KEY_BITS, out=index)
+            index &= _KEY_MASK
+            np.subtract(base, index, out=index)
+            index += self._diagonal
+            np.take(nodes, index, out=corner, mode='clip')
+            low >>= 2 * _KEY_BITS
+            np.subtract(middle, low, out=weight)
+            corner *= weight
+            total += corner
+
+            # Противоположная вершина куба с весом min(доли)
+            base += self._diagonal
+            np.take(nodes, base, out=corner, mode='clip')
+            corner *= low
+            total += corner
+
+            # Округление и распаковка каналов: младшие 8 бит каждого поля
+            total += rounding
+            total >>= shift
+            target = result[start:start + count]
+            for channel in range(3):
+                target[:, channel] = total
+                total >>= _FIELD_BITS
+
+        return out
+
+
+@functools.lru_cache(maxsize=LUT_CACHE_SIZE)
+def _load_cached(path, mtime):
+    return Lut(parse_lut_image(_read_png(path)), name=os.path.basename(path))
+
+
+def load_lut(path):
+    """Загружает LUT из PNG; повторные загрузки берутся из LRU-кэша, пока файл не изменился."""
+    return _load_cached(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def preset_names(list_path=LUT_LIST):
+    """Имена пресетов из файла со списком LUT (без расширения .png)."""
+    with open(list_path, encoding='utf-8') as handle:
+        return [os.path.splitext(line.strip())[0] for line in handle if line.strip()]
+
+
+def preset_path(name, list_path=LUT_LIST):
+    """Путь к PNG пресета: файлы лежат рядом со списком."""
+    return os.path.join(os.path.dirname(list_path), f"{name}.png")
+
+
+def load_preset(name, list_path=LUT_LIST):
+    """
+    Загружает пресет по имени, например 'neo_noir'.
+
+    Raises:
+        KeyError: Если пресета нет в списке.
+    """
+    if name not in preset_names(list_path):
+        raise KeyError(f"Неизвестный пресет LUT: {name}")
+    return load_lut(preset_path(name, list_path))
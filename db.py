@@ -0,0 +1,866 @@
+import asyncio
+import datetime
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DB_PATH = 'movie_bot.db'
+
+# Рекомендация в том виде, в котором она показывается пользователю
+Recommendation = namedtuple('Recommendation', ['id', 'title', 'genre', 'depth', 'features', 'type'])
+RECOMMENDATION_COLUMNS = 'id, title, genre, depth, features, type'
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений SQLite с выделенным пулом потоков.
+
+    Запросы выполняются в отдельных потоках, поэтому event loop aiogram
+    не блокируется медленными записями. Каждое соединение открывается в
+    режиме WAL и держит собственный кэш подготовленных выражений.
+
+    Args:
+        path (str): Путь к файлу базы данных.
+        size (int): Максимальное количество соединений (и потоков).
+        statement_cache (int): Размер кэша подготовленных выражений на соединение.
+        initializer (callable, optional): Вызывается с первым открытым соединением,
+            например для создания схемы, до того как пул начнет выдавать соединения.
+    """
+
+    def __init__(self, path=DB_PATH, size=4, statement_cache=256, initializer=None):
+        self.path = path
+        self.size = size
+        self.statement_cache = statement_cache
+        self.initializer = initializer
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=self.statement_cache
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise RuntimeError('Пул соединений закрыт')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        # Новое соединение создаем лениво, пока не достигнут предел пула
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+                if self.initializer is not None:
+                    # Первое соединение готовит базу; остальные потоки ждут на блокировке
+                    try:
+                        self.initializer(conn)
+                        conn.commit()
+                    except Exception:
+                        conn.close()
+                        self._created -= 1
+                        raise
+                    self.initializer = None
+                return conn
+        return self._idle.get()
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Синхронно выдает соединение из пула в рамках одной транзакции.
+
+        Используется при старте приложения и внутри рабочих потоков.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def _call(self, func, args):
+        with self.connection() as conn:
+            return func(conn, *args)
+
+    async def run(self, func, *args):
+        """
+        Выполняет func(conn, *args) в выделенном потоке и ожидает результат.
+
+        Args:
+            func (callable): Функция, принимающая соединение первым аргументом.
+            *args: Дополнительные аргументы для func.
+
+        Returns:
+            Результат вызова func.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='sqlite')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def execute(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.run(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    def close(self):
+        """Закрывает все свободные соединения и останавливает пул потоков."""
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Вес редакционного рейтинга в голосах: пока отзывов заметно меньше,
+# рейтинг остается близким к редакционному и не скачет от одного голоса
+RATING_PRIOR_WEIGHT = 20
+
+# Рейтинг по формуле байесовского среднего: редакционная оценка считается
+# RATING_PRIOR_WEIGHT голосами, лайк - голосом за 10, дизлайк - за 0
+RATING_EXPRESSION = (
+    '(:prior * COALESCE(editorial_rating, rating) + 10.0 * (likes + :likes))'
+    ' / (:prior + likes + :likes + dislikes + :dislikes)'
+)
+
+# Версия схемы в PRAGMA user_version: при совпадении init_db ничего не делает
+SCHEMA_VERSION = 1
+
+# Вторичные индексы каталога; импорт удаляет их на время загрузки и строит заново
+CONTENT_INDEXES = {
+    'idx_content_genre_lookup':
+        'CREATE INDEX IF NOT EXISTS idx_content_genre_lookup ON content_genre (genre, depth, rating DESC, content_id)',
+    'idx_content_depth_rating': 'CREATE INDEX IF NOT EXISTS idx_content_depth_rating ON content (depth, rating)',
+    'idx_content_rating': 'CREATE INDEX IF NOT EXISTS idx_content_rating ON content (rating)',
+}
+
+# Общий пул соединений для всех обращений к movie_bot.db;
+# схема создается при первом обращении, а не при импорте
+pool = ConnectionPool(initializer=lambda conn: init_db(conn))
+
+
+# Подключение к базе данных SQLite
+def init_db(conn):
+    # Схема уже актуальна: не трогаем таблицы и демонстрационные данные
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    cursor = conn.cursor()
+
+    # Создание таблицы пользователей, если она не существует
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        preferences TEXT,
+        history TEXT,
+        interaction_count INTEGER DEFAULT 0,
+        last_interaction TIMESTAMP
+    )
+    ''')
+
+    # Создание таблицы фильмов/аниме, если она не существует
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        genre TEXT,
+        depth TEXT,
+        features TEXT,
+        type TEXT,
+        description TEXT,
+        rating REAL DEFAULT 0,
+        likes INTEGER DEFAULT 0,
+        dislikes INTEGER DEFAULT 0,
+        year INTEGER,
+        editorial_rating REAL,
+        dedup_key TEXT
+    )
+    ''')
+
+    # Старые базы: редакционный рейтинг хранился только в rating
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(content)')}
+    editorial_added = 'editorial_rating' not in columns
+    if editorial_added:
+        cursor.execute('ALTER TABLE content ADD COLUMN editorial_rating REAL')
+    if 'dedup_key' not in columns:
+        cursor.execute('ALTER TABLE content ADD COLUMN dedup_key TEXT')
+
+    # Создание таблицы для хранения взаимодействий пользователей
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_interactions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        content_id INTEGER,
+        interaction_type TEXT,
+        timestamp TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id),
+        FOREIGN KEY (content_id) REFERENCES content (id)
+    )
+    ''')
+
+    # Индекс для быстрого получения истории пользователя
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_user_interactions_user_time
+    ON user_interactions (user_id, timestamp)
+    ''')
+
+    # Нормализованные таблицы тегов: первичный ключ (тег, content_id) сам
+    # является индексом для проверки тега. Глубина и рейтинг продублированы
+    # в content_genre, чтобы подбор по жанру и глубине в порядке рейтинга
+    # читал только покрывающий индекс idx_content_genre_lookup
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content_genre (
+        genre TEXT NOT NULL,
+        content_id INTEGER NOT NULL,
+        depth TEXT,
+        rating REAL,
+        PRIMARY KEY (genre, content_id),
+        FOREIGN KEY (content_id) REFERENCES content (id)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content_feature (
+        feature TEXT NOT NULL,
+        content_id INTEGER NOT NULL,
+        PRIMARY KEY (feature, content_id),
+        FOREIGN KEY (content_id) REFERENCES content (id)
+    ) WITHOUT ROWID
+    ''')
+
+    # По content_id теги пересобираются при импорте и обновляется рейтинг после отзывов
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_genre_content ON content_genre (content_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_feature_content ON content_feature (content_id)')
+
+    # Версия каталога: импорт и пересчет рейтингов увеличивают ее, а индексы
+    # в памяти других процессов по ней понимают, что пора перезагрузиться
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)')
+
+    # Названия, предложенные DeepSeek, но не найденные в каталоге
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS unresolved_titles (
+        title TEXT PRIMARY KEY,
+        mentions INTEGER DEFAULT 1,
+        first_seen TIMESTAMP,
+        last_seen TIMESTAMP
+    )
+    ''')
+
+    # Похожие тайтлы по оценкам пользователей (заполняет item_neighbors.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content_neighbors (
+        content_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        neighbor_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (content_id, rank)
+    ) WITHOUT ROWID
+    ''')
+
+    # Индексы по тегам, для фильтра по глубине и сортировки по рейтингу
+    for sql in CONTENT_INDEXES.values():
+        cursor.execute(sql)
+
+    # Добавим несколько фильмов и аниме для примера (расширенная информация)
+    sample_content = [
+        (1, 'Начало', 'sci-fi,thriller', 'deep', 'action,mystery', 'movie',
+         'Фильм о воре, который крадет корпоративные секреты через использование технологии совместного сна.', 8.8, 0, 0, 2010),
+        (2, 'Ла-Ла Ленд', 'romance,drama', 'light', 'music,romance', 'movie',
+         'Музыкальная история любви джазового пианиста и начинающей актрисы в Лос-Анджелесе.', 8.0, 0, 0, 2016),
+        (3, 'Атака титанов', 'action,fantasy', 'deep', 'action,drama', 'anime',
+         'Аниме-сериал о борьбе человечества против гигантских людоедов в постапокалиптическом мире.', 9.0, 0, 0, 2013),
+        (4, 'Твоё имя', 'romance,fantasy', 'medium', 'romance,drama', 'anime',
+         'История о двух подростках, которые обнаруживают, что таинственным образом меняются телами.', 8.4, 0, 0, 2016),
+        (5, 'Джон Уик', 'action,thriller', 'light', 'action,violence', 'movie',
+         'Бывший наемный убийца вынужден вернуться к своему темному прошлому, чтобы отомстить.', 7.4, 0, 0, 2014),
+        (6, 'Интерстеллар', 'sci-fi,drama', 'deep', 'space,science', 'movie',
+         'Фильм о группе исследователей, которые используют недавно обнаруженный пространственный тоннель, чтобы преодолеть ограничения космических путешествий.', 8.6, 0, 0, 2014),
+        (7, 'Ванпанчмен', 'comedy,action', 'light', 'action,humor', 'anime',
+         'Аниме о супергерое, который может победить любого противника одним ударом и страдает от этого.', 8.8, 0, 0, 2015),
+        (8, 'Паразит', 'horror,sci-fi', 'deep', 'horror,drama', 'anime',
+         'Аниме о паразитических существах, которые захватывают и контролируют мозг людей.', 8.5, 0, 0, 2014),
+        (9, 'Шрек', 'comedy,fantasy', 'light', 'humor,romance', 'movie',
+         'Анимационный фильм о приключениях огра и его друзей в сказочном королевстве.', 7.9, 0, 0, 2001),
+        (10, 'Унесённые призраками', 'fantasy,adventure', 'medium', 'fantasy,drama', 'anime',
+         'Аниме о девочке, которая попадает в мир духов и должна найти способ спасти своих родителей.', 8.6, 0, 0, 2001),
+        (11, 'Пульп Фикшн', 'crime,drama', 'deep', 'violence,humor', 'movie',
+         'Нелинейное повествование о криминальном мире Лос-Анджелеса.', 8.9, 0, 0, 1994),
+        (12, 'Ковбой Бибоп', 'sci-fi,action', 'medium', 'action,space', 'anime',
+         'Аниме о группе охотников за головами в космосе будущего.', 8.9, 0, 0, 1998),
+        (13, 'Тёмный рыцарь', 'action,crime', 'deep', 'action,drama', 'movie',
+         'Фильм о борьбе Бэтмена с криминальным гением Джокером.', 9.0, 0, 0, 2008),
+        (14, 'Твин Пикс', 'mystery,drama', 'deep', 'mystery,horror', 'movie',
+         'Сериал о расследовании убийства молодой девушки в маленьком городке.', 8.8, 0, 0, 1990),
+        (15, 'Клинок, рассекающий демонов', 'action,fantasy', 'medium', 'action,drama', 'anime',
+         'Аниме о мальчике, который становится охотником на демонов после того, как его семья была убита.', 8.7, 0, 0, 2019)
+    ]
+
+    cursor.executemany('''
+    INSERT OR IGNORE INTO content (id, title, genre, depth, features, type, description, rating, likes, dislikes, year)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', sample_content)
+
+    # Исходный рейтинг нового контента становится редакционным
+    cursor.execute('UPDATE content SET editorial_rating = rating WHERE editorial_rating IS NULL')
+    if editorial_added:
+        recompute_ratings(conn)
+
+    # Ключ для поиска дублей при импорте: нормализованное название и год
+    fill_dedup_keys(conn)
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_content_dedup_key ON content (dedup_key)')
+
+    migrate_history_blobs(conn)
+    sync_content_tags(conn)
+
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+# Ключ дедупликации каталога
+def content_key(title, year):
+    # title_index импортирует db, поэтому нормализация подключается при вызове
+    from title_index import normalize_title
+    return f"{normalize_title(title or '')}|{year or ''}"
+
+
+# Отпечаток каталога: меняется с каждым импортом, в том числе обновляющим
+# существующие записи, и с каждым полным пересчетом рейтингов
+def catalog_stamp(conn):
+    return conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()
+
+
+def bump_catalog_version(conn):
+    conn.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+
+
+def fill_dedup_keys(conn):
+    """
+    Заполняет content.dedup_key так, чтобы ключи были уникальны.
+
+    В базах до уникального индекса один тайтл мог быть записан несколько
+    раз. Такие записи не сливаются, потому что на них ссылаются отзывы и
+    соседи: ключ получает первая по id, у остальных он дополняется
+    суффиксом #id, и импорт затем обновляет первую запись.
+    """
+    updates = []
+
+    # Совпадающие ключи, записанные без уникального индекса
+    taken = set()
+    for content_id, key in conn.execute('''
+        SELECT id, dedup_key FROM content
+        WHERE dedup_key IN (SELECT dedup_key FROM content GROUP BY dedup_key HAVING COUNT(*) > 1)
+        ORDER BY id
+    '''):
+        if key in taken:
+            updates.append((f'{key}#{content_id}', content_id))
+        taken.add(key)
+
+    taken = {row[0] for row in conn.execute('SELECT dedup_key FROM content WHERE dedup_key IS NOT NULL')}
+    for content_id, title, year in conn.execute('SELECT id, title, year FROM content WHERE dedup_key IS NULL ORDER BY id'):
+        key = content_key(title, year)
+        if key in taken:
+            key = f'{key}#{content_id}'
+        taken.add(key)
+        updates.append((key, content_id))
+
+    conn.executemany('UPDATE content SET dedup_key = ? WHERE id = ?', updates)
+    duplicates = sum('#' in key for key, _ in updates)
+    if duplicates:
+        logging.warning(f"Дублей каталога по названию и году: {duplicates}, их ключ дополнен id записи")
+
+
+# Перенос устаревших JSON-блобов users.history в user_interactions
+def migrate_history_blobs(conn):
+    cursor = conn.cursor()
+
+    rows = cursor.execute(
+        "SELECT user_id, history FROM users WHERE history IS NOT NULL AND history NOT IN ('', '[]')"
+    ).fetchall()
+
+    if not rows:
+        return
+
+    migrated = 0
+    for user_id, history in rows:
+        try:
+            entries = json.loads(history)
+        except ValueError:
+            logging.warning(f"Не удалось разобрать историю пользователя {user_id}, запись пропущена")
+            continue
+
+        for entry in entries:
+            # Старый код писал каждую запись и в блоб, и в user_interactions,
+            # поэтому переносим только отсутствующие записи
+            cursor.execute('''
+                INSERT INTO user_interactions (user_id, content_id, interaction_type, timestamp)
+                SELECT ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM user_interactions
+                    WHERE user_id = ? AND content_id = ? AND timestamp = ?
+                )
+            ''', (user_id, entry.get('content_id'), entry.get('feedback'), entry.get('timestamp'),
+                  user_id, entry.get('content_id'), entry.get('timestamp')))
+            migrated += cursor.rowcount
+
+    # Блобы больше не нужны: история читается только из user_interactions
+    cursor.execute("UPDATE users SET history = NULL WHERE history IS NOT NULL")
+    logging.info(f"Перенесено записей истории в user_interactions: {migrated}")
+
+
+# Разбиение строки тегов через запятую на нормализованные значения
+def split_tags(value):
+    if not value:
+        return []
+    return [tag for tag in (part.strip().lower() for part in value.split(',')) if tag]
+
+
+# Заполнение таблиц тегов для контента, которого в них еще нет
+def sync_content_tags(conn, content_ids=None):
+    """
+    Переносит теги из строк content.genre и content.features в таблицы
+    content_genre и content_feature вместе с глубиной и рейтингом.
+
+    Args:
+        conn (sqlite3.Connection): Соединение с базой данных.
+        content_ids (list, optional): Пересобрать теги только этих записей.
+            По умолчанию обрабатывается весь контент без тегов.
+    """
+    cursor = conn.cursor()
+
+    if content_ids is None:
+        rows = cursor.execute('''
+            SELECT c.id, c.genre, c.depth, c.features, c.rating
+            FROM content c
+            WHERE NOT EXISTS (SELECT 1 FROM content_genre g WHERE g.content_id = c.id)
+              AND NOT EXISTS (SELECT 1 FROM content_feature f WHERE f.content_id = c.id)
+        ''').fetchall()
+    else:
+        ids = list(content_ids)
+        if not ids:
+            return
+        placeholders = ','.join(['?'] * len(ids))
+        cursor.execute(f'DELETE FROM content_genre WHERE content_id IN ({placeholders})', ids)
+        cursor.execute(f'DELETE FROM content_feature WHERE content_id IN ({placeholders})', ids)
+        rows = cursor.execute(
+            f'SELECT id, genre, depth, features, rating FROM content WHERE id IN ({placeholders})', ids
+        ).fetchall()
+
+    cursor.executemany(
+        'INSERT OR IGNORE INTO content_genre (genre, content_id, depth, rating) VALUES (?, ?, ?, ?)',
+        [(tag, content_id, depth, rating) for content_id, genre, depth, _, rating in rows for tag in split_tags(genre)]
+    )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO content_feature (feature, content_id) VALUES (?, ?)',
+        [(tag, content_id) for content_id, _, _, features, _ in rows for tag in split_tags(features)]
+    )
+
+
+# Перенос рейтинга из content в таблицу тегов
+def _sync_tag_ratings(cursor, ratings):
+    cursor.executemany(
+        'UPDATE content_genre SET rating = ? WHERE content_id = ?',
+        [(rating, content_id) for content_id, rating in ratings.items()]
+    )
+
+
+# Функция для сохранения предпочтений пользователя
+def _save_user_preferences(conn, user_id, preferences):
+    current_time = datetime.datetime.now().isoformat()
+
+    # UPSERT вместо отдельных SELECT + INSERT/UPDATE
+    conn.execute('''
+        INSERT INTO users (user_id, preferences, interaction_count, last_interaction)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            preferences = excluded.preferences,
+            interaction_count = interaction_count + 1,
+            last_interaction = excluded.last_interaction
+    ''', (user_id, json.dumps(preferences), current_time))
+
+
+async def save_user_preferences(user_id, preferences):
+    await pool.run(_save_user_preferences, user_id, preferences)
+
+
+# Применение пачки отзывов одной транзакцией
+def _apply_feedback_batch(conn, events):
+    """
+    Записывает пачку отзывов и обновляет счетчики контента.
+
+    Взаимодействия вставляются через executemany, а приращения лайков и
+    дизлайков предварительно суммируются по контенту, поэтому число
+    выражений не зависит от того, сколько раз подряд оценивали один тайтл.
+
+    Args:
+        conn (sqlite3.Connection): Соединение с базой данных.
+        events (list): Кортежи (user_id, content_id, feedback, timestamp).
+
+    Returns:
+        dict: Новый рейтинг для каждого затронутого content_id.
+    """
+    cursor = conn.cursor()
+
+    # Отзывы о несуществующем контенте или от неизвестных пользователей не сохраняем:
+    # одно такое событие не должно откатывать всю пачку
+    content_ids = list({event[1] for event in events})
+    placeholders = ','.join(['?'] * len(content_ids))
+    existing = {row[0] for row in cursor.execute(f'SELECT id FROM content WHERE id IN ({placeholders})', content_ids)}
+    user_ids = list({event[0] for event in events})
+    placeholders = ','.join(['?'] * len(user_ids))
+    known = {row[0] for row in cursor.execute(f'SELECT user_id FROM users WHERE user_id IN ({placeholders})', user_ids)}
+    unknown_content = sum(event[1] not in existing for event in events)
+    unknown_users = sum(event[1] in existing and event[0] not in known for event in events)
+    if unknown_content or unknown_users:
+        logging.warning(
+            f"Пропущено отзывов: {unknown_content} о неизвестном контенте, "
+            f"{unknown_users} от неизвестных пользователей"
+        )
+        events = [event for event in events if event[1] in existing and event[0] in known]
+    if not events:
+        return {}
+
+    # История хранится только в user_interactions: одна вставка на отзыв вместо
+    # перезаписи всего JSON-блоба
+    cursor.executemany(
+        'INSERT INTO user_interactions (user_id, content_id, interaction_type, timestamp) VALUES (?, ?, ?, ?)',
+        events
+    )
+
+    deltas = {}
+    for _, content_id, feedback, _ in events:
+        likes, dislikes = deltas.get(content_id, (0, 0))
+        deltas[content_id] = (likes + (feedback == 'like'), dislikes + (feedback == 'dislike'))
+
+    # Обновляем счетчики и рейтинг одним выражением: в SET используются
+    # старые значения likes и dislikes, поэтому приращения учитываются явно
+    cursor.executemany(
+        f'''
+        UPDATE content
+        SET likes = likes + :likes,
+            dislikes = dislikes + :dislikes,
+            rating = {RATING_EXPRESSION}
+        WHERE id = :id
+        ''',
+        [
+            {'id': content_id, 'likes': likes, 'dislikes': dislikes, 'prior': RATING_PRIOR_WEIGHT}
+            for content_id, (likes, dislikes) in deltas.items()
+        ]
+    )
+
+    placeholders = ','.join(['?'] * len(deltas))
+    ratings = dict(cursor.execute(f'SELECT id, rating FROM content WHERE id IN ({placeholders})', list(deltas)))
+
+    # Подбор по таблицам тегов сортирует по их копии рейтинга
+    _sync_tag_ratings(cursor, ratings)
+    return ratings
+
+
+async def apply_feedback_batch(events):
+    return await pool.run(_apply_feedback_batch, list(events))
+
+
+# Полный пересчет рейтингов каталога
+def recompute_ratings(conn, recount=False):
+    """
+    Пересчитывает рейтинг всего каталога одним UPDATE.
+
+    Args:
+        conn (sqlite3.Connection): Соединение с базой данных.
+        recount (bool): Сначала заново посчитать лайки и дизлайки по user_interactions.
+
+    Returns:
+        int: Число обновленных записей.
+    """
+    cursor = conn.cursor()
+
+    if recount:
+        cursor.execute('''
+            UPDATE content
+            SET likes = COALESCE(counts.likes, 0), dislikes = COALESCE(counts.dislikes, 0)
+            FROM (
+                SELECT content_id, SUM(interaction_type = 'like') AS likes, SUM(interaction_type = 'dislike') AS dislikes
+                FROM user_interactions
+                GROUP BY content_id
+            ) AS counts
+            WHERE counts.content_id = content.id
+        ''')
+        cursor.execute('''
+            UPDATE content SET likes = 0, dislikes = 0
+            WHERE (likes != 0 OR dislikes != 0)
+              AND NOT EXISTS (SELECT 1 FROM user_interactions WHERE content_id = content.id)
+        ''')
+
+    cursor.execute(
+        f'UPDATE content SET rating = {RATING_EXPRESSION}',
+        {'likes': 0, 'dislikes': 0, 'prior': RATING_PRIOR_WEIGHT}
+    )
+    updated = cursor.rowcount
+
+    cursor.execute('''
+        UPDATE content_genre SET rating = content.rating
+        FROM content
+        WHERE content.id = content_genre.content_id AND content_genre.rating IS NOT content.rating
+    ''')
+    bump_catalog_version(conn)
+    return updated
+
+
+# Функция для получения истории пользователя с деталями контента
+def _get_user_history_details(conn, user_id, limit=10):
+    cursor = conn.cursor()
+
+    # Получаем взаимодействия пользователя с деталями контента
+    cursor.execute('''
+        SELECT
+            ui.content_id,
+            c.title,
+            c.genre,
+            c.type,
+            ui.interaction_type,
+            ui.timestamp
+        FROM
+            user_interactions ui
+        JOIN
+            content c ON ui.content_id = c.id
+        WHERE
+            ui.user_id = ?
+        ORDER BY
+            ui.timestamp DESC
+        LIMIT ?
+    ''', (user_id, limit))
+
+    # Преобразуем в список словарей для удобства использования
+    detailed_history = []
+    for item in cursor.fetchall():
+        detailed_history.append({
+            'content_id': item[0],
+            'title': item[1],
+            'genre': item[2],
+            'type': item[3],
+            'feedback': item[4],
+            'timestamp': item[5]
+        })
+
+    return detailed_history
+
+
+async def get_user_history_details(user_id, limit=10):
+    return await pool.run(_get_user_history_details, user_id, limit)
+
+
+# Последние оценки пользователя для построения вектора вкуса
+def _get_user_feedback(conn, user_id, limit=200):
+    return conn.execute('''
+        SELECT content_id, interaction_type
+        FROM user_interactions
+        WHERE user_id = ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+    ''', (user_id, limit)).fetchall()
+
+
+async def get_user_feedback(user_id, limit=200):
+    return await pool.run(_get_user_feedback, user_id, limit)
+
+
+# Похожие тайтлы для «потому что вам понравилось X»
+def _get_content_neighbors(conn, content_id, limit=10):
+    return conn.execute(
+        'SELECT neighbor_id, score FROM content_neighbors WHERE content_id = ? ORDER BY rank LIMIT ?',
+        (content_id, limit)
+    ).fetchall()
+
+
+async def get_content_neighbors(content_id, limit=10):
+    return await pool.run(_get_content_neighbors, content_id, limit)
+
+
+# Все ID контента, который пользователь уже оценивал
+def _get_seen_content_ids(conn, user_id):
+    rows = conn.execute(
+        'SELECT DISTINCT content_id FROM user_interactions WHERE user_id = ?',
+        (user_id,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+async def get_seen_content_ids(user_id):
+    return await pool.run(_get_seen_content_ids, user_id)
+
+
+# Подбор контента по предпочтениям через таблицы тегов
+def _find_content_ids(conn, preferences, exclude_ids, limit):
+    """
+    Возвращает до limit ID контента с наивысшим рейтингом под предпочтения.
+
+    Теги сравниваются точно, а не через LIKE '%...%', поэтому 'action' не
+    находится внутри других тегов. При заданном жанре запрос проходит
+    покрывающий индекс idx_content_genre_lookup в порядке рейтинга и
+    останавливается на limit-й подходящей записи, не читая таблицу content.
+    """
+    genre = preferences.get('genre', '').strip().lower()
+    depth = preferences.get('depth', '')
+    features = preferences.get('features', '').strip().lower()
+    content_type = preferences.get('type', '')
+
+    # Глубина и рейтинг есть в обеих таблицах, поэтому фильтры общие
+    if genre:
+        query = 'SELECT content_id FROM content_genre WHERE genre = ?'
+        params = [genre]
+        key = 'content_genre.content_id'
+    else:
+        query = 'SELECT id FROM content WHERE 1=1'
+        params = []
+        key = 'content.id'
+
+    if depth:
+        query += ' AND depth = ?'
+        params.append(depth)
+
+    if features:
+        query += f' AND EXISTS (SELECT 1 FROM content_feature f WHERE f.feature = ? AND f.content_id = {key})'
+        params.append(features)
+
+    if content_type:
+        query += f' AND EXISTS (SELECT 1 FROM content c WHERE c.id = {key} AND c.type = ?)'
+        params.append(content_type)
+
+    # Исключаем уже просмотренные фильмы
+    if exclude_ids:
+        query += f' AND {key} NOT IN ({",".join(["?"] * len(exclude_ids))})'
+        params.extend(exclude_ids)
+
+    # Порядок как у CatalogIndex: по убыванию рейтинга, при равенстве - по id
+    query += f' ORDER BY rating DESC, {key} LIMIT ?'
+    params.append(limit)
+
+    return [row[0] for row in conn.execute(query, params)]
+
+
+async def find_content_ids(preferences, exclude_ids=(), limit=10):
+    return await pool.run(_find_content_ids, preferences, list(exclude_ids), limit)
+
+
+# Получение контента по списку ID с сохранением порядка
+def _get_content_by_ids(conn, content_ids):
+    if not content_ids:
+        return []
+
+    placeholders = ','.join(['?'] * len(content_ids))
+    rows = conn.execute(f'''
+    SELECT {RECOMMENDATION_COLUMNS}
+    FROM content
+    WHERE id IN ({placeholders})
+    ''', content_ids).fetchall()
+
+    by_id = {row[0]: Recommendation._make(row) for row in rows}
+    return [by_id[content_id] for content_id in content_ids if content_id in by_id]
+
+
+async def get_content_by_ids(content_ids):
+    return await pool.run(_get_content_by_ids, list(content_ids))
+
+
+# Сохранение ненайденных в каталоге названий для последующего пополнения
+def _stage_unresolved_titles(conn, titles):
+    current_time = datetime.datetime.now().isoformat()
+
+    conn.executemany('''
+        INSERT INTO unresolved_titles (title, mentions, first_seen, last_seen)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT(title) DO UPDATE SET
+            mentions = mentions + 1,
+            last_seen = excluded.last_seen
+    ''', [(title, current_time, current_time) for title in titles])
+
+
+async def stage_unresolved_titles(titles):
+    if titles:
+        await pool.run(_stage_unresolved_titles, list(titles))
+
+
+# Случайные рекомендации с высоким рейтингом, кроме уже просмотренных
+def _top_rated_content_ids(conn, exclude_ids, limit=3):
+    exclude_clause = f'WHERE id NOT IN ({",".join(["?"] * len(exclude_ids))})' if exclude_ids else ''
+
+    rows = conn.execute(f'''
+    SELECT id
+    FROM content
+    {exclude_clause}
+    ORDER BY rating DESC, RANDOM()
+    LIMIT ?
+    ''', [*exclude_ids, limit]).fetchall()
+
+    return [row[0] for row in rows]
+
+
+async def top_rated_content_ids(exclude_ids=(), limit=3):
+    return await pool.run(_top_rated_content_ids, list(exclude_ids), limit)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных бота')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    recompute_parser = subparsers.add_parser('recompute-ratings', help='Пересчитать рейтинг всего каталога')
+    recompute_parser.add_argument('--recount', action='store_true',
+                                  help='Сначала пересчитать лайки и дизлайки по user_interactions')
+    recompute_parser.add_argument('--db', default=DB_PATH, help='Путь к файлу базы данных')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    maintenance_pool = ConnectionPool(args.db, size=1)
+    with maintenance_pool.connection() as conn:
+        init_db(conn)
+        if args.command == 'recompute-ratings':
+            updated = recompute_ratings(conn, args.recount)
+            logging.info(f"Пересчитан рейтинг записей: {updated}")
+    maintenance_pool.close()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+# Коды ответа, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Простой автоматический выключатель для внешнего API.
+
+    После failure_threshold подряд неудачных вызовов цепь размыкается на
+    reset_timeout секунд, и вызовы сразу отклоняются. По истечении таймаута
+    пропускается один пробный вызов: успех замыкает цепь, неудача снова
+    размыкает её.
+
+    Args:
+        failure_threshold (int): Число подряд идущих ошибок до размыкания.
+        reset_timeout (float): Время в секундах до пробного вызова.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class DeepSeekClient:
+    """
+    Долгоживущий клиент DeepSeek API с пулом соединений.
+
+    Одна сессия aiohttp переиспользует TCP/TLS-соединения между вызовами.
+    Число одновременных запросов ограничено семафором, ответы 429/5xx и
+    сетевые ошибки повторяются с экспоненциальной задержкой и случайным
+    разбросом, а при серии отказов CircuitBreaker временно отключает вызовы,
+    чтобы бот сразу переходил к локальным рекомендациям.
+
+    Args:
+        api_url (str): URL метода chat/completions.
+        api_key (str): API-ключ DeepSeek.
+        max_concurrency (int): Максимум одновременных запросов.
+        timeout (float): Общий таймаут одного запроса в секундах.
+        connect_timeout (float): Таймаут установки соединения в секундах.
+        max_retries (int): Число повторов после первой неудачной попытки.
+        backoff_base (float): Базовая задержка перед повтором в секундах.
+        backoff_max (float): Максимальная задержка перед повтором в секундах.
+        breaker (CircuitBreaker, optional): Выключатель; по умолчанию создается новый.
+    """
+
+    def __init__(self, api_url, api_key, max_concurrency=8, timeout=20.0, connect_timeout=5.0,
+                 max_retries=2, backoff_base=0.5, backoff_max=8.0, breaker=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Полный разброс (full jitter), чтобы повторы клиентов не совпадали
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get('Retry-After')
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    async def chat(self, payload):
+        """
+        Отправляет запрос chat/completions.
+
+        Args:
+            payload (dict): Тело запроса.
+
+        Returns:
+            dict: Ответ API или None, если запрос не удался или цепь разомкнута.
+        """
+        if not self.breaker.allow_request():
+            logging.warning("DeepSeek API временно отключен после серии ошибок")
+            return None
+
+        try:
+            return await self._post_with_retries(payload)
+        except asyncio.CancelledError:
+            # Отмененный вызов не должен навсегда занять пробный слот
+            self.breaker.release_probe()
+            raise
+
+    async def _post_with_retries(self, payload):
+        session = self._get_session()
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    async with session.post(self.api_url, json=payload) as response:
+                        if response.status == 200:
+                            result = await response.json()
+                            self.breaker.record_success()
+                            return result
+
+                        error_text = await response.text()
+                        logging.error(f"DeepSeek API error: {response.status} - {error_text}")
+
+                        if response.status not in RETRY_STATUSES:
+                            # Ошибка запроса, повтор не поможет; сервис при этом доступен
+                            self.breaker.record_success()
+                            return None
+                        retry_after = self._retry_after(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"Error calling DeepSeek API: {e!r}")
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        self.breaker.record_failure()
+        return None
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
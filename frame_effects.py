@@ -0,0 +1,302 @@
+import math
+
+import numpy as np
+
+# Эффекты flashFrameAnimate (video_processor.py) для рендера превью на сервере.
+# Время t везде в миллисекундах от начала анимации, как elapsed в браузере.
+
+
+def load_image(path, size=None):
+    """
+    Загружает изображение как массив RGB (высота, ширина, 3) uint8.
+
+    Args:
+        path (str): Путь к файлу изображения.
+        size (tuple, optional): (ширина, высота) кадра; изображение растягивается, как drawImage.
+    """
+    # Необязательная зависимость: нужен пакет Pillow
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        if size is not None and image.size != tuple(size):
+            image = image.resize(size, Image.BILINEAR)
+        return np.asarray(image, dtype=np.uint8)
+
+
+def _clip(top, left, height, width, frame_height, frame_width):
+    """Пересечение прямоугольника с кадром: срезы кадра и соответствующие срезы заплатки."""
+    y0, x0 = max(top, 0), max(left, 0)
+    y1, x1 = min(top + height, frame_height), min(left + width, frame_width)
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return (slice(y0, y1), slice(x0, x1)), (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+
+
+class Layer:
+    """
+    Слой эффекта: изменяет кадр float32 (высота, ширина, 3) на месте.
+
+    prepare вызывается один раз при известном размере кадра и заранее
+    выделяет маски и рабочие буферы; apply вызывается на каждый кадр и
+    не должен выделять память размером с кадр.
+    """
+
+    def prepare(self, height, width):
+        self.height = height
+        self.width = width
+
+    def apply(self, frame, t):
+        raise NotImplementedError
+
+
+class _PatchLayer(Layer):
+    """Слой, рисующий небольшую заплатку с попиксельной прозрачностью."""
+
+    def _allocate(self, size_y, size_x):
+        self._alpha = np.empty((size_y, size_x), dtype=np.float32)
+        self._keep = np.empty((size_y, size_x, 1), dtype=np.float32)
+        self._add = np.empty((size_y, size_x, 3), dtype=np.float32)
+
+    def _blend(self, frame, top, left, color):
+        # source-over: кадр * (1 - alpha) + цвет * alpha в пределах кадра
+        size_y, size_x = self._alpha.shape
+        clipped = _clip(top, left, size_y, size_x, self.height, self.width)
+        if clipped is None:
+            return
+        region, patch = clipped
+        np.subtract(1.0, self._alpha, out=self._keep[..., 0])
+        np.multiply(self._alpha[..., None], color, out=self._add)
+        target = frame[region]
+        target *= self._keep[patch]
+        target += self._add[patch]
+
+
+class BlinkLayer(Layer):
+    """Моргание: раз в interval мс на duration мс затемняет области глаз."""
+
+    def __init__(self, interval=2000, duration=200, alpha=0.2,
+                 boxes=((0.3, 0.3, 0.15, 0.1), (0.55, 0.3, 0.15, 0.1))):
+        self.interval = interval
+        self.duration = duration
+        self.alpha = alpha
+        self.boxes = boxes
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        self._regions = [
+            (slice(round(height * y), round(height * (y + h))), slice(round(width * x), round(width * (x + w))))
+            for x, y, w, h in self.boxes
+        ]
+
+    def apply(self, frame, t):
+        if t % self.interval < self.duration:
+            for region in self._regions:
+                frame[region] *= 1.0 - self.alpha
+
+
+class WaterLayer(Layer):
+    """Рябь воды: голубая полоса внизу кадра, покачивающаяся по вертикали."""
+
+    def __init__(self, top=0.8, amplitude=5, period=500, color=(0, 100, 255), alpha=0.1):
+        self.top = top
+        self.amplitude = amplitude
+        self.period = period
+        self.color = np.array(color, dtype=np.float32)
+        self.alpha = alpha
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        # Цвет, размноженный на строку: сложение со строкой быстрее, чем с вектором из 3 значений
+        self._row = np.tile(self.color * self.alpha, (width, 1))
+
+    def apply(self, frame, t):
+        offset = math.sin(t / self.period) * self.amplitude
+        region = frame[max(round(self.height * self.top + offset), 0):]
+        region *= 1.0 - self.alpha
+        region += self._row
+
+
+class CloudLayer(_PatchLayer):
+    """Облако: белый полупрозрачный эллипс, плывущий слева направо."""
+
+    def __init__(self, radius_x=30, radius_y=15, top=0.2, speed=1 / 50, color=(255, 255, 255), alpha=0.5):
+        self.radius_x = radius_x
+        self.radius_y = radius_y
+        self.top = top
+        self.speed = speed
+        self.color = np.array(color, dtype=np.float32)
+        self.alpha = alpha
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        y = (np.arange(2 * self.radius_y + 1, dtype=np.float32) - self.radius_y) / self.radius_y
+        x = (np.arange(2 * self.radius_x + 1, dtype=np.float32) - self.radius_x) / self.radius_x
+        self._allocate(len(y), len(x))
+        # Форма облака не меняется, поэтому прозрачность считается один раз
+        self._alpha[:] = (x[None, :] ** 2 + y[:, None] ** 2 <= 1) * self.alpha
+
+    def apply(self, frame, t):
+        center_x = (t * self.speed) % self.width
+        self._blend(frame, round(self.height * self.top) - self.radius_y,
+                    math.floor(center_x) - self.radius_x, self.color)
+
+
+class SwayLayer(_PatchLayer):
+    """Покачивание: зеленый квадрат, поворачивающийся вокруг своего центра."""
+
+    def __init__(self, center=(0.8, 0.7), size=20, amplitude=0.1, period=1000, color=(34, 139, 34), alpha=0.6):
+        self.center = center
+        self.size = size
+        self.amplitude = amplitude
+        self.period = period
+        self.color = np.array(color, dtype=np.float32)
+        self.alpha = alpha
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        # Заплатка вмещает квадрат при любом угле поворота
+        self._radius = math.ceil(self.size / 2 * math.sqrt(2))
+        side = 2 * self._radius + 1
+        self._allocate(side, side)
+        center_x, center_y = width * self.center[0], height * self.center[1]
+        self._left = math.floor(center_x) - self._radius
+        self._top = math.floor(center_y) - self._radius
+        # Координаты центров пикселей заплатки относительно центра квадрата
+        self._dx = (self._left + np.arange(side, dtype=np.float32) + 0.5 - center_x)[None, :]
+        self._dy = (self._top + np.arange(side, dtype=np.float32) + 0.5 - center_y)[:, None]
+        self._u = np.empty((side, side), dtype=np.float32)
+        self._v = np.empty((side, side), dtype=np.float32)
+
+    def apply(self, frame, t):
+        angle = math.sin(t / self.period) * self.amplitude
+        cos, sin = math.cos(angle), math.sin(angle)
+        half = self.size / 2
+        # Переводим пиксели в систему координат повернутого квадрата
+        np.multiply(self._dx, cos, out=self._u)
+        self._u += self._dy * sin
+        np.multiply(self._dy, cos, out=self._v)
+        self._v -= self._dx * sin
+        np.abs(self._u, out=self._u)
+        np.abs(self._v, out=self._v)
+        np.maximum(self._u, self._v, out=self._u)
+        np.less_equal(self._u, half, out=self._alpha, casting='unsafe')
+        self._alpha *= self.alpha
+        self._blend(frame, self._top, self._left, self.color)
+
+
+class FlickerLayer(_PatchLayer):
+    """Мерцающий свет: радиальный градиент в центре кадра с пульсирующей яркостью."""
+
+    def __init__(self, radius=50, period=300, color=(255, 255, 200), alpha=0.5):
+        self.radius = radius
+        self.period = period
+        self.color = np.array(color, dtype=np.float32)
+        self.alpha = alpha
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        side = 2 * self.radius + 1
+        self._allocate(side, side)
+        offsets = np.arange(side, dtype=np.float32) - self.radius
+        distance = np.sqrt(offsets[None, :] ** 2 + offsets[:, None] ** 2)
+        # Линейное затухание прозрачности от центра к краю круга
+        self._profile = np.clip(1 - distance / self.radius, 0, None).astype(np.float32)
+        self._top = round(height * 0.5) - self.radius
+        self._left = round(width * 0.5) - self.radius
+
+    def apply(self, frame, t):
+        flicker = 0.5 + 0.5 * math.sin(t / self.period)
+        np.multiply(self._profile, self.alpha * flicker, out=self._alpha)
+        self._blend(frame, self._top, self._left, self.color)
+
+
+class PulseLayer(Layer):
+    """Пульсация цвета: весь кадр окрашивается в красный с меняющейся прозрачностью."""
+
+    def __init__(self, period=1000, color=(255, 0, 0), alpha=0.1):
+        self.period = period
+        self.color = np.array(color, dtype=np.float32)
+        self.alpha = alpha
+
+    def prepare(self, height, width):
+        super().prepare(height, width)
+        self._tile = np.tile(self.color, (width, 1))
+        self._row = np.empty_like(self._tile)
+
+    def apply(self, frame, t):
+        alpha = self.alpha * (0.5 + 0.5 * math.sin(t / self.period))
+        frame *= 1.0 - alpha
+        np.multiply(self._tile, alpha, out=self._row)
+        frame += self._row
+
+
+def default_layers():
+    """Слои в том же порядке, что и в flashFrameAnimate."""
+    return [BlinkLayer(), WaterLayer(), CloudLayer(), SwayLayer(), FlickerLayer(), PulseLayer()]
+
+
+class FrameCompositor:
+    """
+    Накладывает слои эффектов на статичное изображение для момента времени t.
+
+    Буферы кадра выделяются один раз: исходное изображение хранится в
+    float32, каждый кадр начинается с его копии в рабочий буфер, слои
+    изменяют буфер на месте векторными операциями NumPy, а результат
+    округляется до uint8 в выходной буфер.
+
+    Args:
+        image (numpy.ndarray): Изображение RGB (высота, ширина, 3) uint8.
+        layers (list, optional): Слои эффектов; по умолчанию default_layers().
+    """
+
+    def __init__(self, image, layers=None):
+        image = np.asarray(image)
+        if image.ndim != 3 or image.shape[2] != 3:
+            raise ValueError(f"Ожидается изображение RGB (высота, ширина, 3), получено {image.shape}")
+        self.height, self.width = image.shape[:2]
+        self.layers = default_layers() if layers is None else list(layers)
+        for layer in self.layers:
+            layer.prepare(self.height, self.width)
+
+        self._base = image.astype(np.float32)
+        self._frame = np.empty_like(self._base)
+        self._output = np.empty(image.shape, dtype=np.uint8)
+
+    @property
+    def shape(self):
+        return self._output.shape
+
+    def render(self, t, out=None):
+        """
+        Рисует кадр для момента времени t.
+
+        Args:
+            t (float): Время от начала анимации в миллисекундах.
+            out (numpy.ndarray, optional): Буфер uint8 для результата.
+
+        Returns:
+            numpy.ndarray: Кадр uint8; без out это внутренний буфер,
+                который перезаписывается следующим вызовом.
+        """
+        frame = self._frame
+        np.copyto(frame, self._base)
+        for layer in self.layers:
+            layer.apply(frame, t)
+        # Приведение к uint8 отбрасывает дробную часть, поэтому +0.5 дает
+        # округление до ближайшего, как в canvas. Смешивание не выводит значения
+        # за пределы 0-255, поэтому clip не нужен
+        frame += 0.5
+        out = self._output if out is None else out
+        np.copyto(out, frame, casting='unsafe')
+        return out
+
+    def frames(self, fps, duration):
+        """
+        Генерирует кадры анимации длительностью duration секунд.
+
+        Каждый кадр - тот же внутренний буфер, его нужно обработать до
+        запроса следующего.
+        """
+        for index in range(round(fps * duration)):
+            yield self.render(index * 1000 / fps)
@@ -0,0 +1,281 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+
+from db import ConnectionPool
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite (WAL), переживающее перезапуск бота.
+
+    Изменения накапливаются в памяти и записываются одной транзакцией раз
+    в flush_interval секунд или по достижении batch_size измененных
+    диалогов. Диалоги, не менявшиеся дольше ttl секунд, считаются
+    брошенными и периодически удаляются, поэтому пользователи, не
+    завершившие выбор жанра, глубины и особенностей, не копятся вечно.
+
+    Несколько процессов бота могут работать с одним файлом, если апдейты
+    одного чата всегда попадают в один процесс.
+
+    Args:
+        path (str): Путь к файлу базы данных состояний.
+        ttl (float): Время жизни неактивного диалога в секундах.
+        flush_interval (float): Максимальная задержка записи в секундах.
+        batch_size (int): Число измененных диалогов, при котором запись идет сразу.
+        eviction_interval (float): Как часто удалять устаревшие диалоги, в секундах.
+        max_retry_delay (float): Предельная задержка повтора после ошибки записи, в секундах.
+    """
+
+    def __init__(self, path='fsm_storage.db', ttl=7 * 24 * 3600, flush_interval=0.05,
+                 batch_size=256, eviction_interval=600, max_retry_delay=30.0):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.eviction_interval = eviction_interval
+        self.max_retry_delay = max_retry_delay
+        self._pool = ConnectionPool(path, size=2)
+        self._entries = {}
+        self._dirty = set()
+        self._clean = set()
+        self._ready = False
+        self._flush_handle = None
+        self._flush_tasks = set()
+        self._flush_lock = None
+        self._retry_delay = None
+        self._last_eviction = 0.0
+
+    @staticmethod
+    def _init_schema(conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT,
+            bucket TEXT,
+            updated_at REAL,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)')
+
+    @staticmethod
+    def _load(conn, chat, user, min_updated_at):
+        return conn.execute(
+            'SELECT state, data, bucket FROM fsm_storage WHERE chat = ? AND user = ? AND updated_at >= ?',
+            (chat, user, min_updated_at)
+        ).fetchone()
+
+    @staticmethod
+    def _write(conn, upserts, deletes, evict_before):
+        if upserts:
+            conn.executemany(
+                'INSERT OR REPLACE INTO fsm_storage (chat, user, state, data, bucket, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                upserts
+            )
+        if deletes:
+            conn.executemany('DELETE FROM fsm_storage WHERE chat = ? AND user = ?', deletes)
+        if evict_before is not None:
+            return conn.execute('DELETE FROM fsm_storage WHERE updated_at < ?', (evict_before,)).rowcount
+        return 0
+
+    async def _entry(self, chat, user):
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            return key, entry
+
+        if not self._ready:
+            await self._pool.run(self._init_schema)
+            self._ready = True
+
+        row = await self._pool.run(self._load, chat, user, time.time() - self.ttl)
+
+        # Пока шло чтение, запись могла появиться из другого обработчика
+        entry = self._entries.get(key)
+        if entry is None:
+            if row:
+                entry = {
+                    'state': row[0],
+                    'data': json.loads(row[1]) if row[1] else {},
+                    'bucket': json.loads(row[2]) if row[2] else {}
+                }
+            else:
+                entry = {'state': None, 'data': {}, 'bucket': {}}
+            self._entries[key] = entry
+            # Прочитанные записи держим в памяти только до ближайшей записи на диск
+            self._clean.add(key)
+            self._schedule_flush()
+        return key, entry
+
+    def _mark_dirty(self, key):
+        self._dirty.add(key)
+
+        # После ошибки записи ждем повтора по расписанию, а не пишем на каждое изменение
+        if len(self._dirty) >= self.batch_size and self._retry_delay is None:
+            self._start_flush()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self, delay=None):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.flush_interval if delay is None else delay, self._start_flush
+            )
+
+    def _start_flush(self):
+        task = asyncio.get_running_loop().create_task(self._background_flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _background_flush(self):
+        # Исключение фоновой задачи никто не ждет: логируем его и повторяем
+        # запись с экспоненциальной задержкой, изменения остаются в памяти
+        try:
+            await self.flush()
+        except Exception:
+            self._retry_delay = min(self.max_retry_delay, 2 * (self._retry_delay or self.flush_interval))
+            logging.exception(f"Не удалось записать состояния FSM, повтор через {self._retry_delay:.2f} с")
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._schedule_flush(self._retry_delay)
+
+    async def flush(self):
+        """Записывает все накопленные изменения одной транзакцией."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            now = time.time()
+            evict_before = None
+            if now - self._last_eviction >= self.eviction_interval:
+                evict_before = now - self.ttl
+                self._last_eviction = now
+
+            keys, self._dirty = self._dirty, set()
+            clean, self._clean = self._clean - keys, set()
+            upserts = []
+            deletes = []
+            for key in keys:
+                entry = self._entries[key]
+                if entry['state'] is None and not entry['data'] and not entry['bucket']:
+                    deletes.append(key)
+                else:
+                    upserts.append((
+                        *key,
+                        entry['state'],
+                        json.dumps(entry['data'], ensure_ascii=False),
+                        json.dumps(entry['bucket'], ensure_ascii=False),
+                        now
+                    ))
+
+            evicted = 0
+            if upserts or deletes or evict_before is not None:
+                try:
+                    evicted = await self._pool.run(self._write, upserts, deletes, evict_before)
+                except Exception:
+                    # Не теряем изменения: попробуем записать их в следующий раз
+                    self._dirty |= keys
+                    self._clean |= clean
+                    raise
+            self._retry_delay = None
+
+            if evicted:
+                logging.info(f"Удалено брошенных диалогов FSM: {evicted}")
+
+            # Записанные и больше не изменявшиеся диалоги не держим в памяти
+            for key in (keys | clean) - self._dirty:
+                self._entries.pop(key, None)
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        try:
+            if self._ready:
+                await self.flush()
+        finally:
+            self._pool.close()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        state = entry['state']
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        return copy.deepcopy(entry['data'] or default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, entry = await self._entry(chat, user)
+        entry['state'] = self.resolve_state(state)
+        self._mark_dirty(key)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, entry = await self._entry(chat, user)
+        entry['data'] = copy.deepcopy(data or {})
+        self._mark_dirty(key)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, entry = await self._entry(chat, user)
+        entry['data'].update(copy.deepcopy(data or {}), **kwargs)
+        self._mark_dirty(key)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        return copy.deepcopy(entry['bucket'] or default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, entry = await self._entry(chat, user)
+        entry['bucket'] = copy.deepcopy(bucket or {})
+        self._mark_dirty(key)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, entry = await self._entry(chat, user)
+        entry['bucket'].update(copy.deepcopy(bucket or {}), **kwargs)
+        self._mark_dirty(key)
+
+
+def create_storage(backend='sqlite', ttl=7 * 24 * 3600, **options):
+    """
+    Создает хранилище FSM по названию бэкенда.
+
+    Args:
+        backend (str): 'sqlite', 'redis' (любой сервер с протоколом Redis) или 'memory'.
+        ttl (int): Время жизни неактивного диалога в секундах.
+        **options: Параметры конкретного хранилища (path, host, port, db, prefix...).
+
+    Returns:
+        BaseStorage: Хранилище для Dispatcher.
+    """
+    if backend == 'sqlite':
+        return SQLiteStorage(ttl=ttl, **options)
+    if backend == 'redis':
+        # Необязательная зависимость: нужен пакет redis
+        from aiogram.contrib.fsm_storage.redis import RedisStorage2
+        return RedisStorage2(state_ttl=ttl, data_ttl=ttl, bucket_ttl=ttl, **options)
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {backend}")
@@ -0,0 +1,291 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+from scipy import sparse
+
+import db
+
+# Сколько соседей хранить для каждого тайтла
+TOP_N = 20
+# Сколько пользователей с новыми оценками обрабатывать за один проход:
+# в памяти одновременно находится только их история
+CHUNK_SIZE = 5000
+# Минимум общих оценок, чтобы пара считалась соседями: случайные совпадения
+# одного-двух пользователей дают косинус 1.0, но ничего не значат
+MIN_OVERLAP = 2
+
+FEEDBACK_VALUES = {'like': 1.0, 'dislike': -1.0}
+
+
+def init_schema(conn):
+    # Скалярные произведения столбцов матрицы пользователь×тайтл. Пары
+    # хранятся в обе стороны, чтобы соседи тайтла читались одним диапазоном
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS item_pair_stats (
+        item_a INTEGER NOT NULL,
+        item_b INTEGER NOT NULL,
+        dot REAL NOT NULL,
+        overlap INTEGER NOT NULL,
+        PRIMARY KEY (item_a, item_b)
+    ) WITHOUT ROWID
+    ''')
+    # Квадраты норм столбцов
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS item_norms (
+        content_id INTEGER PRIMARY KEY,
+        norm2 REAL NOT NULL
+    )
+    ''')
+    # Отметка: все взаимодействия с id <= last_id учтены. Во время запуска
+    # target_id и last_user_id позволяют продолжить прерванный проход
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_watermarks (
+        job TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        target_id INTEGER,
+        last_user_id INTEGER,
+        updated_at TIMESTAMP
+    )
+    ''')
+    # Тайтлы, чьи соседи устарели и будут пересчитаны в конце запуска
+    conn.execute('CREATE TABLE IF NOT EXISTS item_neighbors_dirty (content_id INTEGER PRIMARY KEY)')
+
+
+def _load_watermark(conn):
+    row = conn.execute(
+        "SELECT last_id, target_id, last_user_id FROM job_watermarks WHERE job = 'item_neighbors'"
+    ).fetchone()
+    return row if row else (0, None, None)
+
+
+def _save_watermark(conn, last_id, target_id=None, last_user_id=None):
+    conn.execute('''
+        INSERT INTO job_watermarks (job, last_id, target_id, last_user_id, updated_at)
+        VALUES ('item_neighbors', ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(job) DO UPDATE SET
+            last_id = excluded.last_id,
+            target_id = excluded.target_id,
+            last_user_id = excluded.last_user_id,
+            updated_at = excluded.updated_at
+    ''', (last_id, target_id, last_user_id))
+
+
+def _user_vectors(conn, user_ids, start_id, end_id):
+    """
+    Оценки пользователей до новых взаимодействий (id <= start_id) и после них (id <= end_id).
+
+    Учитывается только последняя оценка пользователя каждому тайтлу.
+
+    Returns:
+        tuple: Две тройки массивов (строка пользователя, content_id, значение).
+    """
+    placeholders = ','.join(['?'] * len(user_ids))
+    rows = conn.execute(f'''
+        SELECT id, user_id, content_id, interaction_type
+        FROM user_interactions
+        WHERE user_id IN ({placeholders}) AND id <= ?
+    ''', [*user_ids, end_id]).fetchall()
+
+    user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+    rows = [(interaction_id, user_rows[user_id], content_id, FEEDBACK_VALUES[feedback])
+            for interaction_id, user_id, content_id, feedback in rows if feedback in FEEDBACK_VALUES]
+    if not rows:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        return empty, empty
+
+    ids, users, items, values = (np.array(column) for column in zip(*rows))
+    values = values.astype(np.float32)
+
+    def latest(mask):
+        # Сортировка по (пользователь, тайтл, id): последняя строка группы - актуальная оценка
+        order = np.lexsort((ids[mask], items[mask], users[mask]))
+        users_, items_, values_ = users[mask][order], items[mask][order], values[mask][order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (users_[1:] != users_[:-1]) | (items_[1:] != items_[:-1])
+        return users_[last], items_[last], values_[last]
+
+    return latest(ids <= start_id), latest(np.ones(len(ids), dtype=bool))
+
+
+def _gram(users, items, values, n_users, item_index):
+    """Матрицы скалярных произведений и числа общих оценок для тайтлов из item_index."""
+    columns = np.searchsorted(item_index, items)
+    matrix = sparse.csr_matrix((values, (users, columns)), shape=(n_users, len(item_index)))
+    mask = matrix.copy()
+    mask.data = np.ones_like(mask.data)
+    return (matrix.T @ matrix).tocoo(), (mask.T @ mask).tocoo()
+
+
+def _apply_users(conn, user_ids, start_id, end_id):
+    """
+    Учитывает новые оценки пользователей user_ids с id в (start_id, end_id].
+
+    Меняются только векторы этих пользователей, поэтому приращение матрицы
+    Грама равно New.T @ New - Old.T @ Old, где Old и New - их оценки до и
+    после новых взаимодействий. Тайтлы с изменившимися косинусами
+    помечаются в item_neighbors_dirty.
+    """
+    old, new = _user_vectors(conn, user_ids, start_id, end_id)
+    item_index = np.unique(np.concatenate([old[1], new[1]]))
+
+    new_dot, new_overlap = _gram(*new, len(user_ids), item_index)
+    old_dot, old_overlap = _gram(*old, len(user_ids), item_index)
+    delta_dot = (new_dot - old_dot).tocoo()
+    delta_overlap = (new_overlap - old_overlap).tocoo()
+
+    # Объединяем приращения в один набор пар (a, b); диагональ - нормы
+    deltas = {}
+    for a, b, value in zip(item_index[delta_dot.row].tolist(), item_index[delta_dot.col].tolist(),
+                           delta_dot.data.tolist()):
+        deltas[a, b] = [value, 0]
+    for a, b, value in zip(item_index[delta_overlap.row].tolist(), item_index[delta_overlap.col].tolist(),
+                           delta_overlap.data.tolist()):
+        deltas.setdefault((a, b), [0.0, 0])[1] = int(value)
+
+    conn.executemany('''
+        INSERT INTO item_pair_stats (item_a, item_b, dot, overlap) VALUES (?, ?, ?, ?)
+        ON CONFLICT(item_a, item_b) DO UPDATE SET
+            dot = dot + excluded.dot,
+            overlap = overlap + excluded.overlap
+    ''', [(a, b, dot, overlap) for (a, b), (dot, overlap) in deltas.items() if a != b and (dot or overlap)])
+
+    norm_changed = [(a, dot) for (a, b), (dot, _) in deltas.items() if a == b and dot]
+    conn.executemany('''
+        INSERT INTO item_norms (content_id, norm2) VALUES (?, ?)
+        ON CONFLICT(content_id) DO UPDATE SET norm2 = norm2 + excluded.norm2
+    ''', norm_changed)
+
+    # Косинус пары меняется при изменении её скалярного произведения или
+    # нормы любого из тайтлов, поэтому пересчитываем и всех, кто связан с
+    # тайтлом, чья норма изменилась
+    conn.executemany('INSERT OR IGNORE INTO item_neighbors_dirty (content_id) VALUES (?)',
+                     [(a,) for a in {a for a, _ in deltas}])
+    for start in range(0, len(norm_changed), 500):
+        batch = [a for a, _ in norm_changed[start:start + 500]]
+        conn.execute(f'''
+            INSERT OR IGNORE INTO item_neighbors_dirty (content_id)
+            SELECT DISTINCT item_b FROM item_pair_stats WHERE item_a IN ({','.join(['?'] * len(batch))})
+        ''', batch)
+
+
+def _rebuild_neighbors(conn, top_n, min_overlap):
+    """
+    Пересчитывает top_n соседей по косинусу для тайтлов из item_neighbors_dirty.
+
+    Returns:
+        int: Число пересчитанных тайтлов.
+    """
+    content_ids = [row[0] for row in conn.execute('SELECT content_id FROM item_neighbors_dirty ORDER BY content_id')]
+    if not content_ids:
+        return 0
+
+    norms = dict(conn.execute('SELECT content_id, norm2 FROM item_norms').fetchall())
+
+    for start in range(0, len(content_ids), 500):
+        batch = content_ids[start:start + 500]
+        placeholders = ','.join(['?'] * len(batch))
+
+        pairs = conn.execute(f'''
+            SELECT item_a, item_b, dot FROM item_pair_stats
+            WHERE item_a IN ({placeholders}) AND overlap >= ?
+        ''', [*batch, min_overlap]).fetchall()
+
+        conn.execute(f'DELETE FROM content_neighbors WHERE content_id IN ({placeholders})', batch)
+        if not pairs:
+            continue
+
+        a, b, dot = (np.array(column) for column in zip(*pairs))
+        norm_a = np.sqrt(np.array([norms.get(item, 0.0) for item in a.tolist()]))
+        norm_b = np.sqrt(np.array([norms.get(item, 0.0) for item in b.tolist()]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where((norm_a > 0) & (norm_b > 0), dot / (norm_a * norm_b), 0.0)
+
+        # Сортируем по (тайтл, -косинус) и берем первые top_n положительных в каждой группе
+        order = np.lexsort((-scores, a))
+        a, b, scores = a[order], b[order], scores[order]
+        ranks = np.arange(len(a)) - np.searchsorted(a, a, side='left')
+        keep = (ranks < top_n) & (scores > 0)
+
+        conn.executemany(
+            'INSERT INTO content_neighbors (content_id, neighbor_id, score, rank) VALUES (?, ?, ?, ?)',
+            zip(a[keep].tolist(), b[keep].tolist(), scores[keep].tolist(), ranks[keep].tolist())
+        )
+
+    conn.execute('DELETE FROM item_neighbors_dirty')
+    return len(content_ids)
+
+
+def run(pool, full=False, top_n=TOP_N, chunk_size=CHUNK_SIZE, min_overlap=MIN_OVERLAP):
+    """
+    Обновляет таблицу content_neighbors по новым взаимодействиям.
+
+    Обрабатываются только пользователи, оценившие что-то после прошлого
+    запуска, порциями по chunk_size пользователей. Каждая порция
+    фиксируется отдельной транзакцией вместе с прогрессом, поэтому
+    прерванный запуск продолжается с места остановки без двойного учета.
+
+    Args:
+        pool (db.ConnectionPool): Пул соединений с базой бота.
+        full (bool): Пересчитать все с нуля, игнорируя сохраненную отметку.
+        top_n (int): Сколько соседей хранить для тайтла.
+        chunk_size (int): Сколько пользователей обрабатывать за проход.
+        min_overlap (int): Минимум пользователей, оценивших оба тайтла.
+
+    Returns:
+        int: Число тайтлов, для которых пересчитаны соседи.
+    """
+    started = time.monotonic()
+
+    with pool.connection() as conn:
+        db.init_db(conn)
+        init_schema(conn)
+        if full:
+            for table in ('item_pair_stats', 'item_norms', 'content_neighbors', 'item_neighbors_dirty'):
+                conn.execute(f'DELETE FROM {table}')
+            conn.execute("DELETE FROM job_watermarks WHERE job = 'item_neighbors'")
+
+        last_id, target_id, last_user_id = _load_watermark(conn)
+        if target_id is None:
+            # Взаимодействия, появившиеся во время запуска, войдут в следующий
+            target_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM user_interactions').fetchone()[0]
+            last_user_id = None
+            _save_watermark(conn, last_id, target_id)
+
+        user_ids = [row[0] for row in conn.execute('''
+            SELECT DISTINCT user_id FROM user_interactions
+            WHERE id > ? AND id <= ? AND user_id > ?
+            ORDER BY user_id
+        ''', (last_id, target_id, last_user_id if last_user_id is not None else -2 ** 63))]
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        with pool.connection() as conn:
+            _apply_users(conn, chunk, last_id, target_id)
+            _save_watermark(conn, last_id, target_id, chunk[-1])
+        logging.info(f"Обработано пользователей: {start + len(chunk)} из {len(user_ids)}")
+
+    with pool.connection() as conn:
+        rebuilt = _rebuild_neighbors(conn, top_n, min_overlap)
+        _save_watermark(conn, target_id)
+
+    logging.info(f"Соседи пересчитаны для {rebuilt} тайтлов за {time.monotonic() - started:.1f} с")
+    return rebuilt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Расчет похожих тайтлов по оценкам пользователей')
+    parser.add_argument('--db', default=db.DB_PATH, help='Путь к файлу базы данных')
+    parser.add_argument('--full', action='store_true', help='Пересчитать с нуля')
+    parser.add_argument('--top-n', type=int, default=TOP_N, help='Сколько соседей хранить')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Пользователей за проход')
+    parser.add_argument('--min-overlap', type=int, default=MIN_OVERLAP, help='Минимум общих оценок')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    job_pool = db.ConnectionPool(args.db, size=1)
+    try:
+        run(job_pool, args.full, args.top_n, args.chunk_size, args.min_overlap)
+    finally:
+        job_pool.close()
@@ -1,26 +1,137 @@
 import logging
-import sqlite3
-import json
-import aiohttp
-import asyncio
-import datetime
+import time
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+import db
+from catalog_index import catalog
+from deepseek_client import DeepSeekClient
+from fsm_storage import create_storage
+from render import cards, DEPTH_KEYBOARD, FEATURE_KEYBOARD, GENRE_KEYBOARD, MORE_KEYBOARD
+from response_cache import ResponseCache, fingerprint
+from router import CallbackRouter, IntentRouter
+from title_index import parse_titles, titles
+from write_behind import FeedbackWriter
+from db import save_user_preferences, get_user_history_details
 
 # Инициализация бота и диспетчера
 API_TOKEN = 'YOUR_TELEGRAM_BOT_TOKEN'  # Замените на свой токен
 DEEPSEEK_API_KEY = 'YOUR_DEEPSEEK_API_KEY'  # Замените на свой API-ключ DeepSeek
 DEEPSEEK_API_URL = 'https://api.deepseek.com/v1/chat/completions'  # URL для API DeepSeek
+RECOMMENDATIONS_LIMIT = 10  # Сколько лучших совпадений выбирать из каталога
+CURSOR_TTL = 30 * 60  # Сколько секунд хранится выдача для «Еще рекомендации»
+DEEPSEEK_CACHE_PATH = 'deepseek_cache.db'  # Файл кэша ответов DeepSeek (None - только в памяти)
+FSM_STORAGE = 'sqlite'  # Хранилище состояний диалогов: 'sqlite', 'redis' или 'memory'
+FSM_STORAGE_OPTIONS = {'path': 'fsm_storage.db'}  # Для Redis: {'host': 'localhost', 'port': 6379}
+FSM_STATE_TTL = 24 * 3600  # Через сколько секунд брошенный диалог удаляется
+WEBHOOK_URL = None  # Например, 'https://example.com/webhook'; None - режим long polling
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = None  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = '0.0.0.0'
+WEBAPP_PORT = 8080
+UPDATE_WORKERS = 8  # Сколько чатов обрабатываются параллельно в режиме вебхука
+UPDATE_QUEUE_SIZE = 100  # Максимум апдейтов в очереди одного обработчика
+FEEDBACK_FLUSH_INTERVAL = 0.1  # Максимальная задержка записи отзывов в секундах
+FEEDBACK_BATCH_SIZE = 500  # Сколько отзывов записывать одной транзакцией
+FEEDBACK_DURABILITY = 'async'  # 'sync' - отвечать только после записи отзыва на диск
+FEEDBACK_DEAD_LETTER_PATH = 'feedback_dead_letter.jsonl'  # Куда сохранять отзывы, которые не удалось записать
+METRICS_PORT = 9464  # Порт локального эндпоинта /metrics; None - метрики не собираются
+# Основы слов, с которых начинается подбор; совпадение ищется по подстроке
+FILM_DIALOG_PHRASES = ['фильм', 'кино', 'кинц', 'посмотр', 'смотреть', 'аниме']
+
+# Настройки по умолчанию для create_app; ключи можно переопределить словарем config
+DEFAULT_CONFIG = {
+    'api_token': API_TOKEN,
+    'db_path': db.DB_PATH,
+    'deepseek_api_url': DEEPSEEK_API_URL,
+    'deepseek_api_key': DEEPSEEK_API_KEY,
+    'deepseek_cache_path': DEEPSEEK_CACHE_PATH,
+    'fsm_storage': FSM_STORAGE,
+    'fsm_storage_options': FSM_STORAGE_OPTIONS,
+    'fsm_state_ttl': FSM_STATE_TTL,
+    'feedback_flush_interval': FEEDBACK_FLUSH_INTERVAL,
+    'feedback_batch_size': FEEDBACK_BATCH_SIZE,
+    'feedback_durability': FEEDBACK_DURABILITY,
+    'feedback_dead_letter_path': FEEDBACK_DEAD_LETTER_PATH,
+    'metrics_port': METRICS_PORT,
+}
+
+# Объекты приложения создаются в create_app: импорт модуля не открывает
+# базу данных, не создает бота и не загружает numpy и метрики
+bot = None
+dp = None
+deepseek = None
+deepseek_cache = None
+feedback_writer = None
+metrics_exporter = None
+ranker = None
+metrics = None
+
+
+def update_catalog_ratings(ratings):
+    # Точечно обновляем позиции контента в индексе каталога после записи отзывов;
+    # движок ранжирования только помечает рейтинги устаревшими
+    for content_id, rating in ratings.items():
+        catalog.update_rating(content_id, rating)
+        ranker.update_rating(content_id, rating)
+
+
+def create_app(config=None):
+    """
+    Создает бота, диспетчер и клиентов внешних сервисов и регистрирует обработчики.
+
+    База данных открывается и при необходимости создается при первом
+    запросе, а не здесь. В процессе работает одно приложение: повторный
+    вызов заменяет предыдущее.
+
+    Args:
+        config (dict, optional): Переопределения ключей DEFAULT_CONFIG.
+
+    Returns:
+        Dispatcher: Диспетчер с зарегистрированными обработчиками.
+    """
+    global bot, dp, deepseek, deepseek_cache, feedback_writer, metrics_exporter, ranker, metrics
+
+    settings = {**DEFAULT_CONFIG, **(config or {})}
+
+    # numpy и scipy загружаются один раз здесь, а не в обработчиках и колбэках записи
+    import ranking
+    ranker = ranking.ranker
+
+    if settings['db_path'] != db.pool.path:
+        db.pool.close()
+        db.pool = db.ConnectionPool(settings['db_path'], initializer=db.init_db)
+
+    bot = Bot(token=settings['api_token'])
+    deepseek = DeepSeekClient(settings['deepseek_api_url'], settings['deepseek_api_key'])
+    deepseek_cache = ResponseCache(path=settings['deepseek_cache_path'])
+    storage = create_storage(settings['fsm_storage'], ttl=settings['fsm_state_ttl'], **settings['fsm_storage_options'])
+    dp = Dispatcher(bot, storage=storage)
+    feedback_writer = FeedbackWriter(
+        flush_interval=settings['feedback_flush_interval'],
+        max_batch=settings['feedback_batch_size'],
+        durability=settings['feedback_durability'],
+        on_flush=update_catalog_ratings,
+        dead_letter_path=settings['feedback_dead_letter_path']
+    )
+
+    # Без порта метрики не импортируются и не собираются: main.metrics остается None
+    metrics = None
+    metrics_exporter = None
+    if settings['metrics_port']:
+        import metrics
+        dp.middleware.setup(metrics.MetricsMiddleware())
+        metrics.instrument_pool(db.pool)
+        metrics.instrument_storage(storage)
+        metrics.instrument_bot(bot)
+        metrics.registry.register_cache('deepseek', deepseek_cache)
+        metrics.registry.register_cache('cards', cards)
+        metrics_exporter = metrics.MetricsExporter(port=settings['metrics_port'])
+
+    register_handlers(dp)
+    return dp
 
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
 
 # Определение состояний для конечного автомата
 class FilmDialog(StatesGroup):
@@ -29,97 +140,6 @@ class FilmDialog(StatesGroup):
     waiting_for_features = State()
     waiting_for_feedback = State()
 
-# Подключение к базе данных SQLite
-def init_db():
-    conn = sqlite3.connect('movie_bot.db')
-    cursor = conn.cursor()
-    
-    # Создание таблицы пользователей, если она не существует
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        preferences TEXT,
-        history TEXT,
-        interaction_count INTEGER DEFAULT 0,
-        last_interaction TIMESTAMP
-    )
-    ''')
-    
-    # Создание таблицы фильмов/аниме, если она не существует
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS content (
-        id INTEGER PRIMARY KEY,
-        title TEXT,
-        genre TEXT,
-        depth TEXT,
-        features TEXT,
-        type TEXT,
-        description TEXT,
-        rating REAL DEFAULT 0,
-        likes INTEGER DEFAULT 0,
-        dislikes INTEGER DEFAULT 0,
-        year INTEGER
-    )
-    ''')
-    
-    # Создание таблицы для хранения взаимодействий пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS user_interactions (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER,
-        content_id INTEGER,
-        interaction_type TEXT,
-        timestamp TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (user_id),
-        FOREIGN KEY (content_id) REFERENCES content (id)
-    )
-    ''')
-    
-    # Добавим несколько фильмов и аниме для примера (расширенная информация)
-    sample_content = [
-        (1, 'Начало', 'sci-fi,thriller', 'deep', 'action,mystery', 'movie', 
-         'Фильм о воре, который крадет корпоративные секреты через использование технологии совместного сна.', 8.8, 0, 0, 2010),
-        (2, 'Ла-Ла Ленд', 'romance,drama', 'light', 'music,romance', 'movie', 
-         'Музыкальная история любви джазового пианиста и начинающей актрисы в Лос-Анджелесе.', 8.0, 0, 0, 2016),
-        (3, 'Атака титанов', 'action,fantasy', 'deep', 'action,drama', 'anime', 
-         'Аниме-сериал о борьбе человечества против гигантских людоедов в постапокалиптическом мире.', 9.0, 0, 0, 2013),
-        (4, 'Твоё имя', 'romance,fantasy', 'medium', 'romance,drama', 'anime', 
-         'История о двух подростках, которые обнаруживают, что таинственным образом меняются телами.', 8.4, 0, 0, 2016),
-        (5, 'Джон Уик', 'action,thriller', 'light', 'action,violence', 'movie', 
-         'Бывший наемный убийца вынужден вернуться к своему темному прошлому, чтобы отомстить.', 7.4, 0, 0, 2014),
-        (6, 'Интерстеллар', 'sci-fi,drama', 'deep', 'space,science', 'movie', 
-         'Фильм о группе исследователей, которые используют недавно обнаруженный пространственный тоннель, чтобы преодолеть ограничения космических путешествий.', 8.6, 0, 0, 2014),
-        (7, 'Ванпанчмен', 'comedy,action', 'light', 'action,humor', 'anime', 
-         'Аниме о супергерое, который может победить любого противника одним ударом и страдает от этого.', 8.8, 0, 0, 2015),
-        (8, 'Паразит', 'horror,sci-fi', 'deep', 'horror,drama', 'anime', 
-         'Аниме о паразитических существах, которые захватывают и контролируют мозг людей.', 8.5, 0, 0, 2014),
-        (9, 'Шрек', 'comedy,fantasy', 'light', 'humor,romance', 'movie', 
-         'Анимационный фильм о приключениях огра и его друзей в сказочном королевстве.', 7.9, 0, 0, 2001),
-        (10, 'Унесённые призраками', 'fantasy,adventure', 'medium', 'fantasy,drama', 'anime', 
-         'Аниме о девочке, которая попадает в мир духов и должна найти способ спасти своих родителей.', 8.6, 0, 0, 2001),
-        (11, 'Пульп Фикшн', 'crime,drama', 'deep', 'violence,humor', 'movie', 
-         'Нелинейное повествование о криминальном мире Лос-Анджелеса.', 8.9, 0, 0, 1994),
-        (12, 'Ковбой Бибоп', 'sci-fi,action', 'medium', 'action,space', 'anime', 
-         'Аниме о группе охотников за головами в космосе будущего.', 8.9, 0, 0, 1998),
-        (13, 'Тёмный рыцарь', 'action,crime', 'deep', 'action,drama', 'movie', 
-         'Фильм о борьбе Бэтмена с криминальным гением Джокером.', 9.0, 0, 0, 2008),
-        (14, 'Твин Пикс', 'mystery,drama', 'deep', 'mystery,horror', 'movie', 
-         'Сериал о расследовании убийства молодой девушки в маленьком городке.', 8.8, 0, 0, 1990),
-        (15, 'Клинок, рассекающий демонов', 'action,fantasy', 'medium', 'action,drama', 'anime', 
-         'Аниме о мальчике, который становится охотником на демонов после того, как его семья была убита.', 8.7, 0, 0, 2019)
-    ]
-    
-    cursor.executemany('''
-    INSERT OR IGNORE INTO content (id, title, genre, depth, features, type, description, rating, likes, dislikes, year)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', sample_content)
-    
-    conn.commit()
-    conn.close()
-
-# Инициализация базы данных при запуске
-init_db()
-
 # Функция для взаимодействия с DeepSeek API
 async def query_deepseek_api(prompt, user_history=None):
     """
@@ -132,11 +152,6 @@ async def query_deepseek_api(prompt, user_history=None):
     Returns:
         dict: Ответ от DeepSeek API с рекомендациями.
     """
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     # Формируем историю сообщений для контекста
     messages = [{"role": "system", "content": "Ты - эксперт по фильмам и аниме, который помогает пользователям находить контент на основе их предпочтений."}]
     
@@ -159,160 +174,31 @@ async def query_deepseek_api(prompt, user_history=None):
         "max_tokens": 500
     }
     
+    start = time.perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(DEEPSEEK_API_URL, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result
-                else:
-                    error_text = await response.text()
-                    logging.error(f"DeepSeek API error: {response.status} - {error_text}")
-                    return None
+        response = await deepseek.chat(payload)
     except Exception as e:
         logging.error(f"Error calling DeepSeek API: {e}")
-        return None
+        response = None
 
-# Функция для сохранения предпочтений пользователя
-def save_user_preferences(user_id, preferences):
-    conn = sqlite3.connect('movie_bot.db')
-    cursor = conn.cursor()
-    
-    current_time = datetime.datetime.now().isoformat()
-    
-    # Проверяем, существует ли запись для пользователя
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
-    
-    if user:
-        # Обновляем существующие предпочтения и увеличиваем счетчик взаимодействий
-        cursor.execute(
-            'UPDATE users SET preferences = ?, interaction_count = interaction_count + 1, last_interaction = ? WHERE user_id = ?',
-            (json.dumps(preferences), current_time, user_id)
-        )
-    else:
-        # Создаем новую запись
-        cursor.execute(
-            'INSERT INTO users (user_id, preferences, history, interaction_count, last_interaction) VALUES (?, ?, ?, ?, ?)',
-            (user_id, json.dumps(preferences), json.dumps([]), 1, current_time)
-        )
-    
-    conn.commit()
-    conn.close()
+    if metrics is not None:
+        metrics.LLM_SECONDS.observe(time.perf_counter() - start, payload['model'])
+        metrics.LLM_REQUESTS.inc(payload['model'], 'ok' if response is not None else 'failed')
+    return response
 
-# Функция для сохранения истории просмотра и взаимодействий
-def save_user_history(user_id, content_id, feedback):
-    conn = sqlite3.connect('movie_bot.db')
-    cursor = conn.cursor()
-    
-    current_time = datetime.datetime.now().isoformat()
-    
-    # Получаем текущую историю
-    cursor.execute('SELECT history FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    history = []
-    if result and result[0]:
-        history = json.loads(result[0])
-    
-    # Получаем информацию о контенте
-    cursor.execute('SELECT title, type FROM content WHERE id = ?', (content_id,))
-    content_result = cursor.fetchone()
-    
-    if content_result:
-        title, content_type = content_result
-        
-        # Добавляем новую запись в историю
-        history.append({
-            'content_id': content_id,
-            'title': title,
-            'type': content_type,
-            'feedback': feedback,
-            'timestamp': current_time
-        })
-        
-        # Обновляем историю в базе данных
-        cursor.execute(
-            'UPDATE users SET history = ? WHERE user_id = ?',
-            (json.dumps(history), user_id)
-        )
-        
-        # Добавляем запись в таблицу взаимодействий
-        cursor.execute(
-            'INSERT INTO user_interactions (user_id, content_id, interaction_type, timestamp) VALUES (?, ?, ?, ?)',
-            (user_id, content_id, feedback, current_time)
-        )
-        
-        # Обновляем статистику контента
-        if feedback == 'like':
-            cursor.execute('UPDATE content SET likes = likes + 1 WHERE id = ?', (content_id,))
-        elif feedback == 'dislike':
-            cursor.execute('UPDATE content SET dislikes = dislikes + 1 WHERE id = ?', (content_id,))
-        
-        # Пересчитываем рейтинг контента на основе лайков и дизлайков
-        cursor.execute(
-            '''
-            UPDATE content 
-            SET rating = CASE 
-                WHEN (likes + dislikes) > 0 THEN (likes * 10.0) / (likes + dislikes) 
-                ELSE rating 
-            END 
-            WHERE id = ?
-            ''', 
-            (content_id,)
-        )
+# Функция для ранжирования контента на основе предпочтений и истории
+async def rank_content(preferences, user_id=None, limit=RECOMMENDATIONS_LIMIT):
+    """
+    Подбирает до limit ID контента под предпочтения пользователя.
     
-    conn.commit()
-    conn.close()
-
-# Функция для получения истории пользователя с деталями контента
-def get_user_history_details(user_id, limit=10):
-    conn = sqlite3.connect('movie_bot.db')
-    cursor = conn.cursor()
-    
-    # Получаем взаимодействия пользователя с деталями контента
-    cursor.execute('''
-        SELECT 
-            ui.content_id,
-            c.title,
-            c.genre,
-            c.type,
-            ui.interaction_type,
-            ui.timestamp
-        FROM 
-            user_interactions ui
-        JOIN 
-            content c ON ui.content_id = c.id
-        WHERE 
-            ui.user_id = ?
-        ORDER BY 
-            ui.timestamp DESC
-        LIMIT ?
-    ''', (user_id, limit))
-    
-    history = cursor.fetchall()
-    
-    conn.close()
-    
-    # Преобразуем в список словарей для удобства использования
-    detailed_history = []
-    for item in history:
-        detailed_history.append({
-            'content_id': item[0],
-            'title': item[1],
-            'genre': item[2],
-            'type': item[3],
-            'feedback': item[4],
-            'timestamp': item[5]
-        })
-    
-    return detailed_history
-
-# Функция для рекомендации контента на основе предпочтений и истории
-async def recommend_content(preferences, user_id=None):
-    conn = sqlite3.connect('movie_bot.db')
-    cursor = conn.cursor()
+    Args:
+        preferences (dict): Предпочтения с ключами genre, depth, features и type.
+        user_id (int, optional): ID пользователя для исключения просмотренного и контекста DeepSeek.
+        limit (int): Максимум рекомендаций.
     
+    Returns:
+        list: ID контента в порядке убывания релевантности.
+    """
     # Получаем жанр, глубину и особенности из предпочтений
     genre = preferences.get('genre', '')
     depth = preferences.get('depth', '')
@@ -320,65 +206,73 @@ async def recommend_content(preferences, user_id=None):
     
     # Список уже просмотренных фильмов, чтобы не рекомендовать их снова
     exclude_ids = []
-    user_history = None
+    user_feedback = []
     
-    # Если есть ID пользователя, получаем его историю
+    # Если есть ID пользователя, получаем его оценки
     if user_id:
-        user_history = get_user_history_details(user_id)
-        exclude_ids = [item['content_id'] for item in user_history]
-    
-    # Формируем SQL-запрос с учетом истории просмотров и рейтинга
-    query = '''
-    SELECT id, title, genre, depth, features, type, description, rating, year
-    FROM content
-    WHERE 1=1
-    '''
-    params = []
-    
-    if genre:
-        query += ' AND genre LIKE ?'
-        params.append(f'%{genre}%')
-    
-    if depth:
-        query += ' AND depth = ?'
-        params.append(depth)
-    
-    if features:
-        query += ' AND features LIKE ?'
-        params.append(f'%{features}%')
-    
-    # Исключаем уже просмотренные фильмы
-    if exclude_ids:
-        placeholders = ','.join(['?'] * len(exclude_ids))
-        query += f' AND id NOT IN ({placeholders})'
-        params.extend(exclude_ids)
-    
-    # Сортируем по рейтингу (высший рейтинг первым)
-    query += ' ORDER BY rating DESC'
-    
-    # Выполняем запрос
-    cursor.execute(query, params)
-    results = cursor.fetchall()
+        user_feedback = await db.get_user_feedback(user_id)
+        # Отзывы из буфера еще не в базе, но рекомендовать их снова тоже нельзя
+        exclude_ids = set(await db.get_seen_content_ids(user_id))
+        exclude_ids |= feedback_writer.pending_content_ids(user_id)
+    
+    if user_feedback:
+        # Пользователь уже оценивал контент - ранжируем каталог по его вкусу
+        # «Потому что понравилось X»: соседи последнего понравившегося тайтла
+        liked_id = next((content_id for content_id, feedback in user_feedback if feedback == 'like'), None)
+        neighbors = dict(await db.get_content_neighbors(liked_id)) if liked_id else {}
+        # Выбор в диалоге - жесткий фильтр, как и для новых пользователей:
+        # история только упорядочивает подходящие тайтлы
+        await catalog.ensure_loaded()
+        candidates = catalog.matching_ids(preferences)
+        await ranker.ensure_loaded()
+        results = ranker.top_k(preferences, user_feedback, limit, exclude_ids, neighbors, candidates)
+    elif catalog.loaded:
+        # Подбираем лучшие совпадения по индексу каталога в памяти
+        await catalog.ensure_loaded()
+        results = catalog.top_k(preferences, limit, exclude_ids)
+    else:
+        # Большой каталог индексируется секунды: пока индекс строится в фоне,
+        # подбираем по индексам таблиц тегов в SQLite
+        catalog.load_in_background()
+        results = await db.find_content_ids(preferences, exclude_ids, limit)
     
     # Если нет точных совпадений, попробуем запросить DeepSeek API
     if not results and user_id:
         try:
+            user_history = await get_user_history_details(user_id)
+            
             # Формируем запрос к DeepSeek на основе предпочтений и истории
             prompt = f"Я ищу рекомендации для {'фильма' if 'movie' in preferences.get('type', '') else 'аниме'}. "
             prompt += f"Мне нравится жанр: {genre}, "
             prompt += f"я предпочитаю {'легкий контент' if depth == 'light' else 'контент средней глубины' if depth == 'medium' else 'глубокий контент'}. "
             prompt += f"Важные элементы: {features}. "
             
+            # Используем последние 5 оценок
+            recent_history = user_history[:5]
+            
             # Добавляем информацию из истории просмотров
-            if user_history:
+            if recent_history:
                 prompt += "Вот мои предыдущие оценки: "
-                for i, item in enumerate(user_history[:5]):  # Используем последние 5 оценок
+                for item in recent_history:
                     prompt += f"{item['title']} ({item['feedback'].replace('like', 'понравилось').replace('dislike', 'не понравилось')}), "
             
             prompt += "Порекомендуй мне 3 подходящих фильма или аниме с названиями и коротким описанием."
             
+            # Запрос полностью определяется предпочтениями и последними оценками,
+            # поэтому одинаковые запросы разных пользователей берутся из кэша
+            cache_key = fingerprint(
+                sorted(db.split_tags(genre)),
+                depth,
+                sorted(db.split_tags(features)),
+                preferences.get('type', ''),
+                [(item['content_id'], item['feedback']) for item in recent_history]
+            )
+            
             # Запрос к DeepSeek API
-            deepseek_response = await query_deepseek_api(prompt, user_history)
+            deepseek_response = await deepseek_cache.get_or_fetch(
+                cache_key,
+                lambda: query_deepseek_api(prompt, recent_history)
+            )
             
             if deepseek_response and 'choices' in deepseek_response:
                 ai_suggestions = deepseek_response['choices'][0]['message']['content']
@@ -386,49 +280,67 @@ async def recommend_content(preferences, user_id=None):
                 # Записываем рекомендации в лог для анализа
                 logging.info(f"DeepSeek API рекомендации для пользователя {user_id}: {ai_suggestions}")
                 
-                # Теперь попробуем найти в нашей базе фильмы, похожие на рекомендации DeepSeek
-                # Это упрощенная логика - в реальном приложении вы бы анализировали ответ и извлекали названия
-                # Здесь мы просто ищем по популярным жанрам
-                cursor.execute('''
-                SELECT id, title, genre, depth, features, type, description, rating, year 
-                FROM content 
-                WHERE id NOT IN ({})
-                ORDER BY rating DESC, RANDOM()
-                LIMIT 3
-                '''.format(','.join(['?'] * len(exclude_ids)) if exclude_ids else '0'), 
-                exclude_ids if exclude_ids else [])
+                # Извлекаем названия из ответа и ищем их в каталоге по нечеткому индексу
+                await titles.ensure_loaded()
+                ai_ids = []
+                unresolved = []
+                for title in parse_titles(ai_suggestions):
+                    content_id = titles.resolve(title)
+                    if content_id is None:
+                        unresolved.append(title)
+                    elif content_id not in exclude_ids and content_id not in ai_ids:
+                        ai_ids.append(content_id)
+                
+                # Ненайденные названия сохраняем для пополнения каталога
+                await db.stage_unresolved_titles(unresolved)
                 
-                ai_recommended = cursor.fetchall()
-                if ai_recommended:
-                    results = ai_recommended
+                if ai_ids:
+                    results = ai_ids[:limit]
         except Exception as e:
             logging.error(f"Ошибка при использовании DeepSeek API: {e}")
     
-    conn.close()
-    
     # Если все еще нет результатов, вернем случайные рекомендации с высоким рейтингом
     if not results:
-        conn = sqlite3.connect('movie_bot.db')
-        cursor = conn.cursor()
-        
-        # Исключаем уже просмотренные
-        exclude_clause = f'WHERE id NOT IN ({",".join(["?"] * len(exclude_ids))})' if exclude_ids else ''
-        
-        cursor.execute(f'''
-        SELECT id, title, genre, depth, features, type, description, rating, year 
-        FROM content 
-        {exclude_clause}
-        ORDER BY rating DESC, RANDOM() 
-        LIMIT 3
-        ''', exclude_ids if exclude_ids else [])
-        
-        results = cursor.fetchall()
-        conn.close()
+        results = await db.top_rated_content_ids(exclude_ids, limit)
     
     return results
 
+# Функция для рекомендации контента на основе предпочтений и истории
+async def recommend_content(preferences, user_id=None, limit=RECOMMENDATIONS_LIMIT):
+    """
+    Подбирает до limit рекомендаций под предпочтения пользователя.
+    
+    Returns:
+        list: Объекты db.Recommendation в порядке убывания релевантности.
+    """
+    return await db.get_content_by_ids(await rank_content(preferences, user_id, limit))
+
+# Текст карточки и кнопки отзыва для рекомендации
+def render_recommendation(rec):
+    # Карточка собирается один раз и берется из кэша, пока не изменятся поля записи
+    return cards.render(rec)
+
+# Показ рекомендации и сохранение оставшейся выдачи как курсора пользователя
+async def show_recommendation(callback_query, state, rec, remaining_ids):
+    text, markup = render_recommendation(rec)
+    
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=text,
+        reply_markup=markup,
+        parse_mode="HTML"
+    )
+    
+    # Сохраняем ID контента для отзыва и курсор по остальной выдаче
+    await state.update_data(
+        current_content_id=rec.id,
+        cursor={'ids': remaining_ids, 'expires_at': time.time() + CURSOR_TTL}
+    )
+    
+    await FilmDialog.waiting_for_feedback.set()
+
 # Обработчик команды /start
-@dp.message_handler(commands=['start'])
 async def send_welcome(message: types.Message):
     await message.answer(
         "👋 Привет! Я твой помощник в мире фильмов и аниме!\n\n"
@@ -438,29 +350,11 @@ async def send_welcome(message: types.Message):
     )
 
 # Обработчик для начала диалога о фильмах/аниме
-@dp.message_handler(lambda message: any(phrase in message.text.lower() for phrase in ['фильм', 'кино', 'посмотреть', 'аниме']))
 async def start_film_dialog(message: types.Message):
-    markup = InlineKeyboardMarkup(row_width=2)
-    genres = [
-        ('Комедия', 'comedy'),
-        ('Драма', 'drama'),
-        ('Фантастика', 'sci-fi'),
-        ('Боевик', 'action'),
-        ('Триллер', 'thriller'),
-        ('Ужасы', 'horror'),
-        ('Романтика', 'romance'),
-        ('Фэнтези', 'fantasy'),
-        ('Приключения', 'adventure')
-    ]
-    
-    for name, callback_data in genres:
-        markup.add(InlineKeyboardButton(name, callback_data=f'genre_{callback_data}'))
-    
-    await message.answer("Отлично! Какой жанр тебе больше нравится?", reply_markup=markup)
+    await message.answer("Отлично! Какой жанр тебе больше нравится?", reply_markup=GENRE_KEYBOARD)
     await FilmDialog.waiting_for_genre.set()
 
 # Обработчик выбора жанра
-@dp.callback_query_handler(lambda c: c.data.startswith('genre_'), state=FilmDialog.waiting_for_genre)
 async def process_genre(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     
@@ -470,24 +364,16 @@ async def process_genre(callback_query: types.CallbackQuery, state: FSMContext):
     async with state.proxy() as data:
         data['genre'] = genre
     
-    markup = InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        InlineKeyboardButton("Лёгкое", callback_data="depth_light"),
-        InlineKeyboardButton("Среднее", callback_data="depth_medium"),
-        InlineKeyboardButton("Глубокое", callback_data="depth_deep")
-    )
-    
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
         text="Ты хочешь что-то лёгкое или с глубоким смыслом?",
-        reply_markup=markup
+        reply_markup=DEPTH_KEYBOARD
     )
     
     await FilmDialog.waiting_for_depth.set()
 
 # Обработчик выбора глубины
-@dp.callback_query_handler(lambda c: c.data.startswith('depth_'), state=FilmDialog.waiting_for_depth)
 async def process_depth(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     
@@ -497,30 +383,16 @@ async def process_depth(callback_query: types.CallbackQuery, state: FSMContext):
     async with state.proxy() as data:
         data['depth'] = depth
     
-    markup = InlineKeyboardMarkup(row_width=2)
-    features = [
-        ('Экшен', 'action'),
-        ('Романтика', 'romance'),
-        ('Юмор', 'humor'),
-        ('Драма', 'drama'),
-        ('Мистика', 'mystery'),
-        ('Научные', 'science')
-    ]
-    
-    for name, callback_data in features:
-        markup.add(InlineKeyboardButton(name, callback_data=f'feature_{callback_data}'))
-    
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
         text="Какие элементы наиболее важны для тебя?",
-        reply_markup=markup
+        reply_markup=FEATURE_KEYBOARD
     )
     
     await FilmDialog.waiting_for_features.set()
 
 # Обработчик выбора особенностей
-@dp.callback_query_handler(lambda c: c.data.startswith('feature_'), state=FilmDialog.waiting_for_features)
 async def process_features(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     
@@ -530,64 +402,33 @@ async def process_features(callback_query: types.CallbackQuery, state: FSMContex
     async with state.proxy() as data:
         data['features'] = feature
         
-        # Сохраняем предпочтения пользователя в базе данных
         preferences = {
             'genre': data.get('genre', ''),
             'depth': data.get('depth', ''),
             'features': data.get('features', '')
         }
-        save_user_preferences(callback_query.from_user.id, preferences)
-        
-        # Получаем рекомендации на основе предпочтений
-        recommendations = recommend_content(preferences)
-        
-        if recommendations:
-            # Показываем первую рекомендацию
-            rec = recommendations[0]
-            rec_id, title, genres, depth, features, content_type = rec
-            
-            # Форматируем текст рекомендации
-            type_text = "Фильм" if content_type == "movie" else "Аниме"
-            genre_text = ', '.join([g.capitalize() for g in genres.split(',')])
-            features_text = ', '.join([f.capitalize() for f in features.split(',')])
-            
-            text = (
-                f"🎬 <b>{title}</b> ({type_text})\n\n"
-                f"🎭 Жанр: {genre_text}\n"
-                f"🎯 Особенности: {features_text}\n"
-                f"💭 Глубина: {depth.capitalize()}\n\n"
-                f"Как тебе эта рекомендация?"
-            )
-            
-            # Создаем кнопки для отзыва
-            markup = InlineKeyboardMarkup(row_width=2)
-            markup.add(
-                InlineKeyboardButton("👍 Нравится", callback_data=f"feedback_like_{rec_id}"),
-                InlineKeyboardButton("👎 Не нравится", callback_data=f"feedback_dislike_{rec_id}")
-            )
-            
-            await bot.edit_message_text(
-                chat_id=callback_query.message.chat.id,
-                message_id=callback_query.message.message_id,
-                text=text,
-                reply_markup=markup,
-                parse_mode="HTML"
-            )
-            
-            # Сохраняем ID контента для отзыва
-            data['current_content_id'] = rec_id
-            
-            await FilmDialog.waiting_for_feedback.set()
-        else:
-            await bot.edit_message_text(
-                chat_id=callback_query.message.chat.id,
-                message_id=callback_query.message.message_id,
-                text="К сожалению, я не нашел подходящих рекомендаций. Давай попробуем другие критерии."
-            )
-            await state.finish()
+    
+    user_id = callback_query.from_user.id
+    
+    # Сохраняем предпочтения пользователя в базе данных
+    await save_user_preferences(user_id, preferences)
+    
+    # Ранжируем выдачу один раз, а загружаем только показываемую рекомендацию
+    ranked_ids = await rank_content(preferences, user_id)
+    recommendations = await db.get_content_by_ids(ranked_ids[:1])
+    
+    if recommendations:
+        # Показываем первую рекомендацию, остальные остаются в курсоре
+        await show_recommendation(callback_query, state, recommendations[0], ranked_ids[1:])
+    else:
+        await bot.edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text="К сожалению, я не нашел подходящих рекомендаций. Давай попробуем другие критерии."
+        )
+        await state.finish()
 
 # Обработчик отзыва о рекомендации
-@dp.callback_query_handler(lambda c: c.data.startswith('feedback_'), state=FilmDialog.waiting_for_feedback)
 async def process_feedback(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     
@@ -595,8 +436,8 @@ async def process_feedback(callback_query: types.CallbackQuery, state: FSMContex
     feedback_type = feedback_parts[1]  # 'like' или 'dislike'
     content_id = int(feedback_parts[2])
     
-    # Сохраняем отзыв пользователя в базе данных
-    save_user_history(callback_query.from_user.id, content_id, feedback_type)
+    # Отзыв записывается в базу пачкой вместе с отзывами других пользователей
+    await feedback_writer.record(callback_query.from_user.id, content_id, feedback_type)
     
     text = "Спасибо за отзыв! Это поможет мне делать рекомендации лучше."
     if feedback_type == 'like':
@@ -604,32 +445,46 @@ async def process_feedback(callback_query: types.CallbackQuery, state: FSMContex
     else:
         text += " Я учту это при следующих рекомендациях. 👍"
     
-    markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Еще рекомендации", callback_data="more_recommendations"))
-    
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
         text=text,
-        reply_markup=markup
+        reply_markup=MORE_KEYBOARD
     )
     
-    await state.finish()
+    # Завершаем диалог, но сохраняем предпочтения и курсор для «Еще рекомендации»
+    await state.reset_state(with_data=False)
 
 # Обработчик запроса дополнительных рекомендаций
-@dp.callback_query_handler(lambda c: c.data == "more_recommendations")
-async def more_recommendations(callback_query: types.CallbackQuery):
+async def more_recommendations(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     
-    # Здесь можно было бы начать диалог заново или предложить другие рекомендации
-    await bot.edit_message_text(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        text="Хочешь получить новые рекомендации? Напиши мне, что ты хочешь посмотреть, и мы начнем заново! 🎬"
-    )
+    data = await state.get_data()
+    cursor = data.get('cursor')
+    preferences = {key: data[key] for key in ('genre', 'depth', 'features') if key in data}
+    
+    # Берем следующую рекомендацию из сохраненной выдачи, пока курсор не истек
+    if cursor and cursor['ids'] and cursor['expires_at'] > time.time():
+        ranked_ids = cursor['ids']
+    elif preferences:
+        # Выдача закончилась или устарела - ранжируем заново по тем же предпочтениям
+        ranked_ids = await rank_content(preferences, callback_query.from_user.id)
+    else:
+        ranked_ids = []
+    
+    recommendations = await db.get_content_by_ids(ranked_ids[:1])
+    
+    if recommendations:
+        await show_recommendation(callback_query, state, recommendations[0], ranked_ids[1:])
+    else:
+        await bot.edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text="Хочешь получить новые рекомендации? Напиши мне, что ты хочешь посмотреть, и мы начнем заново! 🎬"
+        )
+        await state.finish()
 
 # Обработчик для неизвестных сообщений
-@dp.message_handler()
 async def unknown_message(message: types.Message):
     await message.answer(
         "Не совсем понимаю, что ты имеешь в виду. 🤔\n\n"
@@ -637,6 +492,59 @@ async def unknown_message(message: types.Message):
         "и я помогу тебе найти что-то интересное!"
     )
 
+# Регистрация обработчиков: текст и кнопки разбираются роутерами намерений
+def register_handlers(dp):
+    intents = IntentRouter(default=unknown_message)
+    intents.add('film_dialog', FILM_DIALOG_PHRASES, start_film_dialog)
+    
+    callbacks = CallbackRouter()
+    callbacks.add('genre', process_genre, state=FilmDialog.waiting_for_genre)
+    callbacks.add('depth', process_depth, state=FilmDialog.waiting_for_depth)
+    callbacks.add('feature', process_features, state=FilmDialog.waiting_for_features)
+    callbacks.add('feedback', process_feedback, state=FilmDialog.waiting_for_feedback)
+    callbacks.add('more', more_recommendations)
+    
+    dp.register_message_handler(send_welcome, commands=['start'])
+    dp.register_message_handler(intents.dispatch)
+    dp.register_callback_query_handler(callbacks.dispatch, state='*')
+
+# Запуск локального эндпоинта метрик
+async def on_startup(dispatcher: Dispatcher):
+    if metrics_exporter is not None:
+        await metrics_exporter.start()
+
+# Освобождение соединений с базой данных и DeepSeek API при остановке
+async def on_shutdown(dispatcher: Dispatcher):
+    if metrics_exporter is not None:
+        await metrics_exporter.stop()
+    await dispatcher.storage.close()
+    await dispatcher.storage.wait_closed()
+    await deepseek.close()
+    logging.info(f"Кэш DeepSeek: {deepseek_cache.stats()}")
+    deepseek_cache.close()
+    await feedback_writer.close()
+    db.pool.close()
+
 # Запуск бота
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
\ No newline at end of file
+    # Настройка логирования
+    logging.basicConfig(level=logging.INFO)
+    dp = create_app()
+    
+    if WEBHOOK_URL:
+        from webhook import run_webhook
+        
+        run_webhook(
+            dp,
+            WEBHOOK_URL,
+            path=WEBHOOK_PATH,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+            secret_token=WEBHOOK_SECRET,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            workers=UPDATE_WORKERS,
+            queue_size=UPDATE_QUEUE_SIZE
+        )
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
@@ -0,0 +1,367 @@
+import bisect
+import functools
+import logging
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# Экспортер слушает только локальный интерфейс: метрики не публикуются наружу
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+# Границы корзин гистограмм задержек в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Какие счетчики stats() кэшей выгружаются как cache_requests_total{result=...}
+CACHE_RESULTS = {'hits': 'hit', 'misses': 'miss', 'coalesced': 'coalesced'}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterSeries:
+    """Значение счетчика для одного набора меток."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter:
+    """
+    Монотонный счетчик с метками.
+
+    Значения меток передаются позиционно в порядке labelnames. Метрики
+    обновляются и выгружаются в потоке event loop, поэтому блокировки не
+    нужны: даже время SQL снимается в корутине, ожидающей пул. Горячие
+    пути берут значение через labels один раз и затем обновляют его
+    напрямую, без кортежа меток и поиска в словаре.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+
+    def labels(self, *labels):
+        """Значение для набора меток; создается при первом обращении."""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _CounterSeries()
+        return series
+
+    def inc(self, *labels, amount=1):
+        self.labels(*labels).value += amount
+
+    def samples(self):
+        for labels, series in self._series.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {series.value}"
+
+
+class _HistogramSeries:
+    """Счетчики корзин и сумма значений гистограммы для одного набора меток."""
+
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Последний счетчик - корзина +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами, как histogram в Prometheus.
+
+    observe находит корзину двоичным поиском и увеличивает один счетчик;
+    накопленные суммы по корзинам считаются только при выгрузке. Как и у
+    Counter, labels возвращает набор счетчиков, который можно обновлять
+    напрямую.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def labels(self, *labels):
+        """Счетчики для набора меток; создаются при первом обращении."""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value, *labels):
+        self.labels(*labels).observe(value)
+
+    def samples(self):
+        for labels, series in self._series.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket = _labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket} {total}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series.sum}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {total}"
+
+
+class Registry:
+    """
+    Набор метрик процесса с выгрузкой в текстовом формате Prometheus.
+
+    Кроме собственных метрик выгружает счетчики попаданий кэшей: они уже
+    ведутся самими кэшами и читаются только в момент запроса метрик, так
+    что на горячем пути ничего не добавляется.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._caches = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name, cache):
+        """
+        Выгружает счетчики кэша: stats() или атрибуты hits/misses.
+
+        Повторная регистрация с тем же именем заменяет кэш.
+        """
+        self._caches[name] = cache
+
+    def _cache_samples(self):
+        for name, cache in self._caches.items():
+            stats = cache.stats() if hasattr(cache, 'stats') else {'hits': cache.hits, 'misses': cache.misses}
+            for key, result in CACHE_RESULTS.items():
+                if key in stats:
+                    yield f"cache_requests_total{_labels(('cache', 'result'), (name, result))} {stats[key]}"
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        if self._caches:
+            lines.append('# HELP cache_requests_total Обращения к кэшам по результату.')
+            lines.append('# TYPE cache_requests_total counter')
+            lines.extend(self._cache_samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики процесса
+registry = Registry()
+HANDLER_SECONDS = registry.histogram(
+    'handler_duration_seconds', 'Время обработки апдейта от middleware до ответа обработчика.',
+    ('kind', 'handler'))
+SQL_SECONDS = registry.histogram(
+    'sql_duration_seconds', 'Время запроса к SQLite с ожиданием потока пула.', ('pool', 'statement'))
+LLM_SECONDS = registry.histogram(
+    'llm_request_duration_seconds', 'Время запроса к LLM с повторами.', ('model',))
+LLM_REQUESTS = registry.counter(
+    'llm_requests_total', 'Запросы к LLM по результату.', ('model', 'outcome'))
+TELEGRAM_SECONDS = registry.histogram(
+    'telegram_request_duration_seconds', 'Время вызова Bot API.', ('method',))
+FSM_TRANSITIONS = registry.counter(
+    'fsm_transitions_total', 'Переходы диалогов в состояние; none - сброс.', ('state',))
+
+
+def handler_name(handler, event):
+    """Имя обработчика для метки; для роутеров - обработчик, выбранный роутером."""
+    if handler is None:
+        return 'unhandled'
+    router = getattr(handler, '__self__', None)
+    if router is not None and hasattr(router, 'resolve'):
+        handler = router.resolve(event)
+        if handler is None:
+            return 'unhandled'
+    return getattr(handler, '__name__', type(handler).__name__)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Измеряет время обработки каждого сообщения и callback-запроса.
+
+    Время считается от pre_process до post_process, то есть вместе с
+    фильтрами и запросами обработчика к базе, LLM и Bot API. Обработчик
+    определяется в process, когда aiogram уже выбрал его по фильтрам.
+
+    aiogram вызывает trigger для каждого действия каждого апдейта, в том
+    числе для ненужных здесь process_update; нужные действия находятся по
+    словарю и обрабатываются обычными функциями, без форматирования имени
+    метода и создания корутины на каждый вызов.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._hooks = {}
+        for kind in ('message', 'callback_query'):
+            self._hooks[f'pre_process_{kind}'] = self._start
+            self._hooks[f'process_{kind}'] = self._resolve
+            self._hooks[f'post_process_{kind}'] = functools.partial(self._observe, kind)
+
+    async def trigger(self, action, args):
+        hook = self._hooks.get(action)
+        if hook is not None:
+            hook(*args)
+
+    @staticmethod
+    def _start(event, data):
+        data['metrics_start'] = time.perf_counter()
+
+    @staticmethod
+    def _resolve(event, data):
+        data['metrics_handler'] = handler_name(current_handler.get(), event)
+
+    @staticmethod
+    def _observe(kind, event, results, data):
+        start = data.get('metrics_start')
+        if start is not None:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, kind, data.get('metrics_handler', 'unhandled'))
+
+
+def statement_name(func):
+    """Имя запроса для метки: полное имя функции, для лямбд - функция, в которой она объявлена."""
+    name = getattr(func, '__qualname__', type(func).__name__)
+    return name.split('.<locals>')[0] if '<lambda>' in name else name
+
+
+def instrument_pool(pool, name='main'):
+    """
+    Измеряет каждый вызов pool.run по имени переданной функции.
+
+    Повторный вызов для того же пула ничего не меняет.
+    """
+    if hasattr(pool.run, '__wrapped__'):
+        return pool
+    run = pool.run
+    # Лямбды создаются заново на каждый вызов, но код у них общий: имя запроса
+    # и счетчики ищутся по объекту кода один раз
+    statements = {}
+
+    @functools.wraps(run)
+    async def timed_run(func, *args):
+        start = time.perf_counter()
+        try:
+            return await run(func, *args)
+        finally:
+            code = getattr(func, '__code__', None)
+            series = statements.get(code)
+            if series is None:
+                series = SQL_SECONDS.labels(name, statement_name(func))
+                if code is not None:
+                    statements[code] = series
+            series.observe(time.perf_counter() - start)
+
+    pool.run = timed_run
+    return pool
+
+
+def instrument_storage(storage):
+    """Считает переходы FSM: reset_state и finish тоже проходят через set_state."""
+    if hasattr(storage.set_state, '__wrapped__'):
+        return storage
+    set_state = storage.set_state
+
+    transitions = {}
+
+    @functools.wraps(set_state)
+    async def counted_set_state(*, chat=None, user=None, state=None):
+        await set_state(chat=chat, user=user, state=state)
+        series = transitions.get(state)
+        if series is None:
+            series = transitions[state] = FSM_TRANSITIONS.labels(state or 'none')
+        series.inc()
+
+    storage.set_state = counted_set_state
+    return storage
+
+
+def instrument_bot(bot):
+    """Измеряет вызовы Bot API (sendMessage, editMessageText, ...) по имени метода."""
+    if hasattr(bot.request, '__wrapped__'):
+        return bot
+    request = bot.request
+
+    methods = {}
+
+    @functools.wraps(request)
+    async def timed_request(method, data=None, files=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        finally:
+            series = methods.get(method)
+            if series is None:
+                series = methods[method] = TELEGRAM_SECONDS.labels(method)
+            series.observe(time.perf_counter() - start)
+
+    bot.request = timed_request
+    return bot
+
+
+class MetricsExporter:
+    """
+    HTTP-эндпоинт /metrics в формате Prometheus на локальном интерфейсе.
+
+    Args:
+        host (str): Адрес для прослушивания.
+        port (int): Порт.
+        registry (Registry): Выгружаемые метрики.
+    """
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(body=self.registry.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
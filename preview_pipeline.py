@@ -0,0 +1,260 @@
+import logging
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+
+from color_grading import load_preset
+from frame_effects import FrameCompositor, load_image
+
+# Параметры превью по умолчанию
+PREVIEW_SIZE = (640, 360)
+PREVIEW_FPS = 25
+PREVIEW_DURATION = 3.0
+# Сколько кадровых буферов переиспользуется по кругу (не меньше 3)
+RING_SIZE = 3
+FFMPEG_BINARY = 'ffmpeg'
+
+
+def render_frames(compositor, fps, duration, lut=None, ring_size=RING_SIZE):
+    """
+    Генерирует кадры анимации: эффекты, затем цветокоррекция.
+
+    Кадры рисуются по кругу в ring_size заранее выделенных буферов, поэтому
+    память не зависит от длины ролика. Выданный буфер будет перезаписан
+    через ring_size кадров: потребитель должен успеть его обработать.
+
+    Args:
+        compositor (FrameCompositor): Слои эффектов поверх исходного изображения.
+        fps (float): Кадров в секунду.
+        duration (float): Длительность в секундах.
+        lut (color_grading.Lut, optional): Цветокоррекция.
+        ring_size (int): Число буферов.
+    """
+    ring = [np.empty(compositor.shape, dtype=np.uint8) for _ in range(ring_size)]
+    for index in range(round(fps * duration)):
+        frame = ring[index % ring_size]
+        compositor.render(index * 1000 / fps, out=frame)
+        if lut is not None:
+            lut.apply(frame, out=frame)
+        yield frame
+
+
+class FrameWriter:
+    """
+    Записывает кадры в фоновом потоке, пока рисуется следующий кадр.
+
+    Очередь вмещает ring_size - 2 кадра, и еще один записывается потоком,
+    поэтому буфер, который генератор заполняет следующим, уже точно
+    записан. Кадры передаются без копирования.
+
+    Args:
+        path (str): Файл результата.
+        width (int): Ширина кадра.
+        height (int): Высота кадра.
+        fps (float): Кадров в секунду.
+        frame_count (int): Сколько кадров будет записано.
+        ring_size (int): Размер круга буферов генератора кадров.
+    """
+
+    def __init__(self, path, width, height, fps, frame_count, ring_size=RING_SIZE):
+        if ring_size < 3:
+            raise ValueError("Для записи в фоне нужно не меньше 3 буферов")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_count = frame_count
+        self._queue = queue.Queue(maxsize=ring_size - 2)
+        self._error = None
+        self._thread = None
+
+    def __enter__(self):
+        self.open()
+        self._thread = threading.Thread(target=self._run, name='frame-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(None)
+        self._thread.join()
+        self.finish(aborted=exc_type is not None or self._error is not None)
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is None:
+                try:
+                    self.write_frame(frame)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def open(self):
+        pass
+
+    def write_frame(self, frame):
+        raise NotImplementedError
+
+    def finish(self, aborted=False):
+        pass
+
+
+class FFmpegWriter(FrameWriter):
+    """
+    Кодирует кадры в H.264 MP4 (или любой формат ffmpeg по расширению) через stdin ffmpeg.
+
+    stderr ffmpeg пишется во временный файл, а не в канал: иначе ffmpeg,
+    заполнив канал stderr, перестанет читать stdin, и запись кадра зависнет.
+    """
+
+    def open(self):
+        command = [
+            FFMPEG_BINARY, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{self.width}x{self.height}', '-r', str(self.fps),
+            '-i', '-'
+        ]
+        if not self.path.endswith('.gif'):
+            # yuv420p нужен для воспроизведения в Telegram и требует четных размеров
+            command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p',
+                        '-c:v', 'libx264', '-preset', 'veryfast', '-movflags', '+faststart']
+        command.append(self.path)
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def write_frame(self, frame):
+        # memoryview отдает буфер кадра в канал без копии в bytes
+        self._process.stdin.write(memoryview(frame).cast('B'))
+
+    def finish(self, aborted=False):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        code = self._process.wait()
+        with self._stderr:
+            self._stderr.seek(0)
+            stderr = self._stderr.read()
+        if code != 0 and not aborted:
+            raise RuntimeError(f"ffmpeg завершился с кодом {code}: {stderr.decode(errors='replace').strip()}")
+
+
+class APNGWriter(FrameWriter):
+    """
+    Пишет анимированный PNG без внешних программ.
+
+    Строки кадра кодируются фильтром Sub векторно в заранее выделенный
+    буфер и сжимаются zlib, который отпускает GIL на время сжатия.
+    """
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def _control(self):
+        return struct.pack('>II', self.frame_count, 0)
+
+    def open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+        self._control_offset = self._file.tell()
+        self._chunk(b'acTL', self._control())
+        # Первый байт каждой строки - номер фильтра (1 - Sub)
+        self._rows = np.zeros((self.height, self.width * 3 + 1), dtype=np.uint8)
+        self._rows[:, 0] = 1
+        self._sequence = 0
+        self._written = 0
+        self._delay = max(round(1000 / self.fps), 1)
+
+    def write_frame(self, frame):
+        rows = self._rows
+        rows[:, 1:4] = frame[:, 0]
+        np.subtract(frame[:, 1:], frame[:, :-1], out=rows[:, 4:].reshape(self.height, self.width - 1, 3))
+        data = zlib.compress(memoryview(rows), 6)
+
+        self._chunk(b'fcTL', struct.pack('>IIIIIHHBB', self._sequence, self.width, self.height,
+                                         0, 0, self._delay, 1000, 0, 0))
+        self._sequence += 1
+        if self._written == 0:
+            self._chunk(b'IDAT', data)
+        else:
+            self._chunk(b'fdAT', struct.pack('>I', self._sequence) + data)
+            self._sequence += 1
+        self._written += 1
+
+    def finish(self, aborted=False):
+        self._chunk(b'IEND', b'')
+        if self._written != self.frame_count:
+            # Число кадров объявляется заранее; исправляем, если кадров оказалось меньше
+            self.frame_count = self._written
+            self._file.seek(self._control_offset)
+            self._chunk(b'acTL', self._control())
+        self._file.close()
+
+
+def writer_for(output_path):
+    """
+    Класс записи по расширению файла: .png/.apng - встроенный APNG, остальные - ffmpeg.
+
+    Raises:
+        RuntimeError: Если нужен ffmpeg, а его нет в PATH.
+    """
+    if output_path.endswith(('.png', '.apng')):
+        return APNGWriter
+    if shutil.which(FFMPEG_BINARY):
+        return FFmpegWriter
+    raise RuntimeError(f"Для {os.path.basename(output_path)} нужен ffmpeg; без него доступен только APNG (.png)")
+
+
+def render_preview(image, output_path, size=PREVIEW_SIZE, fps=PREVIEW_FPS, duration=PREVIEW_DURATION,
+                   preset=None, layers=None, ring_size=RING_SIZE):
+    """
+    Рендерит анимированное превью изображения в файл.
+
+    Формат выбирается по расширению: .png/.apng - встроенный APNG,
+    остальные (.mp4, .gif, ...) - через ffmpeg. Ролик не хранится в
+    памяти целиком: кадры проходят через круг из ring_size буферов.
+
+    Args:
+        image (str | numpy.ndarray): Путь к изображению или массив RGB uint8.
+        output_path (str): Файл результата.
+        size (tuple): (ширина, высота) кадра.
+        fps (float): Кадров в секунду.
+        duration (float): Длительность в секундах.
+        preset (str, optional): Пресет цветокоррекции из списка luts.
+        layers (list, optional): Слои эффектов; по умолчанию как во flashFrameAnimate.
+        ring_size (int): Число кадровых буферов.
+
+    Returns:
+        str: output_path.
+    """
+    if isinstance(image, str):
+        image = load_image(image, size)
+    compositor = FrameCompositor(image, layers)
+    lut = load_preset(preset) if preset else None
+    height, width = compositor.shape[:2]
+    frame_count = round(fps * duration)
+
+    with writer_for(output_path)(output_path, width, height, fps, frame_count, ring_size) as writer:
+        for frame in render_frames(compositor, fps, duration, lut, ring_size):
+            writer.write(frame)
+
+    logging.info(f"Превью {output_path}: {frame_count} кадров {width}x{height}")
+    return output_path
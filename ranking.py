@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+from scipy import sparse
+
+import db
+
+# Насколько сильнее выбор в текущем диалоге, чем вкусы из истории оценок
+PREFERENCE_WEIGHT = 1.0
+HISTORY_WEIGHT = 0.6
+# Вклад рейтинга (0-10) в итоговую оценку: различает тайтлы с одинаковыми тегами
+RATING_WEIGHT = 0.02
+# Вес каждой следующей (более старой) оценки относительно предыдущей
+HISTORY_DECAY = 0.97
+# Вклад косинусной близости (0-1) к недавно понравившемуся тайтлу
+NEIGHBOR_WEIGHT = 0.5
+
+
+def _year_bucket(year):
+    return year // 10 * 10 if year else None
+
+
+class RankingEngine:
+    """
+    Персональное ранжирование каталога по векторам признаков.
+
+    Каждая запись каталога кодируется one-hot вектором жанров, особенностей,
+    глубины, типа и десятилетия выхода; строки матрицы нормированы, поэтому
+    тайтлы с длинным списком тегов не получают преимущества. Вкус
+    пользователя - взвешенная сумма строк понравившихся (со знаком плюс) и
+    не понравившихся (со знаком минус) тайтлов, где свежие оценки весомее.
+    Весь каталог оценивается одним умножением разреженной (CSR) матрицы на
+    вектор, а лучшие k выбираются через argpartition без полной сортировки.
+
+    Матрица строится один раз и перестраивается, когда импорт каталога
+    меняет отпечаток db.catalog_stamp. Новые рейтинги после записи отзывов только
+    запоминаются и переносятся в вектор рейтингов одной операцией перед
+    следующим ранжированием.
+
+    Args:
+        refresh_interval (float): Как часто проверять, менялся ли каталог, в секундах.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._vocabulary = {}
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._ratings = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self._stale_ratings = {}
+        self._stamp = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._load_lock = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._ids)
+
+    @staticmethod
+    def _keys(genre, depth, features, content_type, year=None):
+        keys = [('genre', tag) for tag in db.split_tags(genre)]
+        keys += [('feature', tag) for tag in db.split_tags(features)]
+        if depth:
+            keys.append(('depth', depth))
+        if content_type:
+            keys.append(('type', content_type))
+        decade = _year_bucket(year)
+        if decade is not None:
+            keys.append(('decade', decade))
+        return keys
+
+    def load(self, conn):
+        """Строит матрицу признаков по таблице content."""
+        self._install(self._build(conn))
+
+    @classmethod
+    def _build(cls, conn):
+        # Матрица собирается в потоке пула в локальные переменные, а подменяется
+        # одним присваиванием в event loop: top_k не видит новую матрицу со старыми id
+        stamp = db.catalog_stamp(conn)
+        rows = conn.execute('SELECT id, genre, depth, features, type, year, rating FROM content ORDER BY id').fetchall()
+
+        vocabulary = {}
+        # Сочетаний тегов немного, поэтому разобранные столбцы переиспользуются
+        columns_cache = {}
+        item_columns = []
+        for _, genre, depth, features, content_type, year, _ in rows:
+            tags = (genre, depth, features, content_type, _year_bucket(year))
+            columns = columns_cache.get(tags)
+            if columns is None:
+                columns = columns_cache[tags] = [
+                    vocabulary.setdefault(key, len(vocabulary))
+                    for key in dict.fromkeys(cls._keys(genre, depth, features, content_type, year))
+                ]
+            item_columns.append(columns)
+
+        # У тайтла всего несколько тегов, поэтому матрица хранится в CSR:
+        # умножение читает только ненулевые элементы
+        lengths = np.array([len(columns) for columns in item_columns], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((column for columns in item_columns for column in columns),
+                              dtype=np.int32, count=indptr[-1])
+        # Нормировка строк: 1/sqrt(число тегов) в каждом ненулевом элементе
+        norms = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths).astype(np.float32)
+        matrix = sparse.csr_matrix((norms, indices, indptr), shape=(len(rows), len(vocabulary)))
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        ratings = np.array([row[6] or 0 for row in rows], dtype=np.float32)
+        positions = {content_id: row for row, content_id in enumerate(ids.tolist())}
+        return stamp, vocabulary, matrix, ids, ratings, positions
+
+    def _install(self, index):
+        self._stamp, self._vocabulary, self._matrix, self._ids, self._ratings, self._rows = index
+        self._checked_at = time.monotonic()
+        self._loaded = True
+        logging.info(f"Матрица ранжирования загружена: {self._matrix.shape[0]} записей, {self._matrix.shape[1]} признаков")
+
+    def _build_if_changed(self, conn, stamp):
+        if db.catalog_stamp(conn) != stamp:
+            return self._build(conn)
+        return None
+
+    async def ensure_loaded(self):
+        """Загружает матрицу при первом обращении и перестраивает её после изменения каталога."""
+        if self._loaded and time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                self._install(await db.pool.run(self._build))
+            elif time.monotonic() - self._checked_at >= self.refresh_interval:
+                self._checked_at = time.monotonic()
+                index = await db.pool.run(self._build_if_changed, self._stamp)
+                if index is not None:
+                    self._install(index)
+
+    def invalidate(self):
+        """Требует перестроить матрицу при следующем обращении (например, после импорта каталога)."""
+        self._loaded = False
+
+    def update_rating(self, content_id, rating):
+        """Помечает рейтинг устаревшим; вектор рейтингов обновится перед следующим top_k."""
+        self._stale_ratings[content_id] = rating
+
+    def _apply_ratings(self):
+        stale, self._stale_ratings = self._stale_ratings, {}
+        updates = [(self._rows[content_id], rating) for content_id, rating in stale.items() if content_id in self._rows]
+        if updates:
+            rows, ratings = zip(*updates)
+            self._ratings[list(rows)] = ratings
+
+    def query_vector(self, preferences, feedback=()):
+        """
+        Строит вектор запроса из предпочтений диалога и истории оценок.
+
+        Args:
+            preferences (dict): Предпочтения с ключами genre, depth, features и type.
+            feedback (iterable): Пары (content_id, 'like' | 'dislike'), начиная с самой свежей.
+
+        Returns:
+            numpy.ndarray: Вектор длины числа признаков.
+        """
+        query = np.zeros(len(self._vocabulary), dtype=np.float32)
+
+        keys = self._keys(
+            preferences.get('genre', ''),
+            preferences.get('depth', ''),
+            preferences.get('features', ''),
+            preferences.get('type', '')
+        )
+        columns = [self._vocabulary[key] for key in keys if key in self._vocabulary]
+        if columns:
+            query[columns] = PREFERENCE_WEIGHT / np.sqrt(len(columns))
+
+        rows = []
+        weights = []
+        weight = 1.0
+        for content_id, interaction_type in feedback:
+            row = self._rows.get(content_id)
+            if row is not None and interaction_type in ('like', 'dislike'):
+                rows.append(row)
+                weights.append(weight if interaction_type == 'like' else -weight)
+            weight *= HISTORY_DECAY
+
+        if rows:
+            weights = np.array(weights, dtype=np.float32)
+            profile = self._matrix[rows].T @ weights
+            query += HISTORY_WEIGHT * profile / np.abs(weights).sum()
+
+        return query
+
+    def top_k(self, preferences, feedback=(), k=1, exclude_ids=(), boosts=None, candidates=None):
+        """
+        Возвращает до k ID контента с наибольшей персональной оценкой.
+
+        Args:
+            preferences (dict): Предпочтения с ключами genre, depth, features и type.
+            feedback (iterable): Пары (content_id, 'like' | 'dislike'), начиная с самой свежей.
+            k (int): Сколько ID вернуть.
+            exclude_ids (iterable, optional): Уже просмотренный контент.
+            boosts (dict, optional): Близость {content_id: score} к понравившимся тайтлам.
+            candidates (set, optional): Ранжировать только эти ID (жесткие фильтры диалога);
+                None - весь каталог.
+
+        Returns:
+            list: ID контента в порядке убывания оценки.
+        """
+        if not len(self._ids) or k <= 0:
+            return []
+
+        if self._stale_ratings:
+            self._apply_ratings()
+
+        scores = self._matrix @ self.query_vector(preferences, feedback)
+        scores += RATING_WEIGHT * self._ratings
+
+        if boosts:
+            boosted = [(self._rows[content_id], score) for content_id, score in boosts.items() if content_id in self._rows]
+            if boosted:
+                rows, values = zip(*boosted)
+                scores[list(rows)] += NEIGHBOR_WEIGHT * np.array(values, dtype=np.float32)
+
+        if candidates is not None:
+            # ID в матрице отсортированы: строки кандидатов находятся двоичным
+            # поиском по массиву, без обхода словаря по каждому ID
+            wanted = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            rows = np.minimum(np.searchsorted(self._ids, wanted), len(self._ids) - 1)
+            rows = rows[self._ids[rows] == wanted]
+            allowed = np.full(len(scores), -np.inf, dtype=scores.dtype)
+            allowed[rows] = scores[rows]
+            scores = allowed
+
+        excluded = [self._rows[content_id] for content_id in exclude_ids if content_id in self._rows]
+        if excluded:
+            scores[excluded] = -np.inf
+        available = int(np.count_nonzero(scores > -np.inf))
+
+        k = min(k, available)
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return self._ids[top].tolist()
+
+
+# Общий движок ранжирования процесса
+ranker = RankingEngine()
@@ -0,0 +1,147 @@
+import html
+import json
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Варианты ответов диалога: (подпись кнопки, значение в callback_data)
+GENRES = [
+    ('Комедия', 'comedy'),
+    ('Драма', 'drama'),
+    ('Фантастика', 'sci-fi'),
+    ('Боевик', 'action'),
+    ('Триллер', 'thriller'),
+    ('Ужасы', 'horror'),
+    ('Романтика', 'romance'),
+    ('Фэнтези', 'fantasy'),
+    ('Приключения', 'adventure')
+]
+DEPTHS = [
+    ('Лёгкое', 'light'),
+    ('Среднее', 'medium'),
+    ('Глубокое', 'deep')
+]
+FEATURES = [
+    ('Экшен', 'action'),
+    ('Романтика', 'romance'),
+    ('Юмор', 'humor'),
+    ('Драма', 'drama'),
+    ('Мистика', 'mystery'),
+    ('Научные', 'science')
+]
+
+
+def freeze(markup):
+    """
+    Сериализует клавиатуру в JSON один раз.
+
+    aiogram передает строковый reply_markup в API как есть, поэтому
+    неизменяемые клавиатуры не сериализуются заново при каждой отправке.
+    """
+    return json.dumps(markup.to_python(), ensure_ascii=False)
+
+
+def _column_keyboard(options, prefix):
+    markup = InlineKeyboardMarkup(row_width=2)
+    for name, value in options:
+        markup.add(InlineKeyboardButton(name, callback_data=f'{prefix}{value}'))
+    return freeze(markup)
+
+
+def _depth_keyboard():
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(*(InlineKeyboardButton(name, callback_data=f'depth_{value}') for name, value in DEPTHS))
+    return freeze(markup)
+
+
+def _more_keyboard():
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Еще рекомендации", callback_data="more_recommendations"))
+    return freeze(markup)
+
+
+# Клавиатуры диалога не зависят от пользователя и строятся при импорте
+GENRE_KEYBOARD = _column_keyboard(GENRES, 'genre_')
+DEPTH_KEYBOARD = _depth_keyboard()
+FEATURE_KEYBOARD = _column_keyboard(FEATURES, 'feature_')
+MORE_KEYBOARD = _more_keyboard()
+
+
+def _capitalize_tags(value):
+    return html.escape(', '.join([tag.capitalize() for tag in value.split(',')]))
+
+
+def format_card(rec):
+    """
+    Текст карточки и кнопки отзыва для рекомендации.
+
+    Поля записи приходят из импорта каталога как есть, поэтому экранируются
+    перед подстановкой в HTML-разметку.
+
+    Returns:
+        tuple: (HTML-текст, сериализованная клавиатура).
+    """
+    type_text = "Фильм" if rec.type == "movie" else "Аниме"
+
+    text = (
+        f"🎬 <b>{html.escape(rec.title)}</b> ({type_text})\n\n"
+        f"🎭 Жанр: {_capitalize_tags(rec.genre)}\n"
+        f"🎯 Особенности: {_capitalize_tags(rec.features)}\n"
+        f"💭 Глубина: {html.escape(rec.depth.capitalize())}\n\n"
+        f"Как тебе эта рекомендация?"
+    )
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        InlineKeyboardButton("👍 Нравится", callback_data=f"feedback_like_{rec.id}"),
+        InlineKeyboardButton("👎 Не нравится", callback_data=f"feedback_dislike_{rec.id}")
+    )
+
+    return text, freeze(markup)
+
+
+class CardCache:
+    """
+    LRU-кэш отформатированных карточек рекомендаций.
+
+    Популярные тайтлы показываются разным пользователям много раз, поэтому
+    текст и клавиатура карточки собираются один раз на версию записи.
+    Ключ - сама запись db.Recommendation, то есть все поля, которые попадают
+    в карточку: после правки названия или тегов импортом запрос приходит
+    с другим ключом, а старая карточка вытесняется как давно не
+    использованная. Рейтинг в карточку не выводится и ключом не является.
+
+    Args:
+        max_entries (int): Максимум карточек в памяти.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def render(self, rec):
+        """Возвращает (текст, клавиатура) карточки, собирая её только при промахе."""
+        key = tuple(rec)
+        card = self._entries.get(key)
+        if card is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return card
+
+        self.misses += 1
+        card = self._entries[key] = format_card(rec)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return card
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Общий кэш карточек процесса
+cards = CardCache()
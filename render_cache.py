@@ -0,0 +1,366 @@
+import asyncio
+import functools
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from aiogram.types import InputFile
+
+from color_grading import LUT_LIST, preset_path
+from db import ConnectionPool
+from frame_effects import default_layers
+from preview_pipeline import PREVIEW_DURATION, PREVIEW_FPS, PREVIEW_SIZE, render_preview
+from render_farm import PRIORITY_INTERACTIVE
+from response_cache import coalesce, fingerprint
+
+RENDER_CACHE_DIR = 'render_cache'
+# Сколько места на диске могут занимать готовые превью
+RENDER_CACHE_BYTES = 512 * 1024 * 1024
+# Сколько записей индекса держать в памяти
+HOT_ENTRIES = 256
+# Читаем исходник блоками, чтобы не держать файл в памяти целиком
+_HASH_BLOCK = 1 << 20
+
+# Готовое превью: файл на диске и/или file_id уже загруженного в Telegram
+CachedRender = namedtuple('CachedRender', ['key', 'path', 'file_id'])
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_digest(path, mtime, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_digest(image):
+    """
+    Хэш содержимого исходного изображения.
+
+    Для файла хэшируются байты, а не путь, поэтому одна и та же картинка
+    под разными именами дает один ключ; повторные вызовы берутся из
+    LRU-кэша, пока файл не изменился.
+    """
+    if isinstance(image, str):
+        stat = os.stat(image)
+        return _file_digest(os.path.abspath(image), stat.st_mtime_ns, stat.st_size)
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    digest = hashlib.sha256(repr(image.shape).encode())
+    digest.update(memoryview(image).cast('B'))
+    return digest.hexdigest()
+
+
+def preset_digest(preset, list_path=LUT_LIST):
+    """
+    Хэш PNG пресета цветокоррекции.
+
+    Замена файла пресета под тем же именем меняет ключ превью. Для пресета
+    без файла возвращается пустая строка: рендер с ним все равно упадет.
+    """
+    if not preset:
+        return ''
+    path = preset_path(preset, list_path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ''
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def layer_params(layers):
+    """Слои эффектов как [имя класса, {параметр: значение}] по аргументам конструктора."""
+    params = []
+    for layer in layers:
+        values = {}
+        for name in inspect.signature(type(layer).__init__).parameters:
+            if name != 'self' and hasattr(layer, name):
+                value = getattr(layer, name)
+                values[name] = value.tolist() if isinstance(value, np.ndarray) else value
+        params.append([type(layer).__name__, values])
+    return params
+
+
+def preview_key(image, size=PREVIEW_SIZE, fps=PREVIEW_FPS, duration=PREVIEW_DURATION,
+                preset=None, layers=None, suffix='.mp4'):
+    """
+    Ключ превью по содержимому: одинаковые входы и параметры дают один ключ.
+
+    Аргументы те же, что у render_preview; suffix - формат результата.
+    Исходник и PNG пресета хэшируются целиком, поэтому для больших файлов
+    ключ стоит считать в потоке исполнителя.
+    """
+    if not isinstance(image, str):
+        # Массив рендерится в своем размере, size к нему не применяется
+        size = (image.shape[1], image.shape[0])
+    layers = default_layers() if layers is None else layers
+    return fingerprint('preview', image_digest(image), list(size), fps, duration, preset or '',
+                       preset_digest(preset), layer_params(layers), suffix)
+
+
+class RenderCache:
+    """
+    Кэш готовых превью на диске с адресацией по содержимому.
+
+    Файлы лежат в directory под именем ключа, индекс (размер, время
+    последнего обращения, file_id Telegram) хранится в SQLite рядом с
+    ними. Когда файлы занимают больше max_bytes, удаляются давно не
+    запрошенные; записи с известным file_id при этом остаются, потому что
+    для повторной отправки байты уже не нужны. Горячие записи индекса
+    держатся в памяти, а время обращения к ним пишется на диск пачкой
+    перед вытеснением. Одновременные запросы одного ключа ждут один рендер;
+    отмена одного из них, в том числе первого, рендер не прерывает.
+
+    Args:
+        directory (str): Каталог для файлов и индекса.
+        max_bytes (int): Предел суммарного размера файлов.
+        hot_entries (int): Сколько записей индекса держать в памяти.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_BYTES, hot_entries=HOT_ENTRIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        os.makedirs(directory, exist_ok=True)
+        # Недописанные файлы прошлого запуска больше никому не нужны
+        for path in glob.glob(os.path.join(glob.escape(directory), '*.part.*')):
+            os.remove(path)
+        self._index = ConnectionPool(os.path.join(directory, 'index.db'), size=1, initializer=self._init_index)
+        self._hot = OrderedDict()
+        self._touched = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hot': len(self._hot)
+        }
+
+    @staticmethod
+    def _init_index(conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS renders (
+            key TEXT PRIMARY KEY,
+            file TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            file_id TEXT,
+            last_used REAL NOT NULL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_renders_last_used ON renders(last_used)')
+
+    @staticmethod
+    def _load(conn, key):
+        return conn.execute('SELECT file, file_id FROM renders WHERE key = ?', (key,)).fetchone()
+
+    @staticmethod
+    def _save(conn, key, file, size):
+        conn.execute(
+            '''
+            INSERT INTO renders (key, file, size, last_used) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET file = excluded.file, size = excluded.size, last_used = excluded.last_used
+            ''',
+            (key, file, size, time.time())
+        )
+
+    @staticmethod
+    def _save_file_id(conn, key, file_id):
+        conn.execute('UPDATE renders SET file_id = ? WHERE key = ?', (file_id, key))
+
+    @staticmethod
+    def _forget(conn, key):
+        conn.execute('DELETE FROM renders WHERE key = ?', (key,))
+
+    @staticmethod
+    def _touch(conn, touched):
+        conn.executemany('UPDATE renders SET last_used = ? WHERE key = ?',
+                         [(last_used, key) for key, last_used in touched.items()])
+
+    def _evict(self, conn, touched, keep):
+        """Удаляет самые старые файлы, кроме keep, пока их суммарный размер больше предела."""
+        self._touch(conn, touched)
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+        evicted = []
+        if total > self.max_bytes:
+            rows = conn.execute(
+                'SELECT key, file, size FROM renders WHERE file IS NOT NULL AND key != ? ORDER BY last_used',
+                (keep,)
+            )
+            for key, file, size in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((key, file))
+                total -= size
+            for key, file in evicted:
+                try:
+                    os.remove(os.path.join(self.directory, file))
+                except FileNotFoundError:
+                    pass
+            conn.executemany('DELETE FROM renders WHERE key = ? AND file_id IS NULL', [(key,) for key, _ in evicted])
+            conn.executemany('UPDATE renders SET file = NULL, size = 0 WHERE key = ?', [(key,) for key, _ in evicted])
+        return [key for key, _ in evicted]
+
+    def _remember(self, entry):
+        self._hot[entry.key] = entry
+        self._hot.move_to_end(entry.key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def _usable(self, entry):
+        return entry.file_id is not None or (entry.path is not None and os.path.exists(entry.path))
+
+    async def get(self, key):
+        """Возвращает CachedRender из памяти или индекса либо None."""
+        entry = self._hot.get(key)
+        if entry is None:
+            row = await self._index.run(self._load, key)
+            if row is None:
+                return None
+            file, file_id = row
+            entry = CachedRender(key, os.path.join(self.directory, file) if file else None, file_id)
+
+        if not self._usable(entry):
+            # Файл удалили в обход кэша: запись больше ни на что не указывает
+            self._hot.pop(key, None)
+            self._touched.pop(key, None)
+            await self._index.run(self._forget, key)
+            return None
+
+        self._remember(entry)
+        self._touched[key] = time.time()
+        return entry
+
+    async def _store(self, key, render, suffix):
+        file = f"{key}{suffix}"
+        path = os.path.join(self.directory, file)
+        # Рендерим во временный файл с тем же расширением: по нему выбирается формат
+        part = os.path.join(self.directory, f"{key}.part{suffix}")
+        try:
+            await render(part)
+            os.replace(part, path)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+
+        await self._index.run(self._save, key, file, os.path.getsize(path))
+        touched, self._touched = self._touched, {}
+        for evicted in await self._index.run(self._evict, touched, key):
+            self._hot.pop(evicted, None)
+            logging.info(f"Превью {evicted} вытеснено из кэша")
+
+        entry = CachedRender(key, path, None)
+        self._remember(entry)
+        return entry
+
+    async def get_or_render(self, key, render, suffix='.mp4'):
+        """
+        Возвращает готовое превью или рендерит его один раз на ключ.
+
+        Args:
+            key (str): Ключ, например результат preview_key().
+            render (callable): Корутинная функция, записывающая превью в переданный путь.
+            suffix (str): Расширение файла; по нему выбирается формат.
+
+        Returns:
+            CachedRender: Путь к файлу и file_id, если превью уже отправлялось.
+        """
+        entry = self._hot.get(key)
+        if entry is not None and self._usable(entry):
+            self.hits += 1
+            self._hot.move_to_end(key)
+            self._touched[key] = time.time()
+            return entry
+
+        if key in self._inflight:
+            self.coalesced += 1
+        return await coalesce(self._inflight, key, functools.partial(self._get_or_store, key, render, suffix))
+
+    async def _get_or_store(self, key, render, suffix):
+        entry = await self.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return await self._store(key, render, suffix)
+
+    async def remember_file_id(self, key, file_id):
+        """Запоминает file_id загруженного превью: дальше оно отправляется без байтов."""
+        entry = self._hot.get(key)
+        if entry is not None:
+            self._remember(entry._replace(file_id=file_id))
+        await self._index.run(self._save_file_id, key, file_id)
+
+    async def send(self, bot, chat_id, entry, **kwargs):
+        """
+        Отправляет превью как анимацию и запоминает file_id после первой загрузки.
+
+        Args:
+            bot (aiogram.Bot): Бот.
+            chat_id (int): Чат получателя.
+            entry (CachedRender): Результат get_or_render().
+            **kwargs: Дополнительные аргументы send_animation (caption, reply_markup, ...).
+
+        Returns:
+            aiogram.types.Message: Отправленное сообщение.
+        """
+        if entry.file_id is not None:
+            return await bot.send_animation(chat_id, entry.file_id, **kwargs)
+
+        message = await bot.send_animation(chat_id, InputFile(entry.path), **kwargs)
+        media = message.animation or message.video or message.document
+        if media is not None:
+            await self.remember_file_id(entry.key, media.file_id)
+        return message
+
+    def close(self):
+        if self._touched:
+            touched, self._touched = self._touched, {}
+            with self._index.connection() as conn:
+                self._touch(conn, touched)
+        self._index.close()
+
+
+async def cached_preview(cache, image, size=PREVIEW_SIZE, fps=PREVIEW_FPS, duration=PREVIEW_DURATION,
+                         preset=None, layers=None, suffix='.mp4', farm=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Возвращает превью из кэша, при промахе рендерит его.
+
+    Рендер идет в ферме, если она передана, иначе в потоке по умолчанию.
+
+    Args:
+        cache (RenderCache): Кэш превью.
+        farm (render_farm.RenderFarm, optional): Ферма рендера.
+        priority (int): Приоритет задания фермы.
+        Остальные аргументы - как у render_preview.
+
+    Returns:
+        CachedRender: Путь к файлу и file_id, если превью уже отправлялось.
+    """
+    # Хэширование исходника и пресета читает файлы целиком: не на цикле событий
+    key = await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(preview_key, image, size, fps, duration, preset, layers, suffix)
+    )
+
+    async def render(path):
+        if farm is not None:
+            job = farm.submit(image, path, size, fps, duration, preset, layers, priority)
+            # Отмена рендера (например, при остановке) отменяет и задание фермы
+            await asyncio.wrap_future(job.future)
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(render_preview, image, path, size, fps, duration, preset, layers)
+            )
+
+    return await cache.get_or_render(key, render, suffix)
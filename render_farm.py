@@ -0,0 +1,419 @@
+import functools
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from color_grading import load_preset
+from frame_effects import FrameCompositor, load_image
+from preview_pipeline import PREVIEW_DURATION, PREVIEW_FPS, PREVIEW_SIZE, writer_for
+
+# Приоритеты: меньшее значение обслуживается раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+# Сколько кадров рендерит рабочий процесс за одно задание
+CHUNK_FRAMES = 8
+# Сколько заданий держит в памяти рабочий процесс (исходник, маски, LUT)
+WORKER_STATE_CACHE = 4
+
+# Что нужно рабочему процессу, чтобы нарисовать кадры задания
+RenderSpec = namedtuple('RenderSpec', ['job_id', 'image', 'size', 'fps', 'preset', 'layers'])
+# Исходное изображение, переданное через разделяемую память
+SharedImage = namedtuple('SharedImage', ['name', 'shape'])
+
+
+_worker_states = OrderedDict()
+
+
+def _worker_state(spec):
+    # Подготовка слоев и загрузка LUT дорогие, поэтому делаются один раз на задание
+    state = _worker_states.get(spec.job_id)
+    if state is not None:
+        _worker_states.move_to_end(spec.job_id)
+        return state
+
+    if isinstance(spec.image, SharedImage):
+        segment = shared_memory.SharedMemory(name=spec.image.name)
+        try:
+            image = np.ndarray(spec.image.shape, dtype=np.uint8, buffer=segment.buf)
+            compositor = FrameCompositor(image, spec.layers)
+            del image
+        finally:
+            segment.close()
+    else:
+        compositor = FrameCompositor(load_image(spec.image, spec.size), spec.layers)
+
+    state = _worker_states[spec.job_id] = (compositor, load_preset(spec.preset) if spec.preset else None)
+    while len(_worker_states) > WORKER_STATE_CACHE:
+        _worker_states.popitem(last=False)
+    return state
+
+
+def _render_chunk(spec, start, count, segment_name):
+    """Рисует кадры start..start+count прямо в разделяемую память (выполняется в рабочем процессе)."""
+    compositor, lut = _worker_state(spec)
+    segment = shared_memory.SharedMemory(name=segment_name)
+    try:
+        frames = np.ndarray((count,) + compositor.shape, dtype=np.uint8, buffer=segment.buf)
+        for offset in range(count):
+            frame = frames[offset]
+            compositor.render((start + offset) * 1000 / spec.fps, out=frame)
+            if lut is not None:
+                lut.apply(frame, out=frame)
+        del frame, frames
+    finally:
+        segment.close()
+    return count
+
+
+class RenderJob:
+    """
+    Задание фермы: рендер одного превью.
+
+    Результат - concurrent.futures.Future с путем к файлу; из asyncio его
+    можно ждать через asyncio.wrap_future(job.future). Отмена future
+    отменяет и само задание.
+    """
+
+    def __init__(self, farm, spec, output_path, shape, frame_count, priority, chunk_frames, on_progress):
+        self.spec = spec
+        self.output_path = output_path
+        self.shape = shape
+        self.frame_count = frame_count
+        self.priority = priority
+        self.on_progress = on_progress
+        self.future = Future()
+        self.frames_done = 0
+        self._farm = farm
+        self._chunks = [(start, min(chunk_frames, frame_count - start)) for start in range(0, frame_count, chunk_frames)]
+        self._dispatched = 0
+        self._next_write = 0
+        self._running = {}
+        self._ready = {}
+        self._stopped = False
+        self._written = False
+        self._image_segment = None
+        self._writer_queue = queue.Queue()
+        self.future.add_done_callback(self._on_future_done)
+
+    def _on_future_done(self, future):
+        if future.cancelled():
+            self._farm._events.put(('cancel', self))
+
+    @property
+    def progress(self):
+        return self.frames_done / self.frame_count if self.frame_count else 1.0
+
+    def cancel(self):
+        """Отменяет задание: новые части не рендерятся, недописанный файл удаляется."""
+        return self.future.cancel()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class RenderFarm:
+    """
+    Параллельный рендер превью в пуле процессов.
+
+    Ролик делится на части по chunk_frames кадров; части рендерятся в
+    ProcessPoolExecutor прямо в блоки multiprocessing.shared_memory, так
+    что кадры не сериализуются между процессами. Готовые части
+    записываются в файл строго по порядку в отдельном потоке задания.
+
+    Части раздаются по приоритету: задания с меньшим priority (например,
+    PRIORITY_INTERACTIVE для запросов из бота) получают освободившиеся
+    процессы раньше пакетных, уже запущенные части дорабатывают. Число
+    блоков разделяемой памяти ограничено, поэтому медленная запись
+    притормаживает рендер, а не копит кадры в памяти.
+
+    Args:
+        workers (int, optional): Число процессов; по умолчанию - число ядер.
+        chunk_frames (int): Кадров в одной части.
+        max_buffered_chunks (int, optional): Максимум одновременно выделенных частей.
+    """
+
+    def __init__(self, workers=None, chunk_frames=CHUNK_FRAMES, max_buffered_chunks=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_frames = chunk_frames
+        self.max_buffered_chunks = max_buffered_chunks or 2 * self.workers + 2
+        self._events = queue.Queue()
+        self._heap = []
+        self._active = set()
+        self._buffers = 0
+        self._sequence = itertools.count()
+        self._job_ids = itertools.count(1)
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # fork из процесса с потоками небезопасен, поэтому рабочие процессы
+            # запускаются через forkserver (или spawn, где его нет)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+            self._thread = threading.Thread(target=self._schedule, name='render-farm', daemon=True)
+            self._thread.start()
+
+    def submit(self, image, output_path, size=PREVIEW_SIZE, fps=PREVIEW_FPS, duration=PREVIEW_DURATION,
+               preset=None, layers=None, priority=PRIORITY_BATCH, on_progress=None):
+        """
+        Ставит превью в очередь рендера.
+
+        Args:
+            image (str | numpy.ndarray): Путь к изображению (растягивается до size)
+                или массив RGB uint8 нужного размера.
+            output_path (str): Файл результата; формат по расширению, как в render_preview.
+            size (tuple): (ширина, высота) кадра для изображения из файла.
+            fps (float): Кадров в секунду.
+            duration (float): Длительность в секундах.
+            preset (str, optional): Пресет цветокоррекции.
+            layers (list, optional): Слои эффектов; по умолчанию как во flashFrameAnimate.
+            priority (int): PRIORITY_INTERACTIVE, PRIORITY_BATCH или другое число.
+            on_progress (callable, optional): Вызывается с заданием после записи каждой части.
+
+        Returns:
+            RenderJob: Задание с future, progress и cancel().
+        """
+        if self._stopping:
+            raise RuntimeError('Ферма рендера остановлена')
+        if round(fps * duration) <= 0:
+            raise ValueError('В превью должен быть хотя бы один кадр')
+        writer_for(output_path)
+        self._start()
+
+        job_id = f"{os.getpid()}-{next(self._job_ids)}"
+        image_segment = None
+        if isinstance(image, str):
+            shape = (size[1], size[0], 3)
+            source = image
+        else:
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            shape = image.shape
+            # Исходник копируется в разделяемую память один раз на задание
+            image_segment = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            np.ndarray(shape, dtype=np.uint8, buffer=image_segment.buf)[:] = image
+            source = SharedImage(image_segment.name, shape)
+
+        spec = RenderSpec(job_id, source, tuple(size), fps, preset, layers)
+        job = RenderJob(self, spec, output_path, shape, round(fps * duration), priority, self.chunk_frames, on_progress)
+        job._image_segment = image_segment
+        self._events.put(('submit', job))
+        return job
+
+    def close(self, cancel=False):
+        """
+        Дожидается завершения заданий и останавливает процессы.
+
+        Args:
+            cancel (bool): Отменить незавершенные задания вместо ожидания.
+        """
+        self._stopping = True
+        if self._thread is None:
+            return
+        self._events.put(('stop', cancel))
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    # Все изменения состояния заданий происходят в потоке планировщика
+
+    def _schedule(self):
+        stop_requested = False
+        while not (stop_requested and not self._active):
+            event = self._events.get()
+            try:
+                if event[0] == 'stop':
+                    stop_requested = True
+                    if event[1]:
+                        for job in list(self._active):
+                            self._stop_job(job)
+                else:
+                    getattr(self, f'_on_{event[0]}')(*event[1:])
+                self._dispatch()
+            except Exception as e:
+                logging.exception(f"Ошибка планировщика рендера: {e}")
+
+    def _on_submit(self, job):
+        if job.future.cancelled():
+            self._release_image(job)
+            return
+        self._active.add(job)
+        heapq.heappush(self._heap, (job.priority, next(self._sequence), job))
+        threading.Thread(target=self._write_job, args=(job,), name=f'render-writer-{job.spec.job_id}', daemon=True).start()
+
+    def _dispatch(self):
+        while self._heap and self._buffers < self.max_buffered_chunks:
+            job = self._heap[0][2]
+            if job._stopped or job._dispatched == len(job._chunks):
+                heapq.heappop(self._heap)
+                continue
+
+            index = job._dispatched
+            job._dispatched += 1
+            start, count = job._chunks[index]
+            segment = shared_memory.SharedMemory(create=True, size=count * int(np.prod(job.shape)))
+            self._buffers += 1
+            try:
+                future = self._executor.submit(_render_chunk, job.spec, start, count, segment.name)
+            except Exception as e:
+                # Например, пул сломан упавшим процессом
+                self._release(segment)
+                self._stop_job(job, e)
+                continue
+            job._running[index] = (future, segment)
+            future.add_done_callback(functools.partial(self._chunk_done, job, index))
+
+    def _chunk_done(self, job, index, future):
+        self._events.put(('done', job, index))
+
+    def _on_done(self, job, index):
+        future, segment = job._running.pop(index)
+        if job._stopped or future.cancelled():
+            self._release(segment)
+            self._retire(job)
+            return
+        error = future.exception()
+        if error is not None:
+            self._release(segment)
+            self._stop_job(job, error)
+            self._retire(job)
+            return
+
+        # Части могут прийти не по порядку; в файл они уходят строго по очереди
+        job._ready[index] = segment
+        while job._next_write in job._ready:
+            job._writer_queue.put((job._next_write, job._ready.pop(job._next_write)))
+            job._next_write += 1
+
+    def _on_cancel(self, job):
+        if job in self._active:
+            self._stop_job(job)
+
+    def _on_release(self, segment):
+        self._release(segment)
+
+    def _on_finished(self, job):
+        job._written = True
+        self._retire(job)
+
+    def _retire(self, job):
+        # Задание завершено, когда файл закрыт и ни одна его часть не рендерится
+        if job._written and not job._running and job in self._active:
+            self._active.discard(job)
+            self._release_image(job)
+
+    def _stop_job(self, job, error=None):
+        if job._stopped:
+            return
+        job._stopped = True
+        for future, _ in job._running.values():
+            future.cancel()
+        for segment in job._ready.values():
+            self._release(segment)
+        job._ready.clear()
+        if error is not None:
+            _resolve(job.future, error=error)
+        # Поток записи отпускает оставшиеся части, удаляет недописанный файл и завершается
+        job._writer_queue.put(None)
+
+    def _release(self, segment):
+        segment.close()
+        segment.unlink()
+        self._buffers -= 1
+
+    def _release_image(self, job):
+        if job._image_segment is not None:
+            job._image_segment.close()
+            job._image_segment.unlink()
+            job._image_segment = None
+
+    def _write_job(self, job):
+        """
+        Поток записи задания: пишет готовые части по порядку.
+
+        После ошибки или отмены продолжает отпускать приходящие части, пока
+        планировщик не пришлет None.
+        """
+        height, width = job.shape[:2]
+        writer = None
+        failed = False
+
+        def fail(error):
+            nonlocal failed
+            failed = True
+            logging.error(f"Ошибка записи превью {job.output_path}: {error}")
+            _resolve(job.future, error=error)
+            self._events.put(('cancel', job))
+
+        try:
+            writer = writer_for(job.output_path)(job.output_path, width, height, job.spec.fps, job.frame_count)
+            writer.open()
+        except Exception as e:
+            writer = None
+            fail(e)
+
+        while True:
+            item = job._writer_queue.get()
+            if item is None:
+                break
+            index, segment = item
+            try:
+                if not failed and not job._stopped:
+                    count = job._chunks[index][1]
+                    frames = np.ndarray((count,) + job.shape, dtype=np.uint8, buffer=segment.buf)
+                    for frame in frames:
+                        writer.write_frame(frame)
+                    del frame, frames
+                    job.frames_done += count
+            except Exception as e:
+                fail(e)
+            finally:
+                self._events.put(('release', segment))
+
+            if failed or job._stopped:
+                continue
+            if job.on_progress:
+                job.on_progress(job)
+            if job.frames_done == job.frame_count:
+                try:
+                    writer.finish()
+                    _resolve(job.future, result=job.output_path)
+                except Exception as e:
+                    fail(e)
+                break
+
+        if not job.future.done():
+            job.future.cancel()
+        if job.future.cancelled() or job.future.exception() is not None:
+            if writer is not None and job.frames_done < job.frame_count:
+                try:
+                    writer.finish(aborted=True)
+                except Exception:
+                    pass
+            if os.path.exists(job.output_path):
+                os.remove(job.output_path)
+        self._events.put(('finished', job))
+
+
+def _resolve(future, result=None, error=None):
+    # Пользователь мог отменить future в любой момент: итог ставится, только если он еще не задан
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
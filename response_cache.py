@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from db import ConnectionPool
+
+
+def fingerprint(*parts):
+    """
+    Строит устойчивый ключ кэша по нормализованным частям запроса.
+
+    Строки приводятся к нижнему регистру без пробелов по краям, словари
+    сериализуются с сортировкой ключей, поэтому одинаковые по смыслу
+    запросы дают одинаковый отпечаток.
+    """
+    def normalize(value):
+        if isinstance(value, str):
+            return value.strip().lower()
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    raw = json.dumps(normalize(list(parts)), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+async def coalesce(inflight, key, load):
+    """
+    Выполняет load() одной задачей на ключ и ждет ее результат.
+
+    Вызовы с тем же ключом, пока задача не завершилась, ждут ее же. Задача
+    не принадлежит ни одному из вызывающих: все ждут ее через asyncio.shield,
+    поэтому отмена любого из них, в том числе первого, не отменяет загрузку
+    и не приводит к CancelledError у остальных.
+
+    Args:
+        inflight (dict): Задачи в работе по ключам; словарь принадлежит кэшу.
+        key: Ключ запроса.
+        load (callable): Корутинная функция без аргументов.
+
+    Returns:
+        Результат load().
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load())
+        inflight[key] = task
+        task.add_done_callback(functools.partial(_forget_inflight, inflight, key))
+    return await asyncio.shield(task)
+
+
+def _forget_inflight(inflight, key, task):
+    if inflight.get(key) is task:
+        del inflight[key]
+    # Ожидающих может не остаться; помечаем исключение как полученное
+    if not task.cancelled():
+        task.exception()
+
+
+class ResponseCache:
+    """
+    Кэш ответов внешнего API с TTL, вытеснением LRU и объединением запросов.
+
+    Горячие записи хранятся в памяти; при указании path они дополнительно
+    сохраняются в SQLite и переживают перезапуск бота. Одновременные
+    запросы с одинаковым ключом ждут один общий вызов.
+
+    Args:
+        max_entries (int): Максимум записей в памяти.
+        ttl (float): Время жизни записи в секундах.
+        path (str, optional): Путь к файлу SQLite для хранения на диске.
+    """
+
+    def __init__(self, max_entries=1024, ttl=6 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._store = ConnectionPool(path, size=1) if path else None
+        self._store_ready = False
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'size': len(self._entries)
+        }
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _init_store(conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            expires_at REAL
+        )
+        ''')
+        conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (time.time(),))
+
+    @staticmethod
+    def _load(conn, key):
+        return conn.execute(
+            'SELECT value, expires_at FROM response_cache WHERE key = ? AND expires_at >= ?',
+            (key, time.time())
+        ).fetchone()
+
+    @staticmethod
+    def _save(conn, key, value, expires_at):
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, value, expires_at)
+        )
+
+    async def _ensure_store(self):
+        if not self._store_ready:
+            await self._store.run(self._init_store)
+            self._store_ready = True
+
+    async def get(self, key):
+        """Возвращает значение из памяти или с диска либо None."""
+        value = self._get_memory(key)
+        if value is not None or self._store is None:
+            return value
+
+        await self._ensure_store()
+        row = await self._store.run(self._load, key)
+        if row is None:
+            return None
+
+        value = json.loads(row[0])
+        self._put_memory(key, value, row[1])
+        return value
+
+    async def set(self, key, value):
+        """Сохраняет значение в памяти и, если настроено, на диске."""
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, value, expires_at)
+
+        if self._store is not None:
+            await self._ensure_store()
+            await self._store.run(self._save, key, json.dumps(value, ensure_ascii=False), expires_at)
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        Возвращает значение из кэша или вызывает fetch() один раз на ключ.
+
+        Пустые ответы (None) не кэшируются. Отмена вызывающего не отменяет
+        начатый fetch(): его результат получат остальные ожидающие и кэш.
+
+        Args:
+            key (str): Ключ, например результат fingerprint().
+            fetch (callable): Корутинная функция без аргументов.
+
+        Returns:
+            Значение из кэша или результат fetch().
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if key in self._inflight:
+            self.coalesced += 1
+        return await coalesce(self._inflight, key, functools.partial(self._fetch, key, fetch))
+
+    async def _fetch(self, key, fetch):
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = await fetch()
+        if value is not None:
+            await self.set(key, value)
+        return value
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
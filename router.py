@@ -0,0 +1,129 @@
+import re
+
+
+def _trie_pattern(phrases):
+    """
+    Строит регулярное выражение по префиксному дереву фраз.
+
+    Общие префиксы фраз объединяются, поэтому в каждой позиции текста
+    автомат проверяет один символ, а не перебирает все фразы: стоимость
+    поиска почти не растет с числом фраз. Если одна фраза - начало другой,
+    достаточно более короткой.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        if '' in node:
+            return ''
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
+class IntentRouter:
+    """
+    Определяет намерение текстового сообщения одним скомпилированным автоматом.
+
+    Фразы всех намерений собираются в одно регулярное выражение по
+    префиксному дереву, а найденная фраза переводится в намерение поиском в
+    словаре, поэтому сообщение просматривается один раз независимо от числа
+    намерений. Фразы задаются основами слов: поиск идет по подстроке, и
+    «фильм» находит «фильмы», «фильмец» и «мультфильм», а «аниме» -
+    «аниме-сериал». При нескольких совпадениях выигрывает первое в тексте.
+
+    Args:
+        default (callable, optional): Обработчик сообщений без распознанного намерения.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+        self._intents = {}
+        self._handlers = {}
+        self._pattern = None
+
+    def add(self, intent, phrases, handler):
+        """
+        Регистрирует намерение.
+
+        Args:
+            intent (str): Имя намерения.
+            phrases (iterable): Основы слов в нижнем регистре.
+            handler (callable): Корутина, принимающая сообщение.
+        """
+        for phrase in phrases:
+            self._intents[phrase] = intent
+        self._handlers[intent] = handler
+        self._pattern = None
+
+    def match(self, text):
+        """Возвращает имя намерения для текста или None."""
+        if not text or not self._intents:
+            return None
+        if self._pattern is None:
+            self._pattern = re.compile(_trie_pattern(self._intents))
+        found = self._pattern.search(text.lower())
+        return self._intents.get(found.group()) if found else None
+
+    def resolve(self, message):
+        """Возвращает обработчик, который получит сообщение, или None."""
+        return self._handlers.get(self.match(message.text), self.default)
+
+    async def dispatch(self, message):
+        handler = self.resolve(message)
+        if handler is not None:
+            await handler(message)
+
+
+class CallbackRouter:
+    """
+    Диспетчеризация callback-запросов по префиксу callback_data.
+
+    Данные кнопок имеют вид «префикс_параметры»; обработчик находится по
+    префиксу поиском в словаре, а состояние диалога проверяется один раз,
+    вместо того чтобы перебирать фильтры всех обработчиков подряд.
+    Запросы с неизвестным префиксом или в неподходящем состоянии
+    игнорируются, как и без роутера.
+
+    Args:
+        separator (str): Разделитель префикса и параметров.
+    """
+
+    def __init__(self, separator='_'):
+        self.separator = separator
+        self._routes = {}
+
+    def add(self, prefix, handler, state='*'):
+        """
+        Регистрирует обработчик префикса.
+
+        Args:
+            prefix (str): Префикс callback_data до разделителя.
+            handler (callable): Корутина, принимающая (callback_query, state).
+            state (State | str | None): Состояние, в котором принимается кнопка; '*' - любое.
+        """
+        self._routes[prefix] = (handler, getattr(state, 'state', state))
+
+    def _route(self, data):
+        # Как и прежний фильтр startswith('genre_'), без разделителя префикс не совпадает
+        prefix, separator, _ = (data or '').partition(self.separator)
+        return self._routes.get(prefix) if separator else None
+
+    def resolve(self, callback_query):
+        """Возвращает обработчик префикса запроса или None; состояние не проверяется."""
+        route = self._route(callback_query.data)
+        return route[0] if route is not None else None
+
+    async def dispatch(self, callback_query, state):
+        route = self._route(callback_query.data)
+        if route is None:
+            return
+        handler, required_state = route
+        if required_state != '*' and await state.get_state() != required_state:
+            return
+        await handler(callback_query, state)
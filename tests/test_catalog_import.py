@@ -0,0 +1,53 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import catalog_import
+import db
+
+
+class CatalogImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bot.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_dump(self, name, records):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            for record in records:
+                handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def test_tags_follow_imported_rows(self):
+        dump = self.write_dump('first.jsonl', [
+            {'title': 'Акира', 'year': 1988, 'genre': ['Sci-Fi', 'action'], 'depth': 'deep',
+             'features': 'action', 'type': 'аниме', 'rating': 9.5},
+        ])
+        for defer_indexes in (True, False):
+            catalog_import.import_files(self.path, [dump], defer_indexes=defer_indexes)
+
+        conn = sqlite3.connect(self.path)
+        try:
+            content_id, rating = conn.execute("SELECT id, rating FROM content WHERE title = 'Акира'").fetchone()
+            self.assertEqual(
+                sorted(conn.execute('SELECT genre, depth, rating FROM content_genre WHERE content_id = ?', (content_id,))),
+                [('action', 'deep', rating), ('sci-fi', 'deep', rating)]
+            )
+            self.assertEqual(db._find_content_ids(conn, {'genre': 'sci-fi', 'depth': 'deep'}, [], 1), [content_id])
+
+            # Повторный импорт с другими тегами заменяет теги той же записи
+            dump = self.write_dump('second.jsonl', [{'title': 'Akira', 'year': 1988, 'genre': 'drama'}])
+            catalog_import.import_files(self.path, [dump])
+            self.assertEqual(
+                [row[0] for row in conn.execute('SELECT genre FROM content_genre WHERE content_id = ?', (content_id,))],
+                ['drama']
+            )
+            self.assertEqual(db._find_content_ids(conn, {'genre': 'sci-fi', 'depth': 'deep'}, [], 1), [1])
+        finally:
+            conn.close()
@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import catalog_import
+import db
+from catalog_index import CatalogIndex
+from ranking import RankingEngine
+from title_index import TitleIndex
+
+
+class CatalogIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        db.init_db(self.conn)
+        self.index = CatalogIndex()
+        self.index.load(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_top_k_by_rating(self):
+        preferences = {'genre': 'action', 'depth': 'deep', 'features': 'action'}
+        self.assertEqual(self.index.top_k(preferences, 5), [3, 13])
+        self.assertEqual(self.index.top_k(preferences, 5, exclude_ids={3}), [13])
+
+    def test_update_rating_reorders(self):
+        preferences = {'genre': 'action', 'depth': 'deep', 'features': 'action'}
+        self.index.update_rating(13, 9.5)
+        self.assertEqual(self.index.top_k(preferences, 5), [13, 3])
+
+    def test_matching_ids(self):
+        self.assertEqual(self.index.matching_ids({'genre': 'action', 'depth': 'deep'}), {3, 13})
+        self.assertEqual(self.index.matching_ids({'genre': 'western'}), set())
+        self.assertIsNone(self.index.matching_ids({}))
+
+    def test_repeated_tags_indexed_once(self):
+        self.index.add(100, 'action,Action', 'deep', 'action, action', 'movie', 9.9)
+        self.assertEqual(self.index.top_k({'genre': 'action'}, 3), [100, 3, 13])
+        self.index.remove(100)
+        self.assertEqual(self.index.top_k({'genre': 'action'}, 2), [3, 13])
+
+    def test_matches_tag_tables(self):
+        for preferences in ({'genre': 'action', 'depth': 'deep'}, {'features': 'mystery'}, {'genre': 'western'}, {}):
+            self.assertEqual(self.index.top_k(preferences, 20), db._find_content_ids(self.conn, preferences, [], 20))
+
+
+class CatalogIndexReloadTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bot.db')
+        self.pool = db.ConnectionPool(self.path)
+        with self.pool.connection() as conn:
+            db.init_db(conn)
+        patcher = mock.patch.object(db, 'pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    async def test_background_load(self):
+        index = CatalogIndex()
+        index.load_in_background()
+        self.assertFalse(index.loaded)
+        await index._loading
+        self.assertEqual(len(index), 15)
+
+    def import_dump(self, records):
+        path = os.path.join(self.directory.name, 'dump.jsonl')
+        with open(path, 'w', encoding='utf-8') as handle:
+            for record in records:
+                handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        catalog_import.import_files(self.path, [path])
+
+    async def test_reloads_after_import_from_other_process(self):
+        index = CatalogIndex(refresh_interval=0)
+        await index.ensure_loaded()
+        self.assertEqual(len(index), 15)
+
+        # Импорт каталога идет отдельным процессом со своим соединением
+        self.import_dump([{'title': 'Акира', 'year': 1988, 'genre': 'sci-fi,action', 'depth': 'deep',
+                           'features': 'action', 'type': 'anime', 'rating': 9.5}])
+
+        await index.ensure_loaded()
+        self.assertEqual(len(index), 16)
+        self.assertEqual(index.top_k({'genre': 'sci-fi', 'depth': 'deep'}, 1), [16])
+
+    async def test_reloads_after_changed_duplicate(self):
+        index = CatalogIndex(refresh_interval=0)
+        ranker = RankingEngine(refresh_interval=0)
+        titles = TitleIndex(refresh_interval=0)
+        for loader in (index, ranker, titles):
+            await loader.ensure_loaded()
+        self.assertEqual(index.top_k({'genre': 'western'}, 1), [])
+
+        # Дубль существующей записи меняет только теги: число строк и MAX(id) прежние
+        self.import_dump([{'title': 'Начало', 'year': 2010, 'genre': 'western', 'type': 'movie'}])
+        for loader in (index, ranker, titles):
+            await loader.ensure_loaded()
+
+        self.assertEqual(len(index), 15)
+        self.assertEqual(index.top_k({'genre': 'western'}, 1), [1])
+        self.assertEqual(index.top_k({'genre': 'sci-fi', 'depth': 'deep'}, 3), [6, 8])
+        self.assertEqual(ranker.top_k({'genre': 'western'}, k=1), [1])
+        self.assertEqual(titles.resolve('Начало'), 1)
+
+    async def test_background_load(self):
+        index = CatalogIndex()
+        index.load_in_background()
+        self.assertFalse(index.loaded)
+        await index._loading
+        self.assertEqual(len(index), 15)
@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from color_grading import Lut, parse_lut_image
+
+
+def identity_table(size=5):
+    axis = np.linspace(0, 255, size, dtype=np.float32)
+    b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+    return np.stack([r, g, b], axis=-1)
+
+
+def tetrahedral(table, frame):
+    """Эталон в float64: сортировка долей и обход вершин тетраэдра по одному пикселю."""
+    size = table.shape[0]
+    result = np.empty(frame.shape, dtype=np.float64)
+    for y, x in np.ndindex(frame.shape[:2]):
+        position = frame[y, x].astype(np.float64) * (size - 1) / 255
+        lower = np.minimum(position.astype(int), size - 2)
+        fraction = position - lower
+        corner = lower.copy()
+        value = (1 - fraction.max()) * table[corner[2], corner[1], corner[0]]
+        order = np.argsort(-fraction, kind='stable')
+        for step, axis in enumerate(order):
+            corner[axis] += 1
+            following = fraction[order[step + 1]] if step < 2 else 0
+            value = value + (fraction[axis] - following) * table[corner[2], corner[1], corner[0]]
+        result[y, x] = value
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+
+
+class LutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = np.random.default_rng(0).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+
+    def test_identity_and_inverted(self):
+        for size in (5, 33):
+            table = identity_table(size)
+            np.testing.assert_array_equal(Lut(table).apply(self.frame), self.frame)
+            np.testing.assert_array_equal(Lut(255 - table).apply(self.frame), 255 - self.frame)
+
+    def test_image_layouts(self):
+        table = identity_table(4).astype(np.uint8)
+        layouts = {
+            'hald': table.reshape(8, 8, 3),
+            'horizontal strip': table.transpose(1, 0, 2, 3).reshape(4, 16, 3),
+            'vertical strip': table.reshape(16, 4, 3),
+        }
+        for name, pixels in layouts.items():
+            with self.subTest(name):
+                np.testing.assert_array_equal(parse_lut_image(pixels), table)
+        with self.assertRaises(ValueError):
+            parse_lut_image(np.zeros((5, 7, 3), dtype=np.uint8))
+
+    def test_matches_float_reference(self):
+        # Нелинейная таблица: результат зависит от выбора тетраэдра
+        table = identity_table(9)
+        table = np.stack([np.sqrt(table[..., 0] / 255) * 255, table[..., 2], table[..., 1] * 0.7 + 40], axis=-1)
+        frame = self.frame[:12, :20]
+        difference = np.abs(Lut(table).apply(frame).astype(int) - tetrahedral(table.astype(np.float64), frame))
+        # Фиксированная точка расходится с float64 не больше чем на единицу
+        self.assertLessEqual(difference.max(), 1)
+        self.assertLess(np.count_nonzero(difference), difference.size * 0.05)
+
+    def test_grey_axis_and_extremes(self):
+        # Равные доли по всем осям и крайние значения 0 и 255
+        grey = np.repeat(np.arange(256, dtype=np.uint8), 3).reshape(16, 16, 3)
+        table = 255 - identity_table(17)
+        np.testing.assert_array_equal(Lut(table).apply(grey), 255 - grey)
+
+    def test_apply_in_place(self):
+        expected = 255 - self.frame
+        frame = self.frame.copy()
+        Lut(255 - identity_table()).apply(frame, out=frame)
+        np.testing.assert_array_equal(frame, expected)
+
+    def test_frame_larger_than_band(self):
+        frame = np.random.default_rng(1).integers(0, 256, (97, 101, 3), dtype=np.uint8)
+        np.testing.assert_array_equal(Lut(255 - identity_table(33)).apply(frame), 255 - frame)
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+
+
+class InitDbTest(unittest.TestCase):
+
+    def test_fresh_database(self):
+        conn = sqlite3.connect(':memory:')
+        db.init_db(conn)
+
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], db.SCHEMA_VERSION)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM content').fetchone()[0], 15)
+        self.assertEqual(
+            sorted(conn.execute('SELECT genre, depth, rating FROM content_genre WHERE content_id = 1')),
+            [('sci-fi', 'deep', 8.8), ('thriller', 'deep', 8.8)]
+        )
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM content_feature').fetchone()[0], 30)
+        conn.close()
+
+    def test_duplicates_from_old_schema_get_unique_keys(self):
+        # База до появления dedup_key: один тайтл записан дважды
+        conn = sqlite3.connect(':memory:')
+        conn.execute('''
+            CREATE TABLE content (
+                id INTEGER PRIMARY KEY, title TEXT, genre TEXT, depth TEXT, features TEXT, type TEXT,
+                description TEXT, rating REAL DEFAULT 0, likes INTEGER DEFAULT 0,
+                dislikes INTEGER DEFAULT 0, year INTEGER
+            )
+        ''')
+        conn.executemany(
+            'INSERT INTO content (id, title, genre, year, rating) VALUES (?, ?, ?, ?, ?)',
+            [(100, 'Акира', 'sci-fi', 1988, 9.0), (101, 'АКИРА', 'action', 1988, 8.0), (102, 'Акира', 'anime', 1988, 7.0)]
+        )
+
+        with self.assertLogs(level='WARNING'):
+            db.init_db(conn)
+
+        keys = dict(conn.execute('SELECT id, dedup_key FROM content WHERE id >= 100'))
+        self.assertEqual(keys, {100: 'akira|1988', 101: 'akira|1988#101', 102: 'akira|1988#102'})
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('idx_content_dedup_key', indexes)
+        conn.close()
+
+    def test_duplicate_keys_written_without_index(self):
+        conn = sqlite3.connect(':memory:')
+        db.init_db(conn)
+        conn.execute('DROP INDEX idx_content_dedup_key')
+        conn.execute("UPDATE content SET dedup_key = 'nachalo|2010' WHERE id IN (1, 6)")
+        conn.execute('PRAGMA user_version = 0')
+
+        with self.assertLogs(level='WARNING'):
+            db.init_db(conn)
+
+        keys = dict(conn.execute('SELECT id, dedup_key FROM content WHERE id IN (1, 6)'))
+        self.assertEqual(keys, {1: 'nachalo|2010', 6: 'nachalo|2010#6'})
+        conn.close()
+
+
+class TagLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        db.init_db(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_exact_tags_in_rating_order(self):
+        self.conn.execute(
+            "INSERT INTO content (id, title, genre, depth, features, rating) "
+            "VALUES (100, 'Тест', 'action-comedy', 'deep', 'action', 9.9)"
+        )
+        db.sync_content_tags(self.conn, [100])
+
+        preferences = {'genre': 'action', 'depth': 'deep', 'features': 'action'}
+        self.assertEqual(db._find_content_ids(self.conn, preferences, [], 10), [3, 13])
+        self.assertEqual(db._find_content_ids(self.conn, preferences, [3], 10), [13])
+        self.assertEqual(db._find_content_ids(self.conn, {'genre': 'action-comedy'}, [], 10), [100])
+        self.assertEqual(db._find_content_ids(self.conn, {'genre': 'western'}, [], 10), [])
+
+    def test_lookup_reads_only_the_covering_index(self):
+        query = (
+            "SELECT content_id FROM content_genre WHERE genre = 'action' AND depth = 'deep' "
+            "ORDER BY rating DESC, content_genre.content_id LIMIT 10"
+        )
+        plan = ' '.join(row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + query))
+        self.assertIn('COVERING INDEX idx_content_genre_lookup', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_feedback_moves_tag_rating(self):
+        self.conn.execute('INSERT INTO users (user_id) VALUES (1)')
+        ratings = db._apply_feedback_batch(self.conn, [(1, 13, 'like', '2026-01-01T00:00:00')])
+
+        tag_ratings = {row[0] for row in self.conn.execute('SELECT rating FROM content_genre WHERE content_id = 13')}
+        self.assertEqual(tag_ratings, {ratings[13]})
+
+    def test_recompute_moves_tag_rating(self):
+        self.conn.execute('UPDATE content SET likes = 100 WHERE id = 5')
+        db.recompute_ratings(self.conn)
+
+        rating = self.conn.execute('SELECT rating FROM content WHERE id = 5').fetchone()[0]
+        tag_ratings = {row[0] for row in self.conn.execute('SELECT rating FROM content_genre WHERE content_id = 5')}
+        self.assertEqual(tag_ratings, {rating})
+        self.assertEqual(db._find_content_ids(self.conn, {'genre': 'action', 'depth': 'light'}, [], 1), [5])
+
+
+class RatingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        db.init_db(self.conn)
+        self.conn.execute('INSERT INTO users (user_id) VALUES (1), (2)')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_single_vote_stays_near_editorial_rating(self):
+        ratings = db._apply_feedback_batch(self.conn, [(1, 1, 'dislike', '2026-01-01T00:00:00')])
+
+        self.assertAlmostEqual(ratings[1], 20 * 8.8 / 21)
+        self.assertEqual(self.conn.execute('SELECT editorial_rating FROM content WHERE id = 1').fetchone()[0], 8.8)
+
+    def test_recount_matches_incremental_updates(self):
+        events = [
+            (1, 1, 'like', '2026-01-01T00:00:00'),
+            (2, 1, 'dislike', '2026-01-01T00:00:01'),
+            (1, 2, 'like', '2026-01-01T00:00:02'),
+        ]
+        incremental = db._apply_feedback_batch(self.conn, events)
+        self.conn.execute('UPDATE content SET likes = 7, dislikes = 3, rating = 0')
+
+        db.recompute_ratings(self.conn, recount=True)
+
+        rows = dict(self.conn.execute('SELECT id, rating FROM content WHERE id IN (1, 2, 3)'))
+        self.assertAlmostEqual(rows[1], incremental[1])
+        self.assertAlmostEqual(rows[2], incremental[2])
+        self.assertEqual(rows[3], 9.0)
+
+
+class OrphanRowsTest(unittest.TestCase):
+
+    def test_history_of_deleted_content_migrates(self):
+        # Старая база: блоб истории ссылается на удаленный тайтл 999
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bot.db')
+            conn = sqlite3.connect(path)
+            conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, preferences TEXT, history TEXT, '
+                         'interaction_count INTEGER DEFAULT 0, last_interaction TIMESTAMP)')
+            history = [{'content_id': 999, 'feedback': 'like', 'timestamp': '2024-01-01T00:00:00'}]
+            conn.execute('INSERT INTO users (user_id, history) VALUES (1, ?)', (json.dumps(history),))
+            conn.commit()
+            conn.close()
+
+            pool = db.ConnectionPool(path, size=1)
+            try:
+                with pool.connection() as conn:
+                    db.init_db(conn)
+                    rows = conn.execute('SELECT user_id, content_id FROM user_interactions').fetchall()
+                    blobs = conn.execute('SELECT history FROM users').fetchall()
+                    # Отзыв о тайтле, которого нет, пропускается, а не валит всю пачку
+                    ratings = db._apply_feedback_batch(conn, [
+                        (1, 999, 'like', '2026-01-01T00:00:00'), (1, 3, 'like', '2026-01-01T00:00:01'),
+                    ])
+            finally:
+                pool.close()
+
+        self.assertEqual(rows, [(1, 999)])
+        self.assertEqual(blobs, [(None,)])
+        self.assertEqual(list(ratings), [3])
@@ -0,0 +1,205 @@
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+
+from deepseek_client import CircuitBreaker, DeepSeekClient
+
+ANSWER = {'choices': [{'message': {'content': 'Начало'}}]}
+
+
+class DeepSeekStubTestCase(AioHTTPTestCase):
+    """
+    DeepSeekClient против локального HTTP-сервера с заданными ответами.
+
+    Каждый тест кладет в self.responses пары (статус, заголовки) или числа -
+    задержку ответа в секундах; когда сценарий кончается, сервер отвечает 200.
+    """
+
+    async def get_application(self):
+        self.responses = []
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.release = None
+        app = web.Application()
+        app.router.add_post('/chat/completions', self._handle)
+        return app
+
+    async def _handle(self, request):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await request.json()
+            step = self.responses.pop(0) if self.responses else (200, {})
+            if self.release is not None:
+                await self.release.wait()
+            if not isinstance(step, tuple):
+                await asyncio.sleep(step)
+                step = (200, {})
+            status, headers = step
+            if status == 200:
+                return web.json_response(ANSWER)
+            return web.Response(status=status, text='stub error', headers=headers)
+        finally:
+            self.in_flight -= 1
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault('backoff_base', 0.01)
+        client = DeepSeekClient(str(self.server.make_url('/chat/completions')), 'test-key', **kwargs)
+        self.addAsyncCleanup(client.close)
+        return client
+
+    async def test_success(self):
+        client = self.make_client()
+
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+        self.assertEqual(self.calls, 1)
+
+    async def test_429_waits_for_retry_after(self):
+        # Без Retry-After задержка со случайным разбросом достигала бы секунд
+        client = self.make_client(backoff_base=5.0, backoff_max=10.0)
+        self.responses = [(429, {'Retry-After': '0.2'})]
+
+        started = time.monotonic()
+        result = await client.chat({'messages': []})
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(result, ANSWER)
+        self.assertEqual(self.calls, 2)
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 2.0)
+
+    async def test_retry_after_is_capped_by_backoff_max(self):
+        client = self.make_client(backoff_max=0.1)
+        self.responses = [(503, {'Retry-After': '3600'})]
+
+        started = time.monotonic()
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+        self.assertLess(time.monotonic() - started, 2.0)
+
+    async def test_5xx_retried_until_success(self):
+        client = self.make_client(max_retries=2)
+        self.responses = [(500, {}), (502, {})]
+
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    async def test_5xx_exhausts_retries(self):
+        client = self.make_client(max_retries=2, breaker=CircuitBreaker(failure_threshold=5))
+        self.responses = [(503, {})] * 3
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(client.breaker._failures, 1)
+
+    async def test_client_error_not_retried(self):
+        client = self.make_client(max_retries=2)
+        self.responses = [(400, {})]
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(self.calls, 1)
+        # Сервис ответил, значит он доступен: выключатель не размыкается
+        self.assertEqual(client.breaker._failures, 0)
+
+    async def test_timeout_retried(self):
+        client = self.make_client(timeout=0.2, max_retries=1)
+        self.responses = [1.0]
+
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+        self.assertEqual(self.calls, 2)
+
+    async def test_timeout_exhausts_retries(self):
+        client = self.make_client(timeout=0.2, max_retries=1)
+        self.responses = [1.0, 1.0]
+
+        started = time.monotonic()
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(self.calls, 2)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    async def test_concurrency_cap(self):
+        client = self.make_client(max_concurrency=2)
+        self.release = asyncio.Event()
+
+        calls = [asyncio.create_task(client.chat({'messages': [i]})) for i in range(6)]
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if self.in_flight == 2:
+                break
+        # Остальные вызовы ждут семафор и до сервера не доходят
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.in_flight, 2)
+
+        self.release.set()
+        results = await asyncio.gather(*calls)
+        self.assertEqual(results, [ANSWER] * 6)
+        self.assertEqual(self.calls, 6)
+        self.assertEqual(self.max_in_flight, 2)
+
+    async def test_breaker_open_half_open_closed(self):
+        client = self.make_client(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+        self.responses = [(500, {}), (500, {})]
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(client.breaker.state, 'closed')
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(client.breaker.state, 'open')
+
+        # Разомкнутая цепь отклоняет вызовы, не обращаясь к серверу
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(self.calls, 2)
+
+        await asyncio.sleep(0.25)
+        self.assertEqual(client.breaker.state, 'half-open')
+
+        # В полуоткрытом состоянии проходит только один пробный вызов
+        self.release = asyncio.Event()
+        probe = asyncio.create_task(client.chat({'messages': []}))
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if self.in_flight:
+                break
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(self.calls, 3)
+
+        self.release.set()
+        self.assertEqual(await probe, ANSWER)
+        self.assertEqual(client.breaker.state, 'closed')
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+
+    async def test_failed_probe_reopens(self):
+        client = self.make_client(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+        self.responses = [(500, {}), (500, {})]
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        await asyncio.sleep(0.25)
+        self.assertEqual(client.breaker.state, 'half-open')
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        self.assertEqual(client.breaker.state, 'open')
+        self.assertEqual(self.calls, 2)
+
+    async def test_cancelled_probe_releases_slot(self):
+        client = self.make_client(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+        self.responses = [(500, {})]
+
+        self.assertIsNone(await client.chat({'messages': []}))
+        await asyncio.sleep(0.25)
+
+        self.release = asyncio.Event()
+        probe = asyncio.create_task(client.chat({'messages': []}))
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if self.in_flight:
+                break
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+
+        self.release.set()
+        self.assertEqual(await client.chat({'messages': []}), ANSWER)
+        self.assertEqual(client.breaker.state, 'closed')
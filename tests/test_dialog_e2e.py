@@ -0,0 +1,208 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot import base
+
+import db
+import main
+from catalog_index import catalog
+from ranking import ranker
+from render import DEPTH_KEYBOARD, FEATURE_KEYBOARD, GENRE_KEYBOARD, MORE_KEYBOARD
+from title_index import titles
+
+USER_ID = 42
+
+
+def message_update(update_id, text):
+    message = {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Тест'},
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return types.Update(update_id=update_id, message=message)
+
+
+def callback_update(update_id, data):
+    return types.Update(update_id=update_id, callback_query={
+        'id': str(update_id), 'chat_instance': 'test', 'data': data,
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Тест'},
+        'message': {'message_id': 1, 'date': 0, 'text': '...', 'chat': {'id': USER_ID, 'type': 'private'}},
+    })
+
+
+def feedback_buttons(markup):
+    return [button['callback_data'] for row in json.loads(markup)['inline_keyboard'] for button in row]
+
+
+class FilmDialogTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Диалог от /start до кнопок отзыва через Dispatcher.process_update.
+
+    Bot.request подменяется и записывает вызовы Bot API вместо отправки
+    в Telegram; база, хранилище FSM и индексы каталога - настоящие.
+    """
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, 'bot.db')
+        self.requests = []
+
+        async def fake_request(bot, method, data=None, files=None, **kwargs):
+            self.requests.append((method, data or {}))
+            if method in ('sendMessage', 'editMessageText'):
+                return {'message_id': 1, 'date': 0, 'text': data.get('text', ''),
+                        'chat': {'id': USER_ID, 'type': 'private'}}
+            return True
+
+        patcher = mock.patch.object(base.BaseBot, 'request', fake_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Индексы - синглтоны процесса: строим их по базе этого теста
+        catalog._loaded = False
+        titles._loaded = False
+        ranker._loaded = False
+        self.dp = main.create_app({
+            'api_token': '123:test',
+            'db_path': self.db_path,
+            'deepseek_cache_path': None,
+            'fsm_storage': 'sqlite',
+            'fsm_storage_options': {'path': os.path.join(self.directory.name, 'fsm.db')},
+            'feedback_durability': 'sync',
+            'feedback_dead_letter_path': os.path.join(self.directory.name, 'dead_letter.jsonl'),
+            'metrics_port': None,
+        })
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+
+    async def asyncTearDown(self):
+        await main.on_shutdown(self.dp)
+        self.directory.cleanup()
+
+    async def send(self, update):
+        self.requests.clear()
+        await self.dp.process_update(update)
+        return self.requests
+
+    async def rate(self, content_id, feedback):
+        await db.pool.run(db._save_user_preferences, USER_ID, {})
+        await db.pool.run(db._apply_feedback_batch, [(USER_ID, content_id, feedback, '2026-01-01T00:00:00')])
+
+    async def state(self):
+        return await self.dp.storage.get_state(chat=USER_ID, user=USER_ID)
+
+    async def data(self):
+        return await self.dp.storage.get_data(chat=USER_ID, user=USER_ID)
+
+    async def test_dialog_to_feedback(self):
+        requests = await self.send(message_update(1, '/start'))
+        self.assertEqual([method for method, _ in requests], ['sendMessage'])
+        self.assertIn('Привет', requests[0][1]['text'])
+
+        requests = await self.send(message_update(2, 'Хочу посмотреть фильм'))
+        self.assertEqual(requests[0][1]['reply_markup'], GENRE_KEYBOARD)
+        self.assertEqual(await self.state(), 'FilmDialog:waiting_for_genre')
+
+        requests = await self.send(callback_update(3, 'genre_action'))
+        self.assertEqual([method for method, _ in requests], ['answerCallbackQuery', 'editMessageText'])
+        self.assertEqual(requests[1][1]['reply_markup'], DEPTH_KEYBOARD)
+        self.assertEqual(await self.state(), 'FilmDialog:waiting_for_depth')
+
+        requests = await self.send(callback_update(4, 'depth_deep'))
+        self.assertEqual(requests[1][1]['reply_markup'], FEATURE_KEYBOARD)
+        self.assertEqual(await self.state(), 'FilmDialog:waiting_for_features')
+
+        # Боевик, глубокое, экшен: «Атака титанов» и «Тёмный рыцарь» с рейтингом 9.0
+        requests = await self.send(callback_update(5, 'feature_action'))
+        method, card = requests[-1]
+        self.assertEqual(method, 'editMessageText')
+        self.assertEqual(card['parse_mode'], 'HTML')
+        self.assertIn('<b>Атака титанов</b> (Аниме)', card['text'])
+        self.assertIn('Жанр: Action, Fantasy', card['text'])
+        self.assertEqual(feedback_buttons(card['reply_markup']), ['feedback_like_3', 'feedback_dislike_3'])
+
+        self.assertEqual(await self.state(), 'FilmDialog:waiting_for_feedback')
+        data = await self.data()
+        self.assertEqual(data['current_content_id'], 3)
+        self.assertEqual(data['cursor']['ids'], [13])
+        self.assertEqual((data['genre'], data['depth'], data['features']), ('action', 'deep', 'action'))
+
+        requests = await self.send(callback_update(6, 'feedback_like_3'))
+        self.assertEqual(requests[-1][1]['reply_markup'], MORE_KEYBOARD)
+        self.assertIn('Спасибо за отзыв', requests[-1][1]['text'])
+        # Диалог завершен, но предпочтения и курсор остались для «Еще рекомендации»
+        self.assertIsNone(await self.state())
+        self.assertEqual((await self.data())['cursor']['ids'], [13])
+
+        requests = await self.send(callback_update(7, 'more_recommendations'))
+        card = requests[-1][1]
+        self.assertIn('<b>Тёмный рыцарь</b> (Фильм)', card['text'])
+        self.assertEqual(feedback_buttons(card['reply_markup']), ['feedback_like_13', 'feedback_dislike_13'])
+        self.assertEqual((await self.data())['cursor']['ids'], [])
+
+        # В режиме sync отзыв уже записан на диск
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT user_id, content_id, interaction_type FROM user_interactions').fetchall()
+            likes = conn.execute('SELECT likes FROM content WHERE id = 3').fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(rows, [(USER_ID, 3, 'like')])
+        self.assertEqual(likes, 1)
+
+    async def test_seen_title_not_recommended_again(self):
+        await self.rate(3, 'dislike')
+        await self.send(message_update(1, 'Хочу посмотреть фильм'))
+        await self.send(callback_update(2, 'genre_action'))
+        await self.send(callback_update(3, 'depth_deep'))
+
+        requests = await self.send(callback_update(4, 'feature_action'))
+        self.assertIn('<b>Тёмный рыцарь</b> (Фильм)', requests[-1][1]['text'])
+        self.assertEqual((await self.data())['current_content_id'], 13)
+
+    async def test_expired_cursor_reranks(self):
+        await self.dp.storage.set_data(chat=USER_ID, user=USER_ID, data={
+            'genre': 'action', 'depth': 'deep', 'features': 'action',
+            'cursor': {'ids': [3], 'expires_at': 0},
+        })
+        await self.rate(3, 'like')
+
+        requests = await self.send(callback_update(1, 'more_recommendations'))
+        self.assertIn('<b>Тёмный рыцарь</b> (Фильм)', requests[-1][1]['text'])
+
+    async def test_llm_call_without_metrics(self):
+        # Без metrics_port модуль метрик не подключается, и запрос к LLM его не трогает
+        self.assertIsNone(main.metrics)
+        with mock.patch.object(main.deepseek, 'chat', side_effect=RuntimeError('offline')), \
+                self.assertLogs(level='ERROR'):
+            self.assertIsNone(await main.query_deepseek_api('Посоветуй фильм'))
+
+    async def test_unknown_message(self):
+        requests = await self.send(message_update(1, 'Привет, как дела?'))
+        self.assertEqual([method for method, _ in requests], ['sendMessage'])
+        self.assertIn('Не совсем понимаю', requests[0][1]['text'])
+        self.assertIsNone(await self.state())
+
+    async def test_history_user_keeps_dialog_filters(self):
+        async def choose(update_id, genre, depth, feature):
+            await self.send(message_update(update_id, 'Посоветуй аниме'))
+            await self.send(callback_update(update_id + 1, f'genre_{genre}'))
+            await self.send(callback_update(update_id + 2, f'depth_{depth}'))
+            return (await self.send(callback_update(update_id + 3, f'feature_{feature}')))[-1][1]
+
+        card = await choose(1, 'action', 'deep', 'action')
+        self.assertIn('Атака титанов', card['text'])
+        await self.send(callback_update(5, 'feedback_like_3'))
+
+        # У пользователя есть оценка, но выбор в диалоге по-прежнему ограничивает выдачу:
+        # комедия, лёгкое, юмор - только «Ванпанчмен» и «Шрек»
+        card = await choose(10, 'comedy', 'light', 'humor')
+        self.assertIn('<b>Ванпанчмен</b>', card['text'])
+        self.assertEqual((await self.data())['cursor']['ids'], [9])
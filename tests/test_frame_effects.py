@@ -0,0 +1,113 @@
+import math
+import unittest
+
+import numpy as np
+
+from frame_effects import (BlinkLayer, CloudLayer, FlickerLayer, FrameCompositor, PulseLayer, SwayLayer,
+                           WaterLayer, default_layers)
+
+HEIGHT, WIDTH = 72, 128
+# Моргание (t % 2000 < 200), облако у левого края, у правого края и обычные моменты
+TIMES = [0, 100, 1234, 5000, 6410, 12345.5]
+
+
+def over(frame, mask, color, alpha):
+    """source-over в float64: frame * (1 - a) + color * a, где a = mask * alpha."""
+    weight = (mask * alpha)[..., None]
+    return frame * (1 - weight) + np.asarray(color, dtype=np.float64) * weight
+
+
+# Эталоны слоев по формулам flashFrameAnimate (video_processor.py), по целому кадру в float64
+def blink(frame, t):
+    if t % 2000 < 200:
+        for x, y, w, h in ((0.3, 0.3, 0.15, 0.1), (0.55, 0.3, 0.15, 0.1)):
+            rows = slice(round(HEIGHT * y), round(HEIGHT * (y + h)))
+            columns = slice(round(WIDTH * x), round(WIDTH * (x + w)))
+            frame[rows, columns] *= 0.8
+    return frame
+
+
+def water(frame, t):
+    top = max(round(HEIGHT * 0.8 + math.sin(t / 500) * 5), 0)
+    mask = (np.arange(HEIGHT) >= top)[:, None] * np.ones(WIDTH)
+    return over(frame, mask, (0, 100, 255), 0.1)
+
+
+def cloud(frame, t):
+    y, x = np.mgrid[:HEIGHT, :WIDTH].astype(np.float64)
+    center_x = math.floor((t / 50) % WIDTH)
+    mask = ((x - center_x) / 30) ** 2 + ((y - round(HEIGHT * 0.2)) / 15) ** 2 <= 1
+    return over(frame, mask, (255, 255, 255), 0.5)
+
+
+def sway(frame, t):
+    y, x = np.mgrid[:HEIGHT, :WIDTH].astype(np.float64)
+    angle = math.sin(t / 1000) * 0.1
+    dx, dy = x + 0.5 - WIDTH * 0.8, y + 0.5 - HEIGHT * 0.7
+    u = dx * math.cos(angle) + dy * math.sin(angle)
+    v = dy * math.cos(angle) - dx * math.sin(angle)
+    return over(frame, np.maximum(np.abs(u), np.abs(v)) <= 10, (34, 139, 34), 0.6)
+
+
+def flicker(frame, t):
+    y, x = np.mgrid[:HEIGHT, :WIDTH].astype(np.float64)
+    distance = np.hypot(x - round(WIDTH * 0.5), y - round(HEIGHT * 0.5))
+    profile = np.clip(1 - distance / 50, 0, None)
+    return over(frame, profile, (255, 255, 200), 0.5 * (0.5 + 0.5 * math.sin(t / 300)))
+
+
+def pulse(frame, t):
+    return over(frame, np.ones((HEIGHT, WIDTH)), (255, 0, 0), 0.1 * (0.5 + 0.5 * math.sin(t / 1000)))
+
+
+REFERENCES = [(BlinkLayer, blink), (WaterLayer, water), (CloudLayer, cloud),
+              (SwayLayer, sway), (FlickerLayer, flicker), (PulseLayer, pulse)]
+
+
+class FrameCompositorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.image = np.random.default_rng(0).integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+    def assert_matches(self, rendered, expected):
+        # Вычисления в float32 расходятся с float64 в последних разрядах: значения у
+        # границы округления (x.5) могут уйти в любую сторону, остальные совпадают точно
+        self.assertTrue(np.all((expected > -1e-6) & (expected < 255 + 1e-6)))
+        rounded = np.floor(expected + 0.5)
+        near_half = np.abs(expected - np.floor(expected) - 0.5) < 1e-3
+        difference = rendered.astype(np.float64) - rounded
+        self.assertLessEqual(np.abs(difference).max(), 1)
+        np.testing.assert_array_equal(difference[~near_half], 0)
+
+    def test_each_layer_matches_reference(self):
+        for layer_type, reference in REFERENCES:
+            compositor = FrameCompositor(self.image, [layer_type()])
+            for t in TIMES:
+                with self.subTest(layer=layer_type.__name__, t=t):
+                    expected = reference(self.image.astype(np.float64), t)
+                    self.assert_matches(compositor.render(t), expected)
+
+    def test_composite_matches_reference(self):
+        compositor = FrameCompositor(self.image)
+        self.assertEqual([type(layer) for layer in compositor.layers], [layer for layer, _ in REFERENCES])
+        for t in TIMES:
+            expected = self.image.astype(np.float64)
+            for _, reference in REFERENCES:
+                expected = reference(expected, t)
+            with self.subTest(t=t):
+                self.assert_matches(compositor.render(t), expected)
+
+    def test_rounds_to_nearest(self):
+        # t = 0: альфа 0.6 * 0.5 = 0.3, кадр = значение * 0.7 + (100, 0, 0) * 0.3 = (30.7, 177.8, 2.1);
+        # отбрасывание дробной части дало бы (30, 177, 2)
+        image = np.array([[[1, 254, 3], [0, 255, 128]]], dtype=np.uint8)
+        compositor = FrameCompositor(image, [PulseLayer(color=(100, 0, 0), alpha=0.6)])
+        np.testing.assert_array_equal(compositor.render(0)[0, 0], [31, 178, 2])
+        # Без слоев кадр совпадает с исходным, крайние значения не переполняются
+        np.testing.assert_array_equal(FrameCompositor(image, []).render(0), image)
+
+    def test_out_buffer_and_defaults(self):
+        compositor = FrameCompositor(self.image)
+        out = np.empty_like(self.image)
+        self.assertIs(compositor.render(1234, out=out), out)
+        np.testing.assert_array_equal(out, FrameCompositor(self.image, default_layers()).render(1234))
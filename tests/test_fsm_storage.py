@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from fsm_storage import SQLiteStorage
+
+
+class SQLiteStorageTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'fsm.db')
+        self.storage = SQLiteStorage(self.path, flush_interval=0.01, max_retry_delay=0.05)
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.directory.cleanup()
+
+    def stored(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT chat, user, state FROM fsm_storage').fetchall()
+        finally:
+            conn.close()
+
+    async def test_state_survives_restart(self):
+        await self.storage.set_state(chat=1, user=1, state='FilmDialog:waiting_for_genre')
+        await self.storage.update_data(chat=1, user=1, data={'genre': 'action'})
+        await self.storage.close()
+
+        self.storage = SQLiteStorage(self.path)
+        self.assertEqual(await self.storage.get_state(chat=1, user=1), 'FilmDialog:waiting_for_genre')
+        self.assertEqual(await self.storage.get_data(chat=1, user=1), {'genre': 'action'})
+
+    async def test_background_flush_retries_after_error(self):
+        run = self.storage._pool.run
+        failures = []
+
+        async def flaky_run(func, *args):
+            if func == SQLiteStorage._write and len(failures) < 3:
+                failures.append(func)
+                raise sqlite3.OperationalError('database is locked')
+            return await run(func, *args)
+
+        self.storage._pool.run = flaky_run
+        await self.storage.set_state(chat=1, user=1, state='FilmDialog:waiting_for_depth')
+
+        with self.assertLogs(level='ERROR') as logs:
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if len(failures) == 3 and self.storage._retry_delay is None:
+                    break
+
+        # Никто не вызывал flush явно: запись повторилась сама после трех ошибок
+        self.assertEqual(len(failures), 3)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(self.stored(), [('1', '1', 'FilmDialog:waiting_for_depth')])
+        self.assertIsNone(self.storage._retry_delay)
+
+    async def test_retry_delay_backs_off(self):
+        async def failing_run(func, *args):
+            if func == SQLiteStorage._write:
+                raise sqlite3.OperationalError('disk I/O error')
+            return await run(func, *args)
+
+        run = self.storage._pool.run
+        self.storage._pool.run = failing_run
+        await self.storage.set_state(chat=1, user=1, state='FilmDialog:waiting_for_genre')
+
+        delays = []
+        with self.assertLogs(level='ERROR'):
+            for _ in range(30):
+                await asyncio.sleep(0.01)
+                if self.storage._retry_delay is not None and self.storage._retry_delay not in delays:
+                    delays.append(self.storage._retry_delay)
+
+        self.assertEqual(delays[:3], [0.02, 0.04, 0.05])
+        self.assertIn(('1', '1'), self.storage._dirty)
+
+        self.storage._pool.run = run
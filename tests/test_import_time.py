@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Импорт main в чистом процессе: время и модули, которые он успел загрузить
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+# Бюджет с запасом на медленные CI: сейчас импорт занимает около 0.5 с
+IMPORT_BUDGET = 2.0
+HEAVY_MODULES = ('numpy', 'scipy', 'ranking', 'metrics')
+
+
+class ImportTimeTest(unittest.TestCase):
+    """Импорт main не открывает базу, не создает файлов и не тянет numpy и метрики."""
+
+    def test_import_has_no_side_effects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'PYTHONPATH': ROOT}
+            result = subprocess.run([sys.executable, '-c', PROBE], cwd=directory, env=env,
+                                    capture_output=True, text=True, timeout=60)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            created = os.listdir(directory)
+
+        self.assertEqual(created, [])
+        probe = json.loads(result.stdout.splitlines()[-1])
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, probe['modules'])
+        self.assertLess(probe['elapsed'], IMPORT_BUDGET)
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import db
+import item_neighbors
+
+
+class ItemNeighborsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pool = db.ConnectionPool(os.path.join(self.directory.name, 'bot.db'), size=1)
+        with self.pool.connection() as conn:
+            db.init_db(conn)
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    def rate(self, *interactions):
+        with self.pool.connection() as conn:
+            conn.executemany(
+                'INSERT INTO user_interactions (user_id, content_id, interaction_type) VALUES (?, ?, ?)',
+                interactions
+            )
+
+    def snapshot(self):
+        with self.pool.connection() as conn:
+            return {
+                'pairs': conn.execute('SELECT item_a, item_b, dot, overlap FROM item_pair_stats '
+                                      'WHERE dot != 0 OR overlap != 0 ORDER BY 1, 2').fetchall(),
+                'norms': conn.execute('SELECT content_id, norm2 FROM item_norms WHERE norm2 != 0 ORDER BY 1').fetchall(),
+                'neighbors': [
+                    (content_id, rank, neighbor_id, round(score, 9)) for content_id, rank, neighbor_id, score
+                    in conn.execute('SELECT content_id, rank, neighbor_id, score FROM content_neighbors ORDER BY 1, 2')
+                ],
+            }
+
+    def full_snapshot(self):
+        item_neighbors.run(self.pool, full=True, min_overlap=1)
+        return self.snapshot()
+
+    def seed(self):
+        self.rate(
+            (1, 10, 'like'), (1, 20, 'like'), (1, 30, 'dislike'),
+            (2, 10, 'like'), (2, 20, 'like'), (2, 40, 'like'),
+            (3, 20, 'dislike'), (3, 30, 'like'), (3, 40, 'like'),
+            (4, 10, 'like'), (4, 30, 'skip'),
+        )
+        item_neighbors.run(self.pool, chunk_size=2, min_overlap=1)
+
+    def test_incremental_matches_full(self):
+        self.seed()
+        # Новый пользователь, новая оценка и смена мнения об уже оцененном тайтле
+        self.rate(
+            (5, 10, 'like'), (5, 40, 'dislike'),
+            (1, 40, 'like'),
+            (2, 20, 'dislike'), (3, 30, 'dislike'),
+        )
+        self.assertGreater(item_neighbors.run(self.pool, chunk_size=2, min_overlap=1), 0)
+        incremental = self.snapshot()
+
+        self.assertTrue(incremental['neighbors'])
+        self.assertEqual(incremental, self.full_snapshot())
+
+    def test_repeated_vote_changes_nothing(self):
+        self.seed()
+        before = self.snapshot()
+        # Повтор той же оценки не меняет последнюю оценку пользователя
+        self.rate((1, 10, 'like'))
+        item_neighbors.run(self.pool, min_overlap=1)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_resume_does_not_double_count(self):
+        self.seed()
+        self.rate((1, 40, 'like'), (2, 30, 'like'), (3, 10, 'dislike'), (5, 20, 'like'), (5, 40, 'like'))
+
+        # Вторая порция падает: первая уже зафиксирована вместе с last_user_id
+        apply_users = item_neighbors._apply_users
+        calls = []
+
+        def failing(conn, user_ids, start_id, end_id):
+            calls.append(list(user_ids))
+            if len(calls) == 2:
+                raise RuntimeError('прервано')
+            apply_users(conn, user_ids, start_id, end_id)
+
+        with mock.patch.object(item_neighbors, '_apply_users', side_effect=failing):
+            with self.assertRaises(RuntimeError):
+                item_neighbors.run(self.pool, chunk_size=2, min_overlap=1)
+        self.assertEqual(calls, [[1, 2], [3, 5]])
+
+        with self.pool.connection() as conn:
+            last_id, target_id, last_user_id = item_neighbors._load_watermark(conn)
+        self.assertEqual((last_id, target_id, last_user_id), (11, 16, 2))
+
+        # Оценка после target_id не входит в продолженный проход, но учитывается следующим
+        self.rate((2, 30, 'dislike'))
+        with mock.patch.object(item_neighbors, '_apply_users', side_effect=apply_users) as resumed:
+            item_neighbors.run(self.pool, chunk_size=2, min_overlap=1)
+        self.assertEqual([call.args[1] for call in resumed.call_args_list], [[3, 5]])
+
+        item_neighbors.run(self.pool, chunk_size=2, min_overlap=1)
+        with self.pool.connection() as conn:
+            self.assertEqual(item_neighbors._load_watermark(conn), (17, None, None))
+        self.assertEqual(self.snapshot(), self.full_snapshot())
@@ -0,0 +1,97 @@
+import unittest
+
+from aiogram.dispatcher.handler import current_handler
+
+from metrics import HANDLER_SECONDS, Counter, Histogram, MetricsMiddleware, Registry
+
+
+class ExpositionTest(unittest.TestCase):
+
+    def test_label_values_escaped(self):
+        counter = Counter('fsm_transitions_total', 'Переходы.', ('state',))
+        counter.inc('a"b\\c\nd')
+        counter.inc('a"b\\c\nd', amount=2)
+        self.assertEqual(list(counter.samples()), ['fsm_transitions_total{state="a\\"b\\\\c\\nd"} 3'])
+
+    def test_counter_without_labels(self):
+        counter = Counter('updates_total', 'Апдейты.')
+        counter.inc()
+        self.assertEqual(list(counter.samples()), ['updates_total 1'])
+
+    def test_histogram_buckets_cumulative(self):
+        histogram = Histogram('sql_duration_seconds', 'SQL.', ('statement',), buckets=(0.125, 0.0078125, 1.0))
+        # Значение на границе попадает в корзину этой границы (le - «меньше или равно»)
+        for value in (0.00390625, 0.0078125, 0.0625, 0.5, 7.0):
+            histogram.observe(value, 'select')
+
+        self.assertEqual(list(histogram.samples()), [
+            'sql_duration_seconds_bucket{statement="select",le="0.0078125"} 2',
+            'sql_duration_seconds_bucket{statement="select",le="0.125"} 3',
+            'sql_duration_seconds_bucket{statement="select",le="1.0"} 4',
+            'sql_duration_seconds_bucket{statement="select",le="+Inf"} 5',
+            'sql_duration_seconds_sum{statement="select"} 7.57421875',
+            'sql_duration_seconds_count{statement="select"} 5',
+        ])
+
+    def test_bound_series_shares_values(self):
+        histogram = Histogram('llm_request_duration_seconds', 'LLM.', ('model',), buckets=(1.0,))
+        series = histogram.labels('deepseek-chat')
+        series.observe(0.5)
+        histogram.observe(2.0, 'deepseek-chat')
+        self.assertIs(histogram.labels('deepseek-chat'), series)
+
+        counter = Counter('llm_requests_total', 'LLM.', ('model', 'outcome'))
+        counter.labels('deepseek-chat', 'ok').inc()
+        counter.inc('deepseek-chat', 'ok')
+
+        samples = list(histogram.samples()) + list(counter.samples())
+        self.assertIn('llm_request_duration_seconds_bucket{model="deepseek-chat",le="+Inf"} 2', samples)
+        self.assertIn('llm_request_duration_seconds_count{model="deepseek-chat"} 2', samples)
+        self.assertIn('llm_requests_total{model="deepseek-chat",outcome="ok"} 2', samples)
+
+    def test_registry_render(self):
+        class Cache:
+            hits, misses = 3, 1
+
+        registry = Registry()
+        registry.counter('llm_requests_total', 'Запросы к LLM.', ('outcome',)).inc('ok')
+        registry.histogram('handler_duration_seconds', 'Обработка.', buckets=(1.0,))
+        registry.register_cache('cards', Cache())
+
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP llm_requests_total Запросы к LLM.',
+            '# TYPE llm_requests_total counter',
+            'llm_requests_total{outcome="ok"} 1',
+            '# HELP handler_duration_seconds Обработка.',
+            '# TYPE handler_duration_seconds histogram',
+            '# HELP cache_requests_total Обращения к кэшам по результату.',
+            '# TYPE cache_requests_total counter',
+            'cache_requests_total{cache="cards",result="hit"} 3',
+            'cache_requests_total{cache="cards",result="miss"} 1',
+        ]) + '\n')
+
+
+class MiddlewareTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_times_handled_message(self):
+        async def start_dialog(message):
+            pass
+
+        series = HANDLER_SECONDS.labels('message', 'start_dialog')
+        before = sum(series.counts)
+        middleware = MetricsMiddleware()
+        message, data = object(), {}
+
+        token = current_handler.set(start_dialog)
+        try:
+            # Действия апдейта целиком middleware пропускает
+            await middleware.trigger('pre_process_update', (message, data))
+            self.assertEqual(data, {})
+            await middleware.trigger('pre_process_message', (message, data))
+            await middleware.trigger('process_message', (message, data))
+            await middleware.trigger('post_process_message', (message, [], data))
+        finally:
+            current_handler.reset(token)
+
+        self.assertEqual(data['metrics_handler'], 'start_dialog')
+        self.assertEqual(sum(series.counts), before + 1)
@@ -0,0 +1,132 @@
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import preview_pipeline
+from frame_effects import FrameCompositor, PulseLayer, WaterLayer
+from preview_pipeline import FFmpegWriter, FrameWriter, render_frames, render_preview
+
+# Вместо ffmpeg: сначала много пишет в stderr, потом читает кадры из stdin в файл
+FAKE_FFMPEG = '''#!{python}
+import os, sys
+sys.stderr.write('x' * (1 << 20))
+sys.stderr.flush()
+data = sys.stdin.buffer.read()
+with open(sys.argv[-1], 'wb') as handle:
+    handle.write(data)
+if os.environ.get('FAKE_FFMPEG_FAIL'):
+    sys.stderr.write('encoder failed')
+    sys.exit(1)
+'''
+
+
+def sample_image(height=24, width=32):
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+class RenderFramesTest(unittest.TestCase):
+
+    def test_ring_buffers_reused(self):
+        compositor = FrameCompositor(sample_image(), [WaterLayer(), PulseLayer()])
+        reference = FrameCompositor(sample_image(), [WaterLayer(), PulseLayer()])
+        buffers = []
+        for index, frame in enumerate(render_frames(compositor, fps=10, duration=1.0, ring_size=3)):
+            buffers.append(id(frame))
+            np.testing.assert_array_equal(frame, reference.render(index * 100))
+
+        self.assertEqual(len(buffers), 10)
+        self.assertEqual(len(set(buffers)), 3)
+        self.assertEqual(buffers[:3] * 3 + buffers[:1], buffers)
+
+    def test_slow_writer_sees_every_frame_intact(self):
+        # Пока поток пишет медленно, генератор не должен перезаписать еще не записанный буфер
+        class Recorder(FrameWriter):
+            def open(self):
+                self.frames = []
+
+            def write_frame(self, frame):
+                time.sleep(0.005)
+                self.frames.append(frame.copy())
+
+        compositor = FrameCompositor(sample_image(), [WaterLayer(), PulseLayer()])
+        reference = FrameCompositor(sample_image(), [WaterLayer(), PulseLayer()])
+        with Recorder('unused', 32, 24, fps=10, frame_count=10, ring_size=3) as writer:
+            for frame in render_frames(compositor, fps=10, duration=1.0, ring_size=3):
+                writer.write(frame)
+
+        self.assertEqual(len(writer.frames), 10)
+        for index, frame in enumerate(writer.frames):
+            np.testing.assert_array_equal(frame, reference.render(index * 100))
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_apng_frames(self):
+        # Необязательная зависимость: Pillow читает APNG
+        from PIL import Image
+
+        path = os.path.join(self.directory.name, 'preview.png')
+        image = sample_image(24, 33)
+        render_preview(image, path, size=(33, 24), fps=10, duration=0.7, layers=[WaterLayer(), PulseLayer()])
+
+        reference = FrameCompositor(image, [WaterLayer(), PulseLayer()])
+        with Image.open(path) as preview:
+            self.assertEqual(preview.size, (33, 24))
+            self.assertEqual(preview.n_frames, 7)
+            for index in range(7):
+                preview.seek(index)
+                np.testing.assert_array_equal(np.asarray(preview.convert('RGB')), reference.render(index * 100))
+
+    def fake_ffmpeg(self):
+        path = os.path.join(self.directory.name, 'ffmpeg')
+        with open(path, 'w') as handle:
+            handle.write(FAKE_FFMPEG.format(python=sys.executable))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def write_frames(self, frames):
+        path = os.path.join(self.directory.name, 'preview.mp4')
+        errors = []
+
+        def write():
+            try:
+                with FFmpegWriter(path, 160, 120, fps=10, frame_count=len(frames)) as writer:
+                    for frame in frames:
+                        writer.write(frame)
+            except Exception as e:
+                errors.append(e)
+
+        # Запись в отдельном потоке: при взаимной блокировке тест падает, а не зависает
+        with mock.patch.object(preview_pipeline, 'FFMPEG_BINARY', self.fake_ffmpeg()):
+            thread = threading.Thread(target=write, daemon=True)
+            thread.start()
+            thread.join(timeout=30)
+        self.assertFalse(thread.is_alive(), 'запись зависла на заполненном канале stderr')
+        return path, errors
+
+    def test_ffmpeg_stderr_does_not_block_stdin(self):
+        frames = [np.full((120, 160, 3), index, dtype=np.uint8) for index in range(8)]
+        path, errors = self.write_frames(frames)
+
+        self.assertEqual(errors, [])
+        with open(path, 'rb') as handle:
+            self.assertEqual(handle.read(), b''.join(frame.tobytes() for frame in frames))
+
+    def test_ffmpeg_failure_reports_stderr(self):
+        with mock.patch.dict(os.environ, {'FAKE_FFMPEG_FAIL': '1'}):
+            _, errors = self.write_frames([np.zeros((120, 160, 3), dtype=np.uint8)])
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], RuntimeError)
+        self.assertIn('encoder failed', str(errors[0]))
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import db
+from ranking import RankingEngine
+
+
+class RankingEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        db.init_db(self.conn)
+        self.engine = RankingEngine()
+        self.engine.load(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_preferences_rank_matching_titles_first(self):
+        top = self.engine.top_k({'genre': 'action', 'depth': 'deep', 'features': 'action'}, k=2)
+        self.assertEqual(sorted(top), [3, 13])
+
+    def test_history_and_exclusions(self):
+        feedback = [(12, 'like'), (2, 'dislike')]
+        top = self.engine.top_k({}, feedback, k=5, exclude_ids={12})
+
+        self.assertNotIn(12, top)
+        self.assertNotIn(2, top[:3])
+
+    def test_rating_update_is_deferred_until_ranking(self):
+        preferences = {'genre': 'action', 'depth': 'deep', 'features': 'action'}
+        self.assertEqual(self.engine.top_k(preferences, k=1), [3])
+
+        self.engine.update_rating(13, 9.9)
+        # Вектор рейтингов не трогается до следующего ранжирования
+        self.assertAlmostEqual(float(self.engine._ratings[self.engine._rows[13]]), 9.0, places=5)
+        self.assertEqual(self.engine.top_k(preferences, k=1), [13])
+        self.assertEqual(self.engine._stale_ratings, {})
+
+    def test_unknown_content_rating_ignored(self):
+        self.engine.update_rating(9999, 10.0)
+        self.assertEqual(len(self.engine.top_k({}, k=3)), 3)
+
+    def test_neighbor_boost(self):
+        # Без предпочтений и истории порядок задает рейтинг, а близость к понравившемуся - сильнее
+        self.assertNotEqual(self.engine.top_k({}, k=1), [9])
+        self.assertEqual(self.engine.top_k({}, k=1, boosts={9: 1.0, 9999: 1.0}), [9])
+
+    def test_candidates_are_hard_filters(self):
+        # История тянет к космическим аниме, но ранжируются только переданные кандидаты
+        feedback = [(12, 'like'), (6, 'like')]
+        top = self.engine.top_k({}, feedback, k=3, candidates={5, 9})
+        self.assertEqual(sorted(top), [5, 9])
+        self.assertEqual(set(self.engine.top_k({}, feedback, k=10, candidates={5, 9, 12}, exclude_ids={12})), {5, 9})
+
+    def test_empty_candidates(self):
+        self.assertEqual(self.engine.top_k({'genre': 'action'}, [(3, 'like')], k=3, candidates=set()), [])
+
+
+class RankingEngineReloadTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bot.db')
+        self.pool = db.ConnectionPool(self.path)
+        with self.pool.connection() as conn:
+            db.init_db(conn)
+        patcher = mock.patch.object(db, 'pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    async def test_build_does_not_touch_installed_matrix(self):
+        engine = RankingEngine(refresh_interval=0)
+        await engine.ensure_loaded()
+        matrix, ids = engine._matrix, engine._ids
+
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "INSERT INTO content (title, genre, depth, features, type, rating, dedup_key) "
+            "VALUES ('Акира', 'sci-fi,action', 'deep', 'action', 'anime', 9.5, 'akira|1988')"
+        )
+        db.bump_catalog_version(conn)
+        conn.commit()
+        conn.close()
+
+        # Пока новая матрица строится в потоке пула, top_k работает по старой целиком
+        index = await self.pool.run(engine._build_if_changed, engine._stamp)
+        self.assertIs(engine._matrix, matrix)
+        self.assertIs(engine._ids, ids)
+        self.assertEqual(index[2].shape[0], len(index[3]))
+
+        await engine.ensure_loaded()
+        self.assertEqual(len(engine), 16)
+        self.assertEqual(engine._matrix.shape[0], len(engine._ratings))
+        self.assertEqual(engine.top_k({'genre': 'sci-fi', 'depth': 'deep', 'type': 'anime'}, k=1), [16])
@@ -0,0 +1,45 @@
+import unittest
+
+from db import Recommendation
+from render import CardCache, format_card
+
+REC = Recommendation(1, 'Тёмный рыцарь', 'action,crime', 'deep', 'action,drama', 'movie')
+
+
+class FormatCardTest(unittest.TestCase):
+
+    def test_fields_are_escaped(self):
+        rec = Recommendation(7, 'Tom & Jerry <3', 'comedy,<i>', 'light & fun', 'a<b', 'anime')
+        text, _ = format_card(rec)
+
+        self.assertIn('<b>Tom &amp; Jerry &lt;3</b> (Аниме)', text)
+        self.assertIn('Жанр: Comedy, &lt;i&gt;', text)
+        self.assertIn('Особенности: A&lt;b', text)
+        self.assertIn('Глубина: Light &amp; fun', text)
+        self.assertNotIn('<i>', text)
+
+
+class CardCacheTest(unittest.TestCase):
+
+    def test_repeated_render_is_cached(self):
+        cache = CardCache()
+        first = cache.render(REC)
+        self.assertIs(cache.render(REC), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_edited_record_is_rendered_again(self):
+        cache = CardCache()
+        cache.render(REC)
+
+        # Импорт поправил название: запись с тем же id дает новую карточку
+        text, _ = cache.render(REC._replace(title='Тёмный рыцарь (2008)'))
+        self.assertIn('Тёмный рыцарь (2008)', text)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru_eviction(self):
+        cache = CardCache(max_entries=2)
+        for content_id in range(3):
+            cache.render(REC._replace(id=content_id))
+        self.assertEqual(len(cache), 2)
+        cache.render(REC._replace(id=0))
+        self.assertEqual(cache.misses, 4)
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from render_cache import RenderCache, preset_digest
+
+
+class PresetDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.list_path = os.path.join(self.directory.name, 'luts')
+        with open(self.list_path, 'w', encoding='utf-8') as handle:
+            handle.write('retro.png\n')
+
+    def write_preset(self, data):
+        with open(os.path.join(self.directory.name, 'retro.png'), 'wb') as handle:
+            handle.write(data)
+
+    def test_replaced_preset_changes_digest(self):
+        self.write_preset(b'first version')
+        first = preset_digest('retro', self.list_path)
+        self.assertEqual(preset_digest('retro', self.list_path), first)
+
+        # Пресет заменили под тем же именем: старые превью не должны находиться
+        self.write_preset(b'second, regraded version')
+        self.assertNotEqual(preset_digest('retro', self.list_path), first)
+
+    def test_without_preset_file(self):
+        self.assertEqual(preset_digest(None, self.list_path), '')
+        self.assertEqual(preset_digest('missing', self.list_path), '')
+
+
+class RenderCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = RenderCache(self.directory.name)
+        self.renders = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def asyncTearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    async def render(self, path):
+        self.renders.append(path)
+        await self.release.wait()
+        with open(path, 'wb') as handle:
+            handle.write(b'preview')
+
+    async def test_second_request_is_hit(self):
+        entry = await self.cache.get_or_render('key', self.render)
+        self.assertTrue(os.path.exists(entry.path))
+        self.assertEqual(await self.cache.get_or_render('key', self.render), entry)
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    async def test_owner_cancel_does_not_fail_waiters(self):
+        self.release.clear()
+        owner = asyncio.create_task(self.cache.get_or_render('key', self.render))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(self.cache.get_or_render('key', self.render))
+        await asyncio.sleep(0.01)
+
+        owner.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        entry = await waiter
+        self.assertTrue(owner.cancelled())
+        self.assertTrue(os.path.exists(entry.path))
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.cache.stats()['coalesced'], 1)
+        self.assertEqual(self.cache._inflight, {})
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from frame_effects import Layer, PulseLayer
+from render_farm import PRIORITY_BATCH, PRIORITY_INTERACTIVE, RenderFarm
+
+SHM_DIR = '/dev/shm'
+TIMEOUT = 120
+
+
+class FailingLayer(Layer):
+    """Падает на кадре с моментом времени fail_at: исключением или завершением рабочего процесса."""
+
+    def __init__(self, fail_at, crash=False):
+        self.fail_at = fail_at
+        self.crash = crash
+
+    def apply(self, frame, t):
+        if t >= self.fail_at:
+            if self.crash:
+                os._exit(1)
+            raise RuntimeError('слой упал')
+
+
+def shared_segments():
+    return {name for name in os.listdir(SHM_DIR) if name.startswith('psm_')}
+
+
+class RenderFarmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.image = np.random.default_rng(0).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        self.segments = shared_segments() if os.path.isdir(SHM_DIR) else None
+
+    def output(self, name):
+        return os.path.join(self.directory.name, f'{name}.png')
+
+    def assert_segments_released(self, farm):
+        self.assertEqual(farm._buffers, 0)
+        if self.segments is not None:
+            self.assertEqual(shared_segments() - self.segments, set())
+
+    def test_interactive_job_overtakes_batch(self):
+        farm = RenderFarm(workers=1, chunk_frames=1, max_buffered_chunks=2)
+        try:
+            batch = farm.submit(self.image, self.output('batch'), fps=10, duration=2.0,
+                                layers=[PulseLayer()], priority=PRIORITY_BATCH)
+            batch_done_at_finish = []
+
+            def on_progress(job):
+                if job.frames_done == job.frame_count:
+                    batch_done_at_finish.append(batch.frames_done)
+
+            interactive = farm.submit(self.image, self.output('interactive'), fps=10, duration=0.3,
+                                      layers=[PulseLayer()], priority=PRIORITY_INTERACTIVE, on_progress=on_progress)
+            self.assertEqual(interactive.result(TIMEOUT), self.output('interactive'))
+            self.assertEqual(batch.result(TIMEOUT), self.output('batch'))
+        finally:
+            farm.close()
+
+        # Пакетное задание успело отдать процессу только уже выделенные части
+        self.assertLessEqual(batch_done_at_finish[0], 2)
+        self.assertTrue(os.path.exists(self.output('batch')))
+        self.assert_segments_released(farm)
+
+    def test_cancel_stops_job_and_removes_file(self):
+        farm = RenderFarm(workers=1, chunk_frames=1, max_buffered_chunks=2)
+        try:
+            job = farm.submit(self.image, self.output('cancelled'), fps=10, duration=20.0,
+                              layers=[PulseLayer()], on_progress=lambda job: job.cancel())
+            with self.assertRaises(CancelledError):
+                job.result(TIMEOUT)
+
+            # Ферма продолжает работать после отмены
+            other = farm.submit(self.image, self.output('other'), fps=10, duration=0.2, layers=[PulseLayer()])
+            self.assertEqual(other.result(TIMEOUT), self.output('other'))
+        finally:
+            farm.close()
+
+        self.assertLess(job.frames_done, job.frame_count)
+        self.assertFalse(os.path.exists(self.output('cancelled')))
+        self.assert_segments_released(farm)
+
+    def test_layer_error_fails_job_and_releases_memory(self):
+        farm = RenderFarm(workers=1, chunk_frames=2)
+        try:
+            job = farm.submit(self.image, self.output('failed'), fps=10, duration=1.0, layers=[FailingLayer(300)])
+            self.assertIsInstance(job.future.exception(TIMEOUT), RuntimeError)
+        finally:
+            farm.close()
+
+        self.assertFalse(os.path.exists(self.output('failed')))
+        self.assert_segments_released(farm)
+
+    def test_worker_crash_fails_job_and_releases_memory(self):
+        farm = RenderFarm(workers=1, chunk_frames=2)
+        try:
+            job = farm.submit(self.image, self.output('crashed'), fps=10, duration=1.0,
+                              layers=[FailingLayer(300, crash=True)])
+            self.assertIsInstance(job.future.exception(TIMEOUT), BrokenProcessPool)
+        finally:
+            farm.close()
+
+        self.assertFalse(os.path.exists(self.output('crashed')))
+        self.assert_segments_released(farm)
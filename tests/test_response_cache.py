@@ -0,0 +1,107 @@
+import asyncio
+import unittest
+
+from response_cache import ResponseCache, coalesce
+
+
+class CoalesceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_share_one_load(self):
+        inflight = {}
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        results = await asyncio.gather(*(coalesce(inflight, 'key', load) for _ in range(5)))
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(inflight, {})
+
+    async def test_owner_cancellation_does_not_fail_waiters(self):
+        inflight = {}
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return 'value'
+
+        owner = asyncio.create_task(coalesce(inflight, 'key', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(coalesce(inflight, 'key', load))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await owner
+        release.set()
+
+        self.assertEqual(await waiter, 'value')
+        self.assertEqual(inflight, {})
+
+    async def test_error_reaches_every_waiter(self):
+        inflight = {}
+
+        async def load():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('boom')
+
+        results = await asyncio.gather(
+            coalesce(inflight, 'key', load), coalesce(inflight, 'key', load), return_exceptions=True
+        )
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(inflight, {})
+
+
+class ResponseCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_get_or_fetch_caches_and_coalesces(self):
+        cache = ResponseCache()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'answer': 42}
+
+        results = await asyncio.gather(*(cache.get_or_fetch('key', fetch) for _ in range(3)))
+        self.assertEqual(results, [{'answer': 42}] * 3)
+        self.assertEqual(await cache.get_or_fetch('key', fetch), {'answer': 42})
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'coalesced': 2, 'size': 1})
+
+    async def test_cancelled_owner_still_fills_cache(self):
+        cache = ResponseCache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 'value'
+
+        owner = asyncio.create_task(cache.get_or_fetch('key', fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch('key', fetch))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        release.set()
+
+        self.assertEqual(await waiter, 'value')
+        self.assertEqual(await cache.get('key'), 'value')
+
+    async def test_none_not_cached(self):
+        cache = ResponseCache()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return None
+
+        self.assertIsNone(await cache.get_or_fetch('key', fetch))
+        self.assertIsNone(await cache.get_or_fetch('key', fetch))
+        self.assertEqual(len(calls), 2)
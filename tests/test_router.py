@@ -0,0 +1,112 @@
+import json
+import random
+import unittest
+
+from aiogram import types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+import render
+from db import Recommendation
+from main import FILM_DIALOG_PHRASES, FilmDialog
+from router import CallbackRouter, IntentRouter
+
+
+def keyboard_data(markup):
+    return [button['callback_data'] for row in json.loads(markup)['inline_keyboard'] for button in row]
+
+
+class IntentRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = IntentRouter(default='unknown_message')
+        self.router.add('film_dialog', FILM_DIALOG_PHRASES, 'start_film_dialog')
+
+    def test_matches_substring_search(self):
+        # Автомат по префиксному дереву совпадает с прямым перебором фраз
+        random.seed(0)
+        fragments = FILM_DIALOG_PHRASES + ['ф', 'ки', 'по', 'смо', 'ани', 'мульт', ' ', 'привет', 'ы', 'Ф', 'КИНО']
+        for _ in range(2000):
+            text = ''.join(random.choices(fragments, k=random.randint(0, 4)))
+            expected = 'film_dialog' if any(phrase in text.lower() for phrase in FILM_DIALOG_PHRASES) else None
+            self.assertEqual(self.router.match(text), expected, text)
+
+    def test_legacy_phrases_still_start_dialog(self):
+        # Прежний фильтр: any(phrase in message.text.lower() for phrase in [...])
+        legacy = ['фильм', 'кино', 'посмотреть', 'аниме']
+        texts = ['Посоветуй ФИЛЬМ', 'хочу в кино', 'что посмотреть?', 'аниме-сериал', 'мультфильм',
+                 'кинцо на вечер', 'посмотрю что-нибудь', 'привет', 'как дела', '']
+        for text in texts:
+            if any(phrase in text.lower() for phrase in legacy):
+                self.assertEqual(self.router.match(text), 'film_dialog', text)
+        self.assertIsNone(self.router.match('привет'))
+        self.assertIsNone(self.router.match(''))
+
+    def test_resolve_falls_back_to_default(self):
+        self.assertEqual(self.router.resolve(types.Message(text='Кино')), 'start_film_dialog')
+        self.assertEqual(self.router.resolve(types.Message(text='привет')), 'unknown_message')
+        # Сообщение без текста (фото, стикер)
+        self.assertEqual(self.router.resolve(types.Message()), 'unknown_message')
+
+    def test_first_phrase_in_text_wins(self):
+        self.router.add('help', ['помощь', 'помоги'], 'help')
+        self.assertEqual(self.router.match('помоги найти фильм'), 'help')
+        self.assertEqual(self.router.match('фильм, помоги'), 'film_dialog')
+
+
+class CallbackRouterTest(unittest.IsolatedAsyncioTestCase):
+
+    # Фильтры aiogram, которые заменил роутер: (обработчик, фильтр данных, состояние)
+    LEGACY = [
+        ('process_genre', lambda data: data.startswith('genre_'), FilmDialog.waiting_for_genre.state),
+        ('process_depth', lambda data: data.startswith('depth_'), FilmDialog.waiting_for_depth.state),
+        ('process_features', lambda data: data.startswith('feature_'), FilmDialog.waiting_for_features.state),
+        ('process_feedback', lambda data: data.startswith('feedback_'), FilmDialog.waiting_for_feedback.state),
+        ('more_recommendations', lambda data: data == 'more_recommendations', '*'),
+    ]
+
+    async def asyncSetUp(self):
+        self.calls = []
+        self.router = CallbackRouter()
+        for prefix, (name, _, state) in zip(['genre', 'depth', 'feature', 'feedback', 'more'], self.LEGACY):
+            self.router.add(prefix, self.handler(name), state=state)
+        self.storage = MemoryStorage()
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+
+    def handler(self, name):
+        async def handle(callback_query, state):
+            self.calls.append(name)
+        handle.__name__ = name
+        return handle
+
+    def legacy_dispatch(self, data, current_state):
+        for name, matches, state in self.LEGACY:
+            if matches(data) and state in ('*', current_state):
+                return name
+        return None
+
+    async def test_matches_legacy_filters(self):
+        card = Recommendation(7, 'Акира', 'sci-fi', 'deep', 'action', 'anime')
+        data = (
+            keyboard_data(render.GENRE_KEYBOARD) + keyboard_data(render.DEPTH_KEYBOARD)
+            + keyboard_data(render.FEATURE_KEYBOARD) + keyboard_data(render.MORE_KEYBOARD)
+            + keyboard_data(render.format_card(card)[1])
+            + ['genre', 'genres_comedy', 'unknown_value', '', '_genre']
+        )
+        states = [None] + [state.state for state in FilmDialog.states]
+        state = FSMContext(self.storage, chat=1, user=1)
+
+        for current_state in states:
+            await state.set_state(current_state)
+            for value in data:
+                self.calls.clear()
+                await self.router.dispatch(types.CallbackQuery(id='1', data=value), state)
+                expected = self.legacy_dispatch(value, current_state)
+                self.assertEqual(self.calls, [expected] if expected else [], (value, current_state))
+
+    def test_resolve_ignores_state(self):
+        resolved = self.router.resolve(types.CallbackQuery(id='1', data='feedback_like_7'))
+        self.assertEqual(resolved.__name__, 'process_feedback')
+        self.assertIsNone(self.router.resolve(types.CallbackQuery(id='1', data='feedback')))
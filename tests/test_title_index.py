@@ -0,0 +1,47 @@
+import unittest
+
+from title_index import TitleIndex, parse_titles
+
+CATALOG = {
+    1: 'Mission: Impossible',
+    2: 'Стальной алхимик: Братство',
+    3: 'Стальной алхимик',
+    4: 'Начало',
+    5: 'Ковбой Бибоп',
+}
+
+
+class ParseTitlesTest(unittest.TestCase):
+
+    def test_colon_kept_in_title(self):
+        text = (
+            '1. Mission: Impossible (1996) - шпионский боевик\n'
+            '2. Стальной алхимик: Братство — аниме о двух братьях\n'
+            '3. Ковбой Бибоп (1998)\n'
+        )
+        self.assertEqual(parse_titles(text), ['Mission: Impossible', 'Стальной алхимик: Братство', 'Ковбой Бибоп'])
+
+    def test_bold_and_quoted(self):
+        text = '- **Начало** (2010): фильм о снах\n- «Ковбой Бибоп» - космический вестерн\n'
+        self.assertEqual(parse_titles(text), ['Начало', 'Ковбой Бибоп'])
+
+
+class TitleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TitleIndex()
+        for content_id, title in CATALOG.items():
+            self.index.add(content_id, title)
+
+    def test_full_title_with_colon(self):
+        self.assertEqual(self.index.resolve('Mission: Impossible'), 1)
+        self.assertEqual(self.index.resolve('Стальной алхимик: Братство'), 2)
+
+    def test_description_after_colon(self):
+        self.assertEqual(self.index.resolve('Начало: фильм о краже идей из снов'), 4)
+
+    def test_fuzzy_transliteration(self):
+        self.assertEqual(self.index.resolve('Kovboy Bibop'), 5)
+
+    def test_unknown(self):
+        self.assertIsNone(self.index.resolve('Совсем другой фильм'))
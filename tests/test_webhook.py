@@ -0,0 +1,107 @@
+import asyncio
+import random
+import unittest
+import zlib
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import UpdateWorkerPool, create_webhook_app
+
+
+def message_update(update_id, chat_id):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': str(update_id),
+                    'chat': {'id': chat_id, 'type': 'private'}},
+    }
+
+
+class RecordingDispatcher(Dispatcher):
+    """Вместо обработчиков записывает порядок апдейтов и может придержать обработку."""
+
+    def __init__(self, delay=0.0):
+        super().__init__(Bot('123:test'))
+        self.delay = delay
+        self.processed = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def process_update(self, update):
+        await self.release.wait()
+        await asyncio.sleep(random.uniform(0, self.delay))
+        self.processed.append((update.message.chat.id, update.update_id))
+
+
+class UpdateWorkerPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_chat_order_preserved(self):
+        random.seed(0)
+        dispatcher = RecordingDispatcher(delay=0.003)
+        pool = UpdateWorkerPool(dispatcher, workers=3, queue_size=100)
+        pool.start()
+
+        chats = [101, 202, 303, 404, 505, 606]
+        # Чаты действительно разнесены по разным очередям
+        self.assertGreater(len({zlib.crc32(str(chat).encode()) % 3 for chat in chats}), 1)
+        updates = [types.Update(**message_update(update_id, chats[update_id % len(chats)])) for update_id in range(60)]
+        for update in updates:
+            self.assertTrue(await pool.submit(update))
+        await pool.drain()
+
+        self.assertEqual(len(dispatcher.processed), len(updates))
+        for chat in chats:
+            self.assertEqual(
+                [update_id for chat_id, update_id in dispatcher.processed if chat_id == chat],
+                [update.update_id for update in updates if update.message.chat.id == chat]
+            )
+
+    async def test_drain_processes_queued_updates(self):
+        dispatcher = RecordingDispatcher()
+        dispatcher.release.clear()
+        pool = UpdateWorkerPool(dispatcher, workers=2, queue_size=10)
+        pool.start()
+        for update_id in range(6):
+            await pool.submit(types.Update(**message_update(update_id, update_id)))
+
+        asyncio.get_running_loop().call_later(0.05, dispatcher.release.set)
+        await pool.drain(timeout=5)
+
+        self.assertEqual(sorted(update_id for _, update_id in dispatcher.processed), list(range(6)))
+        self.assertEqual(pool.pending, 0)
+        # После остановки новые апдейты не принимаются
+        self.assertFalse(await pool.submit(types.Update(**message_update(6, 1))))
+
+
+class WebhookAppTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.dispatcher = RecordingDispatcher()
+        app = create_webhook_app(self.dispatcher, workers=1, queue_size=1, enqueue_timeout=0.05)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        self.dispatcher.release.set()
+        await self.client.close()
+
+    async def test_full_queue_returns_503(self):
+        self.dispatcher.release.clear()
+        # Первый апдейт забирает обработчик, второй занимает единственное место в очереди
+        for update_id in range(2):
+            response = await self.client.post('/webhook', json=message_update(update_id, 1))
+            self.assertEqual(response.status, 200)
+            await asyncio.sleep(0)
+
+        response = await self.client.post('/webhook', json=message_update(2, 1))
+        self.assertEqual(response.status, 503)
+
+        self.dispatcher.release.set()
+        await self.client.app['update_pool'].drain(timeout=5)
+        self.assertEqual(self.dispatcher.processed, [(1, 0), (1, 1)])
+
+    async def test_malformed_body_returns_400(self):
+        for body in ('{"update_id": ', '[1, 2]', '"update"'):
+            response = await self.client.post('/webhook', data=body, headers={'Content-Type': 'application/json'})
+            self.assertEqual(response.status, 400)
+        self.assertEqual(self.client.app['update_pool'].pending, 0)
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import db
+from write_behind import DURABILITY_ASYNC, DURABILITY_SYNC, FeedbackWriter
+
+POISON_ID = 666
+
+
+class FakeDatabase:
+    """Подмена db.apply_feedback_batch: падает failures раз и всегда - на POISON_ID."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.written = []
+
+    async def apply_feedback_batch(self, events):
+        events = list(events)
+        self.batches.append(events)
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError('database is locked')
+        if any(event[1] == POISON_ID for event in events):
+            raise sqlite3.IntegrityError('poisoned event')
+        self.written.extend(events)
+        return {event[1]: 9.0 for event in events}
+
+
+class FeedbackWriterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dead_letter_path = os.path.join(self.directory.name, 'dead.jsonl')
+        self.database = FakeDatabase()
+        patcher = mock.patch.object(db, 'apply_feedback_batch', self.database.apply_feedback_batch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.flushed = []
+
+    async def asyncTearDown(self):
+        self.directory.cleanup()
+
+    def writer(self, durability=DURABILITY_SYNC, **kwargs):
+        return FeedbackWriter(flush_interval=0.01, durability=durability, on_flush=self.flushed.append,
+                              max_retry_delay=0.05, dead_letter_path=self.dead_letter_path, **kwargs)
+
+    def dead_letters(self):
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path, encoding='utf-8') as handle:
+            return [json.loads(line) for line in handle]
+
+    async def test_batches_concurrent_events(self):
+        writer = self.writer()
+
+        await asyncio.gather(*(writer.record(user_id, 1, 'like') for user_id in range(5)))
+
+        self.assertEqual(len(self.database.batches), 1)
+        self.assertEqual(len(self.database.written), 5)
+        self.assertEqual(self.flushed, [{1: 9.0}])
+        self.assertEqual(writer.pending_content_ids(0), set())
+
+    async def test_pending_until_written(self):
+        writer = self.writer(DURABILITY_ASYNC)
+
+        await writer.record(7, 3, 'dislike')
+        self.assertEqual(writer.pending_content_ids(7), {3})
+
+        await writer.close()
+        self.assertEqual(writer.pending_content_ids(7), set())
+        self.assertEqual(len(self.database.written), 1)
+
+    async def test_transient_error_retried_without_failing_waiter(self):
+        self.database.failures = 2
+        writer = self.writer()
+
+        with self.assertLogs(level='ERROR'):
+            await writer.record(1, 1, 'like')
+
+        self.assertEqual(len(self.database.batches), 3)
+        self.assertEqual(self.database.written, [self.database.batches[-1][0]])
+        self.assertEqual(writer.dead_letters, 0)
+        self.assertIsNone(writer._retry_delay)
+
+    async def test_poisoned_event_goes_to_dead_letter(self):
+        writer = self.writer()
+
+        results = await asyncio.gather(
+            writer.record(1, 1, 'like'), writer.record(2, POISON_ID, 'like'), writer.record(3, 2, 'dislike'),
+            return_exceptions=True
+        )
+
+        # Соседи по пачке записаны по одному, ошибку получил только автор испорченного отзыва
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertIsNone(results[2])
+        self.assertEqual(sorted(event[1] for event in self.database.written), [1, 2])
+
+        letters = self.dead_letters()
+        self.assertEqual([(letter['user_id'], letter['content_id']) for letter in letters], [(2, POISON_ID)])
+        self.assertEqual(letters[0]['attempts'], 3)
+        self.assertEqual(writer.dead_letters, 1)
+        self.assertEqual(writer.pending_content_ids(2), set())
+
+    async def test_retries_are_bounded(self):
+        self.database.failures = 100
+        writer = self.writer(DURABILITY_ASYNC)
+
+        with self.assertLogs(level='ERROR'):
+            await writer.record(1, 1, 'like')
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if writer.dead_letters and not writer._flush_tasks:
+                    break
+
+        # Три попытки в пачке и одна отдельная, потом журнал и никаких повторов
+        self.assertEqual(len(self.database.batches), 4)
+        self.assertEqual(len(self.dead_letters()), 1)
+        self.assertFalse(writer._events)
+        self.assertIsNone(writer._flush_handle)
+
+    async def test_close_dead_letters_unwritable_events(self):
+        self.database.failures = 100
+        writer = self.writer(DURABILITY_ASYNC, max_batch=1000)
+        for user_id in range(3):
+            await writer.record(user_id, 1, 'like')
+
+        with self.assertLogs(level='ERROR') as logs:
+            await writer.close()
+
+        self.assertEqual(len(self.dead_letters()), 3)
+        self.assertTrue(any('При остановке не записано отзывов: 3' in line for line in logs.output))
+
+
+class ApplyFeedbackBatchTest(unittest.TestCase):
+
+    def test_unknown_users_and_content_are_counted(self):
+        conn = sqlite3.connect(':memory:')
+        db.init_db(conn)
+        conn.execute("INSERT INTO users (user_id) VALUES (1)")
+        events = [
+            (1, 3, 'like', '2026-01-01T00:00:00'),
+            (1, 9999, 'like', '2026-01-01T00:00:01'),
+            (2, 3, 'dislike', '2026-01-01T00:00:02'),
+        ]
+
+        with self.assertLogs(level='WARNING') as logs:
+            ratings = db._apply_feedback_batch(conn, events)
+
+        self.assertEqual(list(ratings), [3])
+        self.assertIn('1 о неизвестном контенте, 1 от неизвестных пользователей', logs.output[0])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM user_interactions').fetchone()[0], 1)
+        conn.close()
@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+from collections import Counter
+
+import db
+
+# Транслитерация кириллицы, чтобы «Ковбой Бибоп» и «Kovboy Bibop» совпадали
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya'
+})
+
+NON_WORD = re.compile(r'[\W_]+')
+
+# Строка списка: «1. ...», «1) ...», «- ...», «* ...», «• ...»
+LIST_ITEM = re.compile(r'^\s*(?:\d+[.)]|[-*•])\s+(.+)$', re.MULTILINE)
+BOLD = re.compile(r'\*\*(.+?)\*\*|__(.+?)__')
+QUOTED = re.compile(r'«([^»]+)»|"([^"]+)"|“([^”]+)”')
+# Конец названия: год в скобках или тире перед описанием. Двоеточие бывает
+# частью названия («Миссия: невыполнима»), его обрабатывает TitleIndex.resolve
+TITLE_END = re.compile(r'\s*(?:\(|\s[-–—]\s)')
+
+
+def normalize_title(title):
+    """Приводит название к нижнему регистру латиницей без пунктуации."""
+    title = title.lower().translate(TRANSLIT)
+    return NON_WORD.sub(' ', title).strip()
+
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def parse_titles(text, limit=10):
+    """
+    Извлекает названия фильмов и аниме из ответа языковой модели.
+
+    Берет элементы нумерованных и маркированных списков; внутри элемента
+    предпочитает текст в **жирном** или в кавычках, иначе берет текст до
+    года в скобках или тире.
+
+    Args:
+        text (str): Ответ модели.
+        limit (int): Максимум названий.
+
+    Returns:
+        list: Названия в порядке появления без повторов.
+    """
+    if not text:
+        return []
+
+    titles = []
+    seen = set()
+    items = LIST_ITEM.findall(text) or QUOTED.findall(text)
+
+    for item in items:
+        if isinstance(item, tuple):
+            title = next((part for part in item if part), '')
+        else:
+            match = BOLD.search(item) or QUOTED.search(item)
+            if match:
+                title = next(part for part in match.groups() if part)
+            else:
+                title = TITLE_END.split(item, maxsplit=1)[0]
+
+        title = title.strip(' *_"«»“”.,;')
+        key = normalize_title(title)
+        if key and key not in seen:
+            seen.add(key)
+            titles.append(title)
+            if len(titles) >= limit:
+                break
+
+    return titles
+
+
+class TitleIndex:
+    """
+    Нечеткий индекс названий каталога по триграммам.
+
+    Точное совпадение нормализованного названия находится через словарь.
+    Иначе кандидаты отбираются по самым редким триграммам запроса и
+    ранжируются по коэффициенту Дайса, что допускает опечатки и разные
+    варианты транслитерации.
+
+    Индекс перестраивается, когда импорт каталога из другого процесса
+    меняет отпечаток db.catalog_stamp.
+
+    Args:
+        min_score (float): Минимальный коэффициент Дайса для совпадения.
+        max_candidates (int): Сколько кандидатов оценивать точно.
+        refresh_interval (float): Как часто проверять, менялся ли каталог, в секундах.
+    """
+
+    def __init__(self, min_score=0.5, max_candidates=32, refresh_interval=60):
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.refresh_interval = refresh_interval
+        self._exact = {}
+        self._titles = {}
+        self._postings = {}
+        self._stamp = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._load_lock = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def add(self, content_id, title):
+        key = normalize_title(title or '')
+        if not key:
+            return
+        self._exact.setdefault(key, content_id)
+        self._titles[content_id] = key
+        for gram in trigrams(key):
+            self._postings.setdefault(gram, []).append(content_id)
+
+    def resolve(self, title):
+        """
+        Находит ID контента по названию.
+
+        Сначала ищется название целиком, затем часть до первого двоеточия:
+        «Начало: фильм о снах» находится как «Начало», а «Mission: Impossible»
+        и «Стальной алхимик: Братство» - по полному названию.
+
+        Returns:
+            int: ID контента или None, если подходящего названия нет.
+        """
+        content_id = self._resolve(normalize_title(title))
+        if content_id is None and ':' in title:
+            content_id = self._resolve(normalize_title(title.split(':', 1)[0]))
+        return content_id
+
+    def _resolve(self, key):
+        if not key:
+            return None
+
+        content_id = self._exact.get(key)
+        if content_id is not None:
+            return content_id
+
+        query = trigrams(key)
+        grams = sorted((gram for gram in query if gram in self._postings), key=lambda gram: len(self._postings[gram]))
+        if not grams:
+            return None
+
+        # Кандидаты по половине самых редких триграмм: опечатка портит лишь
+        # несколько соседних триграмм, поэтому настоящий ответ почти всегда среди них
+        counts = Counter()
+        for gram in grams[:max(3, len(grams) // 2)]:
+            counts.update(self._postings[gram])
+
+        best_id, best_score = None, self.min_score
+        for candidate, _ in heapq.nlargest(self.max_candidates, counts.items(), key=lambda item: item[1]):
+            other = trigrams(self._titles[candidate])
+            score = 2 * len(query & other) / (len(query) + len(other))
+            if score > best_score:
+                best_id, best_score = candidate, score
+
+        return best_id
+
+    def load(self, conn):
+        """Полностью строит индекс по content.title."""
+        self._install(self._build(conn))
+
+    def _build(self, conn):
+        # Новый индекс собирается в потоке пула отдельно и подменяет текущий в event loop
+        index = TitleIndex(self.min_score, self.max_candidates)
+        stamp = db.catalog_stamp(conn)
+        for content_id, title in conn.execute('SELECT id, title FROM content ORDER BY rating DESC'):
+            index.add(content_id, title)
+        return stamp, index._exact, index._titles, index._postings
+
+    def _install(self, index):
+        self._stamp, self._exact, self._titles, self._postings = index
+        self._checked_at = time.monotonic()
+        self._loaded = True
+        logging.info(f"Индекс названий загружен: {len(self._titles)} записей")
+
+    def _build_if_changed(self, conn, stamp):
+        if db.catalog_stamp(conn) != stamp:
+            return self._build(conn)
+        return None
+
+    async def ensure_loaded(self):
+        """Загружает индекс при первом обращении и перестраивает его после импорта каталога."""
+        if self._loaded and time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                self._install(await db.pool.run(self._build))
+            elif time.monotonic() - self._checked_at >= self.refresh_interval:
+                self._checked_at = time.monotonic()
+                index = await db.pool.run(self._build_if_changed, self._stamp)
+                if index is not None:
+                    self._install(index)
+
+
+# Общий индекс названий процесса
+titles = TitleIndex()
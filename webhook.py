@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import zlib
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+
+def update_chat_id(update):
+    """Возвращает ID чата (или пользователя), к которому относится апдейт."""
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, name)
+        if message:
+            return message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for name in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        event = getattr(update, name)
+        if event:
+            chat = getattr(event, 'chat', None)
+            return chat.id if chat else event.from_user.id
+    return update.update_id
+
+
+class UpdateWorkerPool:
+    """
+    Ограниченный пул обработчиков апдейтов с сохранением порядка внутри чата.
+
+    Апдейты одного чата всегда попадают в одну и ту же очередь и
+    обрабатываются последовательно, а разные чаты обрабатываются
+    параллельно workers задачами. Размер каждой очереди ограничен, поэтому
+    при перегрузке прием новых апдейтов ждет освобождения места.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер aiogram.
+        workers (int): Число параллельных обработчиков.
+        queue_size (int): Максимум апдейтов в очереди одного обработчика.
+    """
+
+    def __init__(self, dispatcher, workers=8, queue_size=100):
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues = []
+        self._tasks = []
+        self.accepting = False
+
+    def start(self):
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        self.accepting = True
+
+    @property
+    def pending(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def submit(self, update, timeout=None):
+        """
+        Ставит апдейт в очередь его чата.
+
+        Args:
+            update (types.Update): Апдейт Telegram.
+            timeout (float, optional): Сколько ждать места в очереди.
+
+        Returns:
+            bool: False, если пул остановлен или очередь не освободилась вовремя.
+        """
+        if not self.accepting:
+            return False
+
+        # crc32 вместо hash(): одинаковое распределение во всех процессах
+        chat_id = update_chat_id(update)
+        queue = self._queues[zlib.crc32(str(chat_id).encode()) % self.workers]
+        try:
+            await asyncio.wait_for(queue.put(update), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _worker(self, queue):
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+
+        while True:
+            update = await queue.get()
+            try:
+                # Отдельная задача - отдельный контекст: контекстные переменные
+                # aiogram (текущее состояние, сообщение) не переходят между апдейтами
+                await asyncio.create_task(self.dispatcher.process_update(update))
+            except Exception as e:
+                logging.exception(f"Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def drain(self, timeout=30):
+        """Перестает принимать апдейты, дожидается обработки очередей и останавливает обработчики."""
+        self.accepting = False
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не дождались обработки {self.pending} апдейтов при остановке")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def create_webhook_app(dispatcher, path='/webhook', workers=8, queue_size=100,
+                       enqueue_timeout=5.0, secret_token=None, on_startup=None, on_shutdown=None):
+    """
+    Создает aiohttp-приложение, принимающее апдейты Telegram по вебхуку.
+
+    Ответ Telegram отправляется сразу после постановки апдейта в очередь.
+    Если очередь чата не освободилась за enqueue_timeout, возвращается 503,
+    и Telegram повторит доставку позже. Тело, которое не разбирается как
+    JSON-объект апдейта, отклоняется с 400.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер aiogram.
+        path (str): Путь вебхука.
+        workers (int): Число параллельных обработчиков.
+        queue_size (int): Максимум апдейтов в очереди одного обработчика.
+        enqueue_timeout (float): Сколько ждать места в очереди, в секундах.
+        secret_token (str, optional): Значение X-Telegram-Bot-Api-Secret-Token для проверки.
+        on_startup (callable, optional): Корутина, вызываемая с диспетчером при старте.
+        on_shutdown (callable, optional): Корутина, вызываемая с диспетчером при остановке.
+
+    Returns:
+        web.Application: Приложение aiohttp.
+    """
+    pool = UpdateWorkerPool(dispatcher, workers, queue_size)
+
+    async def handle_update(request):
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=403)
+
+        try:
+            update = types.Update(**(await request.json()))
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+        if not await pool.submit(update, enqueue_timeout):
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def startup(app):
+        pool.start()
+        if on_startup:
+            await on_startup(dispatcher)
+
+    async def shutdown(app):
+        await pool.drain()
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+
+    app = web.Application()
+    app['update_pool'] = pool
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def run_webhook(dispatcher, webhook_url, path='/webhook', host='0.0.0.0', port=8080, secret_token=None,
+                on_startup=None, on_shutdown=None, **options):
+    """
+    Регистрирует вебхук в Telegram и запускает aiohttp-сервер.
+
+    Неподтвержденные апдейты не сбрасываются: Telegram доставит их после перезапуска.
+    """
+    async def startup(dp):
+        await dp.bot.set_webhook(webhook_url, secret_token=secret_token)
+        if on_startup:
+            await on_startup(dp)
+
+    async def shutdown(dp):
+        if on_shutdown:
+            await on_shutdown(dp)
+        await dp.bot.close()
+
+    app = create_webhook_app(dispatcher, path, secret_token=secret_token,
+                             on_startup=startup, on_shutdown=shutdown, **options)
+    web.run_app(app, host=host, port=port)
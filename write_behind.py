@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import json
+import logging
+from collections import Counter
+
+import db
+
+# Режимы надежности записи отзывов
+DURABILITY_ASYNC = 'async'  # ответ сразу, запись в ближайшей пачке
+DURABILITY_SYNC = 'sync'  # ответ после фиксации пачки с этим отзывом
+
+# Отзывы, которые не удалось записать за все попытки, по одному JSON на строку
+DEAD_LETTER_PATH = 'feedback_dead_letter.jsonl'
+
+
+class FeedbackWriter:
+    """
+    Буфер отложенной записи отзывов (write-behind).
+
+    Отзывы копятся в памяти и записываются одной транзакцией через
+    db.apply_feedback_batch раз в flush_interval секунд или по достижении
+    max_batch событий, поэтому всплеск кликов не упирается в блокировку
+    записи SQLite. Пока пачка не записана, её отзывы видны через
+    pending_content_ids, а после записи новые рейтинги передаются в on_flush.
+
+    Неудачная пачка возвращается в буфер и повторяется с экспоненциальной
+    задержкой. Отзыв, не записанный за max_attempts попыток, пробуется
+    записать отдельно, чтобы одно испорченное событие не тянуло за собой
+    соседей по пачке, и при новой ошибке уходит в журнал dead_letter_path.
+
+    Args:
+        flush_interval (float): Максимальная задержка записи в секундах.
+        max_batch (int): Число событий, при котором запись начинается сразу.
+        durability (str): DURABILITY_ASYNC или DURABILITY_SYNC.
+        on_flush (callable, optional): Вызывается со словарем {content_id: rating}.
+        max_attempts (int): Сколько раз пытаться записать отзыв в составе пачки.
+        max_retry_delay (float): Предельная задержка повтора в секундах.
+        dead_letter_path (str, optional): Файл для незаписанных отзывов; None - только в лог.
+    """
+
+    def __init__(self, flush_interval=0.1, max_batch=500, durability=DURABILITY_ASYNC, on_flush=None,
+                 max_attempts=3, max_retry_delay=5.0, dead_letter_path=DEAD_LETTER_PATH):
+        if durability not in (DURABILITY_ASYNC, DURABILITY_SYNC):
+            raise ValueError(f"Неизвестный режим надежности: {durability}")
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.durability = durability
+        self.on_flush = on_flush
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay
+        self.dead_letter_path = dead_letter_path
+        # Элементы буфера: (событие, число неудачных попыток, future ожидающего или None)
+        self._events = []
+        self._pending = {}
+        self._flush_handle = None
+        self._flush_tasks = set()
+        self._flush_lock = None
+        self._retry_delay = None
+        self.dead_letters = 0
+
+    def pending_content_ids(self, user_id):
+        """ID контента, отзывы о котором пользователь оставил, но они еще не записаны."""
+        return set(self._pending.get(user_id, ()))
+
+    async def record(self, user_id, content_id, feedback):
+        """
+        Добавляет отзыв в буфер.
+
+        В режиме DURABILITY_SYNC ждет, пока отзыв будет записан. Повторы
+        после временных ошибок ожидающему не видны; исключение он получает,
+        только если отзыв в итоге ушел в журнал незаписанных.
+        """
+        timestamp = datetime.datetime.now().isoformat()
+        waiter = None
+        if self.durability == DURABILITY_SYNC:
+            waiter = asyncio.get_running_loop().create_future()
+
+        self._events.append(((user_id, content_id, feedback, timestamp), 0, waiter))
+        self._pending.setdefault(user_id, Counter())[content_id] += 1
+
+        # Во время повторов после ошибки пишем по расписанию, а не на каждый max_batch
+        if len(self._events) >= self.max_batch and self._retry_delay is None:
+            self._start_flush()
+        else:
+            self._schedule_flush(self.flush_interval)
+
+        if waiter is not None:
+            await waiter
+
+    def _schedule_flush(self, delay):
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _forget_pending(self, batch):
+        for (user_id, content_id, _, _), _, _ in batch:
+            pending = self._pending[user_id]
+            pending[content_id] -= 1
+            if pending[content_id] <= 0:
+                del pending[content_id]
+            if not pending:
+                del self._pending[user_id]
+
+    async def flush(self):
+        """Записывает накопленные отзывы одной транзакцией."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._events:
+                return
+
+            batch, self._events = self._events, []
+
+            try:
+                ratings = await db.apply_feedback_batch([event for event, _, _ in batch])
+            except Exception as e:
+                await self._handle_failure(batch, e)
+                return
+
+            self._retry_delay = None
+            self._finish(batch, ratings)
+
+    def _finish(self, batch, ratings):
+        self._forget_pending(batch)
+        for _, _, waiter in batch:
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+        if self.on_flush and ratings:
+            self.on_flush(ratings)
+
+    async def _handle_failure(self, batch, error):
+        retry = []
+        exhausted = []
+        for event, attempts, waiter in batch:
+            item = (event, attempts + 1, waiter)
+            (retry if attempts + 1 < self.max_attempts else exhausted).append(item)
+
+        logging.error(
+            f"Не удалось записать {len(batch)} отзывов: {error!r}; "
+            f"повторим {len(retry)}, отдельно попробуем {len(exhausted)}"
+        )
+
+        # Пачка могла упасть из-за одного события: исчерпавшие попытки пишем
+        # по одному, и в журнал попадают только те, что не записываются сами
+        poisoned = []
+        for item in exhausted:
+            try:
+                ratings = await db.apply_feedback_batch([item[0]])
+            except Exception as e:
+                poisoned.append((item, e))
+            else:
+                self._finish([item], ratings)
+
+        if poisoned:
+            await self._dead_letter(poisoned)
+
+        if retry:
+            # Возвращаем пачку в начало буфера и повторяем с экспоненциальной задержкой
+            self._events[:0] = retry
+            self._retry_delay = min(self.max_retry_delay, self.flush_interval * 2 ** max(item[1] for item in retry))
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._schedule_flush(self._retry_delay)
+
+    async def _dead_letter(self, poisoned):
+        self.dead_letters += len(poisoned)
+        self._forget_pending([item for item, _ in poisoned])
+
+        lines = []
+        for ((user_id, content_id, feedback, timestamp), attempts, waiter), error in poisoned:
+            logging.error(
+                f"Отзыв не записан после {attempts} попыток: user_id={user_id}, "
+                f"content_id={content_id}, feedback={feedback}: {error!r}"
+            )
+            lines.append(json.dumps({
+                'user_id': user_id, 'content_id': content_id, 'feedback': feedback,
+                'timestamp': timestamp, 'attempts': attempts, 'error': repr(error)
+            }, ensure_ascii=False))
+
+        if self.dead_letter_path:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._append_dead_letters, lines)
+            except OSError as e:
+                logging.error(f"Не удалось дописать журнал незаписанных отзывов {self.dead_letter_path}: {e}")
+
+        for (_, _, waiter), error in poisoned:
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(error)
+
+    def _append_dead_letters(self, lines):
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as handle:
+            handle.write('\n'.join(lines) + '\n')
+
+    async def close(self):
+        """
+        Записывает все оставшиеся отзывы перед остановкой.
+
+        Повторы идут без ожидания планировщика, пока каждый отзыв не будет
+        записан или не исчерпает попытки и не попадет в журнал незаписанных.
+        """
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+        dead_letters = self.dead_letters
+        while self._events:
+            await self.flush()
+            if self._events:
+                await asyncio.sleep(self._retry_delay or 0)
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self.dead_letters > dead_letters:
+            logging.error(
+                f"При остановке не записано отзывов: {self.dead_letters - dead_letters}; "
+                f"они сохранены в {self.dead_letter_path or 'лог'}"
+            )